@@ -0,0 +1,192 @@
+"""
+Produce Recognition System - Conversion Artifact Cache
+This module keeps converted model artifacts (ONNX, optimized and quantized
+ONNX, TensorRT engines, conversion reports) in a local content-addressed
+store, so conversion runs with unchanged inputs reuse them instead of
+rebuilding. Entries are evicted least recently used first once the cache
+exceeds its size budget.
+
+Run it as a script to list or prune a cache directory.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+from typing import Any, Callable, Dict, List, Optional
+
+META_FILE = "entry.json"
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-1 of a file's contents, read in chunks"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_tree(path: str) -> str:
+    """
+    SHA-1 over the relative path, size and mtime of every file under a directory
+
+    Cheap stand-in for hashing a dataset's contents: adding, removing,
+    relabelling (moving) or rewriting an image changes it.
+    """
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            stat = os.stat(file_path)
+            digest.update(f"{os.path.relpath(file_path, path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def make_key(**fields: Any) -> str:
+    """Cache key of a set of JSON-serializable build inputs"""
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+class ArtifactCache:
+    """Directory of immutable cache entries addressed by the hash of their build inputs"""
+
+    def __init__(self, cache_dir: str, max_bytes: Optional[int] = None):
+        """
+        Args:
+            cache_dir: Root directory of the cache
+            max_bytes: Size budget; least recently used entries are evicted beyond it
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key: str, filename: str) -> Optional[str]:
+        """Path of a cached artifact, or None on a miss"""
+        entry_dir = self._entry_dir(key)
+        path = os.path.join(entry_dir, filename)
+        if not os.path.exists(path):
+            return None
+        # The entry directory's mtime records when it was last used
+        os.utime(entry_dir)
+        return path
+
+    def put(self, key: str, src_path: str, fields: Optional[Dict[str, Any]] = None) -> str:
+        """Copy a built artifact into the cache and return its cached path"""
+        filename = os.path.basename(src_path)
+        entry_dir = self._entry_dir(key)
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+
+        # Fill a temporary directory and rename it, so readers never see partial entries
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+        shutil.copy2(src_path, os.path.join(tmp_dir, filename))
+        with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+            json.dump({"key": key, "file": filename, "created": time.time(),
+                       "fields": fields or {}}, f, indent=2)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another run stored the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.evict(keep=key)
+        return os.path.join(entry_dir, filename)
+
+    def get_or_build(self, key_fields: Dict[str, Any], filename: str,
+                     build: Callable[[str], Optional[str]], build_dir: str) -> Optional[str]:
+        """
+        Return the cached artifact for key_fields, building it on a miss
+
+        build receives the path to write to under build_dir and returns it,
+        or None when the artifact cannot be built here (nothing is cached then).
+        """
+        key = make_key(**key_fields)
+        cached = self.get(key, filename)
+        if cached is not None:
+            print(f"Cache hit for {filename} ({key[:12]})")
+            return cached
+
+        built = build(os.path.join(build_dir, filename))
+        if built is None:
+            return None
+        return self.put(key, built, key_fields)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Metadata, size and last use of every cache entry"""
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if prefix.startswith(".") or not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, key)
+                try:
+                    with open(os.path.join(entry_dir, META_FILE), "r") as f:
+                        meta = json.load(f)
+                    meta["size"] = _dir_size(entry_dir)
+                    meta["last_used"] = os.path.getmtime(entry_dir)
+                except OSError:
+                    continue
+                meta["path"] = entry_dir
+                entries.append(meta)
+        return entries
+
+    def evict(self, max_bytes: Optional[int] = None, keep: Optional[str] = None) -> int:
+        """Remove least recently used entries until the cache fits its budget; returns bytes freed"""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return 0
+
+        entries = sorted(self.entries(), key=lambda e: e["last_used"])
+        total = sum(e["size"] for e in entries)
+        freed = 0
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            if entry["key"] == keep:
+                continue
+            shutil.rmtree(entry["path"], ignore_errors=True)
+            total -= entry["size"]
+            freed += entry["size"]
+            print(f"Evicted {entry['file']} ({entry['key'][:12]}, {entry['size'] / 1e6:.1f} MB)")
+        return freed
+
+
+def main(args):
+    """List or prune an artifact cache"""
+    cache = ArtifactCache(args.cache_dir)
+
+    if args.max_gb is not None:
+        freed = cache.evict(max_bytes=int(args.max_gb * 1e9))
+        print(f"Freed {freed / 1e6:.1f} MB")
+
+    entries = sorted(cache.entries(), key=lambda e: e["last_used"], reverse=True)
+    for entry in entries:
+        last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_used"]))
+        print(f"{entry['key'][:12]}  {entry['file']:<28}{entry['size'] / 1e6:>10.1f} MB  last used {last_used}")
+    print(f"{len(entries)} entries, {sum(e['size'] for e in entries) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or prune the conversion artifact cache")
+    parser.add_argument("--cache_dir", type=str, required=True, help="Artifact cache directory")
+    parser.add_argument("--max_gb", type=float, default=None, help="Evict least recently used entries beyond this size")
+
+    args = parser.parse_args()
+
+    main(args)
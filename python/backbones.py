@@ -0,0 +1,180 @@
+"""
+Produce Recognition System - Backbone Registry
+This module is the single place that knows which classifier backbones are
+supported, how to build them with a produce classifier head and how to read
+their pooled features. Training, distillation and conversion all build models
+through it, and the architecture name is stored in every checkpoint.
+
+Run it as a script to benchmark the CPU inference latency, memory and
+parameter count of every registered backbone at the deployed resolution.
+"""
+
+import json
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+# Architecture name (torchvision model name) -> metadata
+BACKBONES: Dict[str, Dict] = {
+    "convnext_tiny": {"display_name": "ConvNeXt-Tiny", "family": "convnext"},
+    "convnext_small": {"display_name": "ConvNeXt-Small", "family": "convnext"},
+    "convnext_base": {"display_name": "ConvNeXt-Base", "family": "convnext"},
+    "convnext_large": {"display_name": "ConvNeXt-Large", "family": "convnext"},
+    "efficientnet_b0": {"display_name": "EfficientNet-B0", "family": "efficientnet"},
+    "efficientnet_b2": {"display_name": "EfficientNet-B2", "family": "efficientnet"},
+    "efficientnet_v2_s": {"display_name": "EfficientNetV2-S", "family": "efficientnet"},
+    "mobilenet_v3_small": {"display_name": "MobileNetV3-Small", "family": "mobilenet"},
+    "mobilenet_v3_large": {"display_name": "MobileNetV3-Large", "family": "mobilenet"},
+}
+
+DEFAULT_ARCH = "convnext_large"
+
+
+def get_backbone_spec(arch: str) -> Dict:
+    """Registry entry of an architecture"""
+    if arch not in BACKBONES:
+        raise ValueError(f"Unknown backbone '{arch}'. Available: {', '.join(BACKBONES)}")
+    return BACKBONES[arch]
+
+
+def build_backbone(arch: str, num_classes: int, pretrained: bool = True,
+                   mlp_hidden_dims: Optional[List[int]] = None) -> nn.Module:
+    """
+    Build a registered backbone with a num_classes classifier head
+
+    mlp_hidden_dims (recorded in pruned checkpoints) resizes the ConvNeXt
+    block MLPs so the pruned state dict can be loaded.
+    """
+    from torchvision.models import get_model
+
+    get_backbone_spec(arch)
+    model = get_model(arch, weights="DEFAULT" if pretrained else None)
+
+    # Every registered family ends its classifier with a Linear layer
+    in_features = model.classifier[-1].in_features
+    model.classifier[-1] = nn.Linear(in_features, num_classes)
+
+    if mlp_hidden_dims is not None:
+        resize_mlp_hidden_dims(model, mlp_hidden_dims)
+
+    return model
+
+
+def convnext_mlps(model: nn.Module) -> Iterator[Tuple[nn.Sequential, int, int]]:
+    """(block sequential, fc1 index, fc2 index) of every ConvNeXt block's MLP"""
+    from torchvision.models.convnext import CNBlock
+
+    for module in model.modules():
+        if isinstance(module, CNBlock):
+            # depthwise conv, permute, LayerNorm, Linear(dim, hidden), GELU, Linear(hidden, dim), permute
+            yield module.block, 3, 5
+
+
+def mlp_hidden_dims(model: nn.Module) -> List[int]:
+    """Hidden width of every ConvNeXt block MLP"""
+    return [block[fc1].out_features for block, fc1, _ in convnext_mlps(model)]
+
+
+def resize_mlp_hidden_dims(model: nn.Module, hidden_dims: List[int]):
+    """Replace the ConvNeXt block MLPs with (uninitialized) layers of the given hidden widths"""
+    mlps = list(convnext_mlps(model))
+    if len(mlps) != len(hidden_dims):
+        raise ValueError(f"Expected {len(mlps)} MLP hidden dims, got {len(hidden_dims)}")
+    for (block, fc1, fc2), hidden in zip(mlps, hidden_dims):
+        dim = block[fc1].in_features
+        block[fc1] = nn.Linear(dim, hidden)
+        block[fc2] = nn.Linear(hidden, dim)
+
+
+def feature_dim(model: nn.Module) -> int:
+    """Size of the pooled features feeding the classifier head"""
+    return model.classifier[-1].in_features
+
+
+def head_prefix(model: nn.Module) -> str:
+    """State dict key prefix of the classifier head"""
+    return f"classifier.{len(model.classifier) - 1}."
+
+
+def pooled_features(model: nn.Module, images: torch.Tensor) -> torch.Tensor:
+    """Pooled backbone features, i.e. the input of classifier[-1]"""
+    from torchvision.models import ConvNeXt
+
+    x = model.avgpool(model.features(images))
+    # ConvNeXt flattens inside its classifier (after LayerNorm2d); the others flatten first
+    if not isinstance(model, ConvNeXt):
+        x = torch.flatten(x, 1)
+    return model.classifier[:-1](x)
+
+
+def imagenet_accuracy(arch: str) -> float:
+    """Published ImageNet-1K top-1 of the pretrained torchvision weights"""
+    from torchvision.models import get_model_weights
+    weights = get_model_weights(arch).DEFAULT
+    return weights.meta["_metrics"]["ImageNet-1K"]["acc@1"]
+
+
+def benchmark_backbones(archs: List[str], resolution: int = 224, batch_size: int = 1,
+                        runs: int = 20, num_classes: int = 100) -> List[Dict]:
+    """CPU latency, peak memory and parameter count of each backbone"""
+    from benchmark_pipeline import time_calls
+
+    results = []
+    for arch in archs:
+        model = build_backbone(arch, num_classes=num_classes, pretrained=False).eval()
+        params = sum(p.numel() for p in model.parameters())
+        inputs = [torch.randn(batch_size, 3, resolution, resolution) for _ in range(runs)]
+
+        with torch.inference_mode():
+            stats = time_calls(model, inputs, items_per_call=batch_size, warmup=3)
+
+        results.append({
+            "arch": arch,
+            "display_name": BACKBONES[arch]["display_name"],
+            "params_m": params / 1e6,
+            "resolution": resolution,
+            "batch_size": batch_size,
+            "latency_p50_ms": stats["p50_ms"],
+            "latency_p99_ms": stats["p99_ms"],
+            "images_per_sec": stats["images_per_sec"],
+            "peak_rss_mb": stats["peak_rss_mb"],
+            "imagenet_top1": imagenet_accuracy(arch),
+        })
+        print(f"{arch}: {stats['p50_ms']:.1f} ms p50, {params / 1e6:.1f}M params")
+        del model
+
+    return results
+
+
+def main(args):
+    """Benchmark the registered backbones and print a latency/accuracy table"""
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    results = benchmark_backbones(args.archs, args.resolution, args.batch_size, args.runs)
+
+    print(f"{'backbone':<22}{'params M':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}{'IN top-1':>10}")
+    for r in sorted(results, key=lambda r: r["latency_p50_ms"]):
+        print(f"{r['arch']:<22}{r['params_m']:>10.1f}{r['latency_p50_ms']:>10.1f}"
+              f"{r['latency_p99_ms']:>10.1f}{r['peak_rss_mb']:>10.0f}{r['imagenet_top1']:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"threads": torch.get_num_threads(), "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark registered backbones on CPU")
+    parser.add_argument("--archs", type=str, nargs="+", default=list(BACKBONES), choices=list(BACKBONES), help="Backbones to benchmark")
+    parser.add_argument("--resolution", type=int, default=224, help="Input resolution of the deployed model")
+    parser.add_argument("--batch_size", type=int, default=1, help="Batch size")
+    parser.add_argument("--runs", type=int, default=20, help="Timed runs per backbone")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--output", type=str, default=None, help="Optional JSON output file")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,282 @@
+"""
+Produce Recognition System - Training Pipeline Benchmark
+This script measures each stage of the training input pipeline (JPEG decoding,
+SAM masks, transforms, host-to-device copies, forward/backward) on its own and
+then end to end, and writes a JSON report that can be compared across versions.
+Runs CPU-only on a synthetic dataset unless a dataset directory is given.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import numpy as np
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+def reset_peak_memory():
+    """Reset the peak resident set size of this process (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_memory_mb() -> float:
+    """Peak resident set size since the last reset_peak_memory()"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(latencies_s: List[float], items_per_call: int = 1) -> Dict[str, float]:
+    """Throughput and latency percentiles of a list of per-call durations"""
+    latencies = np.array(latencies_s, dtype=np.float64)
+    total = float(latencies.sum())
+    return {
+        "calls": len(latencies),
+        "images": len(latencies) * items_per_call,
+        "images_per_sec": len(latencies) * items_per_call / total if total > 0 else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000) if len(latencies) else 0.0,
+        "p99_ms": float(np.percentile(latencies, 99) * 1000) if len(latencies) else 0.0,
+        "mean_ms": float(latencies.mean() * 1000) if len(latencies) else 0.0,
+    }
+
+
+def time_calls(fn: Callable, inputs: Iterable, items_per_call: int = 1, warmup: int = 1) -> Dict[str, float]:
+    """Time fn on every input after a few warmup calls, tracking peak memory"""
+    inputs = list(inputs)
+    for item in inputs[:warmup]:
+        fn(item)
+
+    reset_peak_memory()
+    latencies = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+
+    result = summarize(latencies, items_per_call)
+    result["peak_rss_mb"] = peak_memory_mb()
+    return result
+
+
+class TimedLoader:
+    """Wraps a loader and records the time between consecutive batches"""
+
+    def __init__(self, loader, batch_size: int):
+        self.loader = loader
+        self.batch_size = batch_size
+        self.latencies: List[float] = []
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        last = time.perf_counter()
+        for batch in self.loader:
+            yield batch
+            # Covers the consumer's step plus fetching the next batch
+            now = time.perf_counter()
+            self.latencies.append(now - last)
+            last = now
+
+
+def make_synthetic_dataset(root: str, num_classes: int, images_per_class: int,
+                           size: int = 1024, splits=("train", "val")) -> str:
+    """Write random-noise JPEGs in the ProduceDataset directory layout"""
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    for split in splits:
+        for c in range(num_classes):
+            class_dir = os.path.join(root, split, f"class_{c:03d}")
+            os.makedirs(class_dir, exist_ok=True)
+            for i in range(images_per_class):
+                pixels = rng.integers(0, 256, size=(size * 3 // 4, size, 3), dtype=np.uint8)
+                Image.fromarray(pixels).save(os.path.join(class_dir, f"{i:05d}.jpg"), quality=90)
+    return root
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def run_benchmark(args) -> Dict:
+    """Run every stage and return the report"""
+    import tempfile
+    import torch
+    import torch.nn as nn
+    import torch.optim as optim
+    from PIL import Image
+    from torch.utils.data import DataLoader, Subset
+    from train_produce_model import (ProduceDataset, BatchAugmentation, build_model,
+                                     build_train_transform, train_one_epoch)
+    from precompute_sam_masks import MaskStore, hash_image_bytes, largest_mask
+
+    torch.set_num_threads(args.threads or torch.get_num_threads())
+    device = torch.device(args.device)
+
+    tmp_dir = None
+    data_dir = args.data_dir
+    if data_dir is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        data_dir = make_synthetic_dataset(tmp_dir.name, args.synthetic_classes,
+                                          args.synthetic_images_per_class,
+                                          splits=("train",))
+        print(f"Synthetic dataset written to {data_dir}")
+
+    dataset = ProduceDataset(data_dir=data_dir, split="train", shard_dir=args.shard_dir,
+                             manifest_dir=args.manifest_dir)
+    rng = np.random.default_rng(0)
+    indices = rng.permutation(len(dataset))[:args.num_images].tolist()
+    stages: Dict[str, Dict] = {}
+
+    # Stage: JPEG decoding (or shard reads)
+    def decode(idx):
+        if dataset.shards is not None:
+            return Image.fromarray(dataset.shards.get_image(idx))
+        return Image.open(dataset.samples[idx]).convert('RGB')
+    stages["decode"] = time_calls(decode, indices)
+    images = [decode(idx) for idx in indices]
+    print(f"decode: {stages['decode']['images_per_sec']:.1f} img/s")
+
+    # Stage: SAM masks, from a precomputed store or generated live
+    if args.sam_mask_store:
+        store = MaskStore(args.sam_mask_store)
+        def read_mask(idx):
+            if dataset.shards is not None:
+                return store.get(dataset.shards.hashes[idx].decode())
+            with open(dataset.samples[idx], 'rb') as f:
+                return store.get(hash_image_bytes(f.read()))
+        stages["sam_masks"] = time_calls(read_mask, indices)
+    elif args.sam_checkpoint:
+        from train_produce_model import load_sam_model
+        mask_generator = load_sam_model("vit_h", args.sam_checkpoint)
+        subset = [np.array(image) for image in images[:args.sam_images]]
+        stages["sam_masks"] = time_calls(lambda image: largest_mask(mask_generator, image), subset)
+    if "sam_masks" in stages:
+        print(f"sam_masks: {stages['sam_masks']['images_per_sec']:.2f} img/s")
+
+    # Stage: per-image train transform, and the batched alternative
+    train_transform = build_train_transform()
+    stages["transform"] = time_calls(train_transform, images)
+    print(f"transform: {stages['transform']['images_per_sec']:.1f} img/s")
+
+    crop_transform = build_train_transform(batch_augment=True)
+    uint8_batches = []
+    for start in range(0, len(images) - args.batch_size + 1, args.batch_size):
+        uint8_batches.append(torch.stack([crop_transform(image) for image in images[start:start + args.batch_size]]))
+    if uint8_batches:
+        batch_augment = BatchAugmentation().to(device)
+        stages["batch_augment"] = time_calls(lambda batch: batch_augment(batch.to(device)),
+                                             uint8_batches, items_per_call=args.batch_size)
+        print(f"batch_augment: {stages['batch_augment']['images_per_sec']:.1f} img/s")
+
+    # Stage: host-to-device copies
+    float_batches = [torch.randn(args.batch_size, 3, 224, 224) for _ in range(args.steps)]
+    if device.type == "cuda":
+        float_batches = [batch.pin_memory() for batch in float_batches]
+    def copy(batch):
+        batch.to(device, non_blocking=True)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+    stages["host_to_device"] = time_calls(copy, float_batches, items_per_call=args.batch_size)
+
+    # Stage: train_one_epoch alone on in-memory batches
+    model = build_model(num_classes=len(dataset.classes), pretrained=False).to(device)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.AdamW(model.parameters(), lr=1e-4)
+    labels = torch.zeros(args.batch_size, dtype=torch.long)
+    synthetic_batches = [(batch, labels, torch.zeros(1)) for batch in float_batches]
+    train_one_epoch(model, synthetic_batches[:1], criterion, optimizer, device)
+    reset_peak_memory()
+    timed = TimedLoader(synthetic_batches, args.batch_size)
+    train_one_epoch(model, timed, criterion, optimizer, device)
+    stages["forward_backward"] = summarize(timed.latencies, args.batch_size)
+    stages["forward_backward"]["peak_rss_mb"] = peak_memory_mb()
+    print(f"forward_backward: {stages['forward_backward']['images_per_sec']:.2f} img/s")
+
+    # End to end: DataLoader over ProduceDataset into train_one_epoch
+    dataset.transform = train_transform
+    loader = DataLoader(Subset(dataset, indices[:args.batch_size * args.steps]),
+                        batch_size=args.batch_size, shuffle=False,
+                        num_workers=args.num_workers, drop_last=True)
+    reset_peak_memory()
+    timed = TimedLoader(loader, args.batch_size)
+    train_one_epoch(model, timed, criterion, optimizer, device)
+    stages["end_to_end"] = summarize(timed.latencies, args.batch_size)
+    stages["end_to_end"]["peak_rss_mb"] = peak_memory_mb()
+    print(f"end_to_end: {stages['end_to_end']['images_per_sec']:.2f} img/s")
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "git_revision": git_revision(),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "device": str(device),
+        },
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "stages": stages,
+    }
+
+
+def main(args):
+    """Run the benchmark and write the report"""
+    report = run_benchmark(args)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'stage':<18}{'img/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}")
+    for name, stage in report["stages"].items():
+        print(f"{name:<18}{stage['images_per_sec']:>10.2f}{stage['p50_ms']:>10.2f}"
+              f"{stage['p99_ms']:>10.2f}{stage.get('peak_rss_mb', 0):>10.0f}")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the produce training pipeline")
+    parser.add_argument("--data_dir", type=str, default=None, help="Dataset to sample from (default: synthetic)")
+    parser.add_argument("--shard_dir", type=str, default=None, help="Benchmark reads from dataset shards")
+    parser.add_argument("--manifest_dir", type=str, default=None, help="Directory of dataset manifests")
+    parser.add_argument("--sam_mask_store", type=str, default=None, help="Benchmark reads from a precomputed mask store")
+    parser.add_argument("--sam_checkpoint", type=str, default=None, help="Benchmark live SAM mask generation")
+    parser.add_argument("--sam_images", type=int, default=2, help="Images for the live SAM stage")
+    parser.add_argument("--synthetic_classes", type=int, default=4, help="Classes in the synthetic dataset")
+    parser.add_argument("--synthetic_images_per_class", type=int, default=16, help="Images per synthetic class")
+    parser.add_argument("--num_images", type=int, default=64, help="Images sampled for the per-image stages")
+    parser.add_argument("--batch_size", type=int, default=8, help="Batch size")
+    parser.add_argument("--steps", type=int, default=4, help="Training steps for the batched stages")
+    parser.add_argument("--num_workers", type=int, default=2, help="DataLoader workers for the end-to-end stage")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--device", type=str, default="cpu", help="Device for the model stages")
+    parser.add_argument("--output", type=str, default="benchmark_report.json", help="Output JSON report")
+
+    args = parser.parse_args()
+
+    main(args)
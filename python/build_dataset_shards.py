@@ -0,0 +1,166 @@
+"""
+Produce Recognition System - Dataset Shard Builder
+This script decodes every image of a dataset split once, resizes it to a
+fixed short side and packs the uint8 pixels into memory-mappable shard files,
+so training no longer decodes full-size JPEGs on every epoch.
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+from typing import List, Optional, Tuple
+
+META_FILE = "meta.json"
+INDEX_FILE = "index.npz"
+
+
+class ShardStore:
+    """Read-only view over the uint8 image shards of one dataset split"""
+
+    def __init__(self, split_dir: str):
+        """
+        Args:
+            split_dir: Directory holding the shards of one split
+        """
+        self.split_dir = split_dir
+
+        with open(os.path.join(split_dir, META_FILE), "r") as f:
+            self.meta = json.load(f)
+        self.classes: List[str] = self.meta["classes"]
+
+        index = np.load(os.path.join(split_dir, INDEX_FILE))
+        self.shard_ids = index["shard"]
+        self.offsets = index["offset"]
+        self.heights = index["height"]
+        self.widths = index["width"]
+        self.labels = index["labels"]
+        self.hashes = index["hashes"]
+
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getstate__(self):
+        # Memory maps are reopened lazily in each DataLoader worker
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def _shard(self, shard_id: int) -> np.memmap:
+        shard = self._shards.get(shard_id)
+        if shard is None:
+            path = os.path.join(self.split_dir, self.meta["shard_files"][shard_id])
+            shard = np.memmap(path, dtype=np.uint8, mode="r")
+            self._shards[shard_id] = shard
+        return shard
+
+    def get_image(self, idx: int) -> np.ndarray:
+        """Return a zero-copy HWC uint8 view of an image"""
+        height, width = int(self.heights[idx]), int(self.widths[idx])
+        offset = int(self.offsets[idx])
+        shard = self._shard(int(self.shard_ids[idx]))
+        return shard[offset:offset + height * width * 3].reshape(height, width, 3)
+
+
+def decode_and_resize(job: Tuple[str, int]) -> Tuple[np.ndarray, str]:
+    """Decode an image and resize it so its short side matches short_side"""
+    import io
+    from PIL import Image
+    from precompute_sam_masks import hash_image_bytes
+
+    img_path, short_side = job
+    with open(img_path, "rb") as f:
+        data = f.read()
+
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    scale = short_side / min(width, height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    # Let the JPEG decoder downscale by a power of two before resizing
+    image.draft('RGB', size)
+    image = image.convert('RGB')
+    if image.size != size:
+        image = image.resize(size, Image.BILINEAR)
+
+    return np.asarray(image, dtype=np.uint8), hash_image_bytes(data)
+
+
+def build_split(data_dir: str, output_dir: str, split: str, short_side: int,
+                images_per_shard: int, num_workers: int, manifest_dir: Optional[str] = None) -> str:
+    """Pack one dataset split into shard files and return its directory"""
+    from multiprocessing import Pool
+    from train_produce_model import ProduceDataset
+
+    dataset = ProduceDataset(data_dir=data_dir, split=split, manifest_dir=manifest_dir)
+    split_dir = os.path.join(output_dir, split)
+    os.makedirs(split_dir, exist_ok=True)
+
+    num_samples = len(dataset.samples)
+    shard_ids = np.zeros(num_samples, dtype=np.int32)
+    offsets = np.zeros(num_samples, dtype=np.int64)
+    heights = np.zeros(num_samples, dtype=np.int32)
+    widths = np.zeros(num_samples, dtype=np.int32)
+    labels = np.array([dataset.class_to_idx[p.parent.name] for p in dataset.samples], dtype=np.int64)
+    hashes = []
+    shard_files = []
+
+    jobs = [(str(p), short_side) for p in dataset.samples]
+    shard = None
+    with Pool(num_workers) as pool:
+        for i, (image, key) in enumerate(pool.imap(decode_and_resize, jobs, chunksize=16)):
+            if i % images_per_shard == 0:
+                if shard is not None:
+                    shard.close()
+                shard_files.append(f"shard_{len(shard_files):05d}.bin")
+                shard = open(os.path.join(split_dir, shard_files[-1]), "wb")
+
+            shard_ids[i] = len(shard_files) - 1
+            offsets[i] = shard.tell()
+            heights[i], widths[i] = image.shape[:2]
+            hashes.append(key)
+            shard.write(image.tobytes())
+
+            if (i + 1) % 1000 == 0:
+                print(f"[{split}] packed {i + 1}/{num_samples} images")
+    if shard is not None:
+        shard.close()
+
+    np.savez(os.path.join(split_dir, INDEX_FILE), shard=shard_ids, offset=offsets,
+             height=heights, width=widths, labels=labels,
+             hashes=np.array(hashes, dtype="S40"))
+    with open(os.path.join(split_dir, META_FILE), "w") as f:
+        json.dump({
+            "classes": dataset.classes,
+            "short_side": short_side,
+            "num_samples": num_samples,
+            "shard_files": shard_files,
+        }, f, indent=2)
+
+    print(f"[{split}] {num_samples} images packed into {len(shard_files)} shards in {split_dir}")
+    return split_dir
+
+
+def main(args):
+    """Build shards for every requested split"""
+    os.makedirs(args.output_dir, exist_ok=True)
+    for split in args.splits:
+        build_split(args.data_dir, args.output_dir, split, args.short_side,
+                    args.images_per_shard, args.num_workers, args.manifest_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack produce dataset splits into pre-resized shards")
+    parser.add_argument("--data_dir", type=str, required=True, help="Path to dataset directory")
+    parser.add_argument("--output_dir", type=str, required=True, help="Output directory for shard files")
+    parser.add_argument("--splits", type=str, nargs="+", default=["train", "val"], help="Dataset splits to pack")
+    parser.add_argument("--short_side", type=int, default=256, help="Short side of the stored images")
+    parser.add_argument("--images_per_shard", type=int, default=5000, help="Images per shard file")
+    parser.add_argument("--num_workers", type=int, default=4, help="Number of decoding processes")
+    parser.add_argument("--manifest_dir", type=str, default=None, help="Directory of dataset manifests (see dataset_manifest.py)")
+
+    args = parser.parse_args()
+
+    main(args)
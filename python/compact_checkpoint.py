@@ -0,0 +1,181 @@
+"""
+Produce Recognition System - Compact Weights Checkpoint
+This module implements an export-oriented checkpoint format: model weights
+only (optionally stored as fp16) behind a small JSON header with the
+architecture and class mapping. Tensors are 64-byte aligned in one flat file,
+so loading memory-maps it and hands out tensor views without reading or
+copying anything up front; pages are read when a tensor is first used.
+
+Layout: 8-byte magic, little-endian uint64 header length, JSON header,
+padding, tensor data (offsets in the header are relative to the data start).
+
+Run it as a script to convert a training checkpoint (.pth) to this format.
+"""
+
+import os
+import json
+import struct
+import argparse
+import numpy as np
+from typing import Any, Dict, Optional, Tuple
+
+MAGIC = b"PRODWTS1"
+ALIGNMENT = 64
+WEIGHTS_SUFFIX = ".weights"
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _to_numpy(tensor, half: bool) -> np.ndarray:
+    """Contiguous numpy copy of a tensor (or array), optionally with floats as fp16"""
+    if hasattr(tensor, "detach"):
+        import torch
+        tensor = tensor.detach().cpu().contiguous()
+        if half and tensor.is_floating_point():
+            tensor = tensor.half()
+        elif tensor.dtype == torch.bfloat16:
+            # numpy has no bfloat16
+            tensor = tensor.float()
+        return tensor.numpy()
+    array = np.ascontiguousarray(tensor)
+    if half and np.issubdtype(array.dtype, np.floating):
+        array = array.astype(np.float16)
+    return array
+
+
+def is_compact_checkpoint(path: str) -> bool:
+    """Whether a file is a compact weights checkpoint"""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save_compact_checkpoint(path: str, state_dict: Dict[str, Any],
+                            metadata: Optional[Dict[str, Any]] = None, half: bool = False) -> str:
+    """
+    Write a state dict and JSON-serializable metadata (arch, class_to_idx, ...)
+
+    With half=True floating point tensors are stored as fp16. The file is
+    written to a temporary path and renamed into place.
+    """
+    arrays = {name: _to_numpy(tensor, half) for name, tensor in state_dict.items()}
+
+    tensors = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        tensors[name] = {"dtype": array.dtype.name, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+
+    header = dict(metadata or {})
+    header["tensors"] = tensors
+    header["storage_dtype"] = "float16" if half else "float32"
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + tensors[name]["offset"])
+            f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def read_header(path: str) -> Tuple[Dict[str, Any], int]:
+    """JSON header of a compact checkpoint and the file offset of its tensor data"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a compact weights checkpoint")
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    return header, _align(len(MAGIC) + 8 + header_len)
+
+
+def load_compact_arrays(path: str) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """Memory-mapped numpy views of every tensor, plus the header"""
+    header, data_start = read_header(path)
+    # Copy-on-write mapping: views are writable without touching the file
+    data = np.memmap(path, dtype=np.uint8, mode="c")
+
+    arrays = {}
+    for name, info in header["tensors"].items():
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"], dtype=np.int64))
+        start = data_start + info["offset"]
+        arrays[name] = data[start:start + count * dtype.itemsize].view(dtype).reshape(info["shape"])
+    return arrays, header
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    """
+    Load a compact weights checkpoint or a torch checkpoint as a checkpoint dict
+
+    Compact checkpoints come back with their header fields and a
+    'model_state_dict' of memory-mapped tensors; torch checkpoints are
+    memory-mapped too when their format allows it.
+    """
+    import torch
+
+    if not is_compact_checkpoint(path):
+        try:
+            return torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+        except RuntimeError:
+            # Legacy (non-zip) torch checkpoints cannot be memory-mapped
+            return torch.load(path, map_location="cpu", weights_only=False)
+
+    arrays, header = load_compact_arrays(path)
+    checkpoint = {k: v for k, v in header.items() if k != "tensors"}
+    checkpoint["model_state_dict"] = {name: torch.from_numpy(array) for name, array in arrays.items()}
+    return checkpoint
+
+
+def load_model_weights(model, state_dict: Dict[str, Any], dtype=None):
+    """
+    Load weights into a model built on the meta device, adopting the tensors without copying
+
+    Tensors stored in another precision (fp16 checkpoints) are converted to
+    dtype, float32 by default.
+    """
+    import torch
+
+    dtype = dtype or torch.float32
+    model.load_state_dict(state_dict, assign=True)
+    if any(p.dtype != dtype for p in model.parameters() if p.is_floating_point()):
+        model.to(dtype)
+    return model
+
+
+def weights_path_for(checkpoint_path: str) -> str:
+    """Compact checkpoint path next to a .pth checkpoint"""
+    return os.path.splitext(checkpoint_path)[0] + WEIGHTS_SUFFIX
+
+
+def main(args):
+    """Convert a training checkpoint to a compact weights checkpoint"""
+    checkpoint = load_checkpoint(args.input)
+    metadata = {k: checkpoint[k] for k in ("arch", "class_to_idx", "mlp_hidden_dims", "epoch", "val_acc")
+                if k in checkpoint}
+
+    output = args.output or weights_path_for(args.input)
+    save_compact_checkpoint(output, checkpoint["model_state_dict"], metadata, half=args.fp16)
+    print(f"{args.input} ({os.path.getsize(args.input) / 1e6:.1f} MB) -> "
+          f"{output} ({os.path.getsize(output) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a checkpoint to the compact weights format")
+    parser.add_argument("--input", type=str, required=True, help="Training checkpoint (.pth)")
+    parser.add_argument("--output", type=str, default=None, help="Output path (default: <input>.weights)")
+    parser.add_argument("--fp16", action="store_true", help="Store floating point weights as fp16")
+
+    args = parser.parse_args()
+
+    main(args)
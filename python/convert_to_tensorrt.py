@@ -6,51 +6,169 @@ for optimized inference on edge devices like Raspberry Pi with GPU acceleration.
 """
 
 import os
+import json
+import shutil
+import hashlib
 import torch
 import argparse
 import numpy as np
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, List, Optional
 
 # For ONNX conversion
 import onnx
 import onnxruntime
+from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                      quant_pre_process, quantize_static)
 
-# TensorRT imports (these would typically be installed on the target system)
-# Uncomment this section when running on a system with TensorRT installed
-"""
-import tensorrt as trt
-import pycuda.driver as cuda
-import pycuda.autoinit
-"""
+from backbones import BACKBONES, DEFAULT_ARCH, build_backbone
+from benchmark_pipeline import time_calls
+from artifact_cache import ArtifactCache, hash_file, hash_tree
+from compact_checkpoint import load_checkpoint, load_model_weights
 
-def load_pytorch_model(model_path: str, num_classes: int) -> torch.nn.Module:
-    """Load the trained PyTorch model"""
-    from torchvision.models import convnext_large
-    
-    # Initialize model architecture
-    model = convnext_large(weights=None)
-    
-    # Modify the classifier head for our number of classes
-    in_features = model.classifier[-1].in_features
-    model.classifier[-1] = torch.nn.Linear(in_features, num_classes)
-    
-    # Load saved weights
-    checkpoint = torch.load(model_path, map_location=torch.device('cpu'))
-    model.load_state_dict(checkpoint['model_state_dict'])
+# Bump when a change here alters the produced artifacts, to invalidate cached ones
+CONVERTER_VERSION = 1
+
+# Deployed input profile (NCHW)
+INPUT_SHAPE = (1, 3, 224, 224)
+
+# ONNX Runtime graph optimization levels for the offline-optimized model
+OPTIMIZATION_LEVELS = {
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+# TensorRT is only installed on systems that can build engines
+try:
+    import tensorrt as trt
+except ImportError:
+    trt = None
+
+def load_pytorch_model(model_path: str, num_classes: int) -> Tuple[torch.nn.Module, Dict[str, int], str]:
+    """Load the trained PyTorch model (.pth or compact .weights) with the architecture recorded in its checkpoint"""
+    # Memory-mapped: tensors are only read from disk when they are used
+    checkpoint = load_checkpoint(model_path)
+    
+    # Initialize model architecture with the classifier head for our number of classes.
+    # On the meta device nothing is allocated; the checkpoint tensors are adopted below
+    arch = checkpoint.get('arch', DEFAULT_ARCH)
+    with torch.device('meta'):
+        # Pruned checkpoints record the reduced MLP widths of their blocks
+        model = build_backbone(arch, num_classes, pretrained=False,
+                               mlp_hidden_dims=checkpoint.get('mlp_hidden_dims'))
+    
+    # Load saved weights (fp16 checkpoints are converted to fp32 for export)
+    load_model_weights(model, checkpoint['model_state_dict'])
     
     # Set to evaluation mode
     model.eval()
     
-    return model, checkpoint.get('class_to_idx', {})
+    return model, checkpoint.get('class_to_idx', {}), arch
+
+# Normalization of the training and validation transforms
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+def first_conv(model: torch.nn.Module) -> torch.nn.Conv2d:
+    """The convolution that sees the input image"""
+    return next(m for m in model.modules() if isinstance(m, torch.nn.Conv2d))
+
+class FrameInputModel(torch.nn.Module):
+    """
+    Classifier taking raw uint8 NHWC BGR camera frames at the model resolution
+
+    The layout change, BGR to RGB swap, scaling to [0, 1] and ImageNet
+    normalization are part of the graph. When the first convolution has no
+    padding (the ConvNeXt patchify stem) they are folded into its weights and
+    bias, leaving only a cast and a transpose; padded convolutions would pad
+    with the wrong value, so other backbones keep explicit Mul/Add nodes.
+    """
+
+    def __init__(self, model: torch.nn.Module):
+        """
+        Args:
+            model: Classifier taking normalized NCHW RGB float input (copied, not modified)
+        """
+        import copy
+
+        super().__init__()
+        self.model = copy.deepcopy(model)
+        # x_normalized = x_raw * scale + shift per RGB channel
+        scale = 1.0 / (255.0 * torch.tensor(IMAGENET_STD))
+        shift = -torch.tensor(IMAGENET_MEAN) / torch.tensor(IMAGENET_STD)
+
+        conv = first_conv(self.model)
+        self.folded = all(p == 0 for p in conv.padding) if not isinstance(conv.padding, str) \
+            else conv.padding == "valid"
+        if self.folded:
+            with torch.no_grad():
+                weight = conv.weight.double()
+                bias_delta = (weight * shift.double().view(1, -1, 1, 1)).sum(dim=(1, 2, 3))
+                # Scale each RGB input channel, then reorder the channels to BGR
+                folded = (weight * scale.double().view(1, -1, 1, 1))[:, [2, 1, 0]]
+                conv.weight.copy_(folded.to(conv.weight.dtype))
+                if conv.bias is None:
+                    conv.bias = torch.nn.Parameter(torch.zeros(conv.out_channels, dtype=conv.weight.dtype))
+                conv.bias.add_(bias_delta.to(conv.bias.dtype))
+        else:
+            self.register_buffer("scale", scale.view(1, 3, 1, 1))
+            self.register_buffer("shift", shift.view(1, 3, 1, 1))
+
+    def forward(self, frames: torch.Tensor) -> torch.Tensor:
+        x = frames.permute(0, 3, 1, 2).float()
+        if not self.folded:
+            x = x[:, [2, 1, 0]] * self.scale + self.shift
+        return self.model(x)
+
+def to_frames(images: np.ndarray) -> np.ndarray:
+    """Normalized NCHW RGB float images (validation transform output) as uint8 NHWC BGR frames"""
+    mean = np.array(IMAGENET_MEAN, dtype=np.float32).reshape(1, 3, 1, 1)
+    std = np.array(IMAGENET_STD, dtype=np.float32).reshape(1, 3, 1, 1)
+    pixels = np.clip(np.rint((images * std + mean) * 255), 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(pixels.transpose(0, 2, 3, 1)[..., ::-1])
+
+def model_input_shape(batch_size: int, resolution: int, frame_input: bool = False) -> Tuple[int, int, int, int]:
+    """Graph input shape: NCHW float images, or NHWC frames for frame-input exports"""
+    if frame_input:
+        return (batch_size, resolution, resolution, 3)
+    return (batch_size, 3, resolution, resolution)
+
+def input_format(frame_input: bool = False, folded: bool = False) -> Dict[str, Any]:
+    """Input contract of an exported model, recorded in deployment_info.json"""
+    if frame_input:
+        return {"layout": "NHWC", "dtype": "uint8", "channel_order": "BGR",
+                "normalization": "in_graph", "normalization_folded": folded}
+    return {"layout": "NCHW", "dtype": "float32", "channel_order": "RGB",
+            "normalization": {"scale": 1 / 255, "mean": list(IMAGENET_MEAN), "std": list(IMAGENET_STD)}}
 
 def convert_to_onnx(
     model: torch.nn.Module, 
     output_path: str, 
-    input_shape: Tuple[int, int, int, int] = (1, 3, 224, 224)
+    input_shape: Tuple[int, int, int, int] = (1, 3, 224, 224),
+    opset_version: int = 12,
+    dynamic_resolution: bool = False,
+    frame_input: bool = False
 ) -> str:
-    """Convert PyTorch model to ONNX format"""
-    # Create random input tensor for tracing
-    dummy_input = torch.randn(input_shape)
+    """
+    Convert PyTorch model to ONNX format
+    
+    With frame_input the graph takes uint8 NHWC BGR frames of the NCHW
+    input_shape's size and normalizes them itself (see FrameInputModel).
+    """
+    if frame_input:
+        if not isinstance(model, FrameInputModel):
+            model = FrameInputModel(model)
+        batch_size, _, height, width = input_shape
+        dummy_input = torch.randint(0, 256, (batch_size, height, width, 3), dtype=torch.uint8)
+        spatial_axes = {1: 'height', 2: 'width'}
+        print(f"Frame input: normalization {'folded into the first convolution' if model.folded else 'as graph ops'}")
+    else:
+        # Create random input tensor for tracing
+        dummy_input = torch.randn(input_shape)
+        spatial_axes = {2: 'height', 3: 'width'}
+    
+    # The batch axis is always dynamic; height and width only for multi-resolution profiles
+    input_axes = {0: 'batch_size', **spatial_axes} if dynamic_resolution else {0: 'batch_size'}
     
     # Export model to ONNX
     torch.onnx.export(
@@ -58,12 +176,12 @@ def convert_to_onnx(
         dummy_input,
         output_path,
         export_params=True,
-        opset_version=12,
+        opset_version=opset_version,
         do_constant_folding=True,
         input_names=['input'],
         output_names=['output'],
         dynamic_axes={
-            'input': {0: 'batch_size'},
+            'input': input_axes,
             'output': {0: 'batch_size'}
         }
     )
@@ -78,24 +196,451 @@ def convert_to_onnx(
     
     return output_path
 
+def count_ops(onnx_path: str) -> Dict[str, int]:
+    """Number of nodes of each op type in an ONNX graph"""
+    counts: Dict[str, int] = {}
+    for node in onnx.load(onnx_path, load_external_data=False).graph.node:
+        counts[node.op_type] = counts.get(node.op_type, 0) + 1
+    return counts
+
+def optimize_onnx(onnx_path: str, output_path: str, level: str = "extended") -> str:
+    """
+    Save an ONNX Runtime offline-optimized copy of an ONNX model
+
+    The extended level adds ONNX Runtime's LayerNorm and GELU fusions on top of
+    constant folding and redundant node elimination; opset 17+ exports already
+    contain native LayerNormalization nodes. The "all" level also applies
+    layout transformations that are specific to the CPU it runs on, so the
+    resulting file should only be deployed on the same hardware.
+    """
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.graph_optimization_level = OPTIMIZATION_LEVELS[level]
+    sess_options.optimized_model_filepath = output_path
+    # Creating the session runs the optimizer and writes the optimized graph
+    onnxruntime.InferenceSession(onnx_path, sess_options, providers=["CPUExecutionProvider"])
+
+    before, after = count_ops(onnx_path), count_ops(output_path)
+    print(f"Optimized ONNX model ({level}) saved to {output_path}")
+    print(f"Nodes: {sum(before.values())} -> {sum(after.values())}")
+    for op in ("LayerNormalization", "SimplifiedLayerNormalization", "Gelu", "BiasGelu", "FastGelu"):
+        if after.get(op, 0) > before.get(op, 0):
+            print(f"  fused {op}: {after[op] - before.get(op, 0)}")
+
+    return output_path
+
+def _onnx_session(onnx_path: str, optimized: bool = False) -> onnxruntime.InferenceSession:
+    # Files optimized offline are loaded as-is, without optimizing them again. Everything else
+    # is optimized on load like on the device; without it QDQ nodes are not fused into
+    # quantized kernels and INT8 models run as float ops plus (de)quantization
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.graph_optimization_level = (onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL if optimized
+                                             else onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL)
+    return onnxruntime.InferenceSession(onnx_path, sess_options, providers=["CPUExecutionProvider"])
+
+def check_onnx_parity(
+    model: torch.nn.Module,
+    onnx_paths: Dict[str, str],
+    sample_inputs: np.ndarray,
+    timing_runs: int = 20,
+    optimized: Tuple[str, ...] = ("onnx_optimized",)
+) -> Dict[str, Any]:
+    """
+    Compare ONNX models against the PyTorch model on sample inputs
+
+    Reports the max absolute logit difference and top-1 agreement of every
+    ONNX model, and the batch-1 latency of PyTorch eager and each ONNX model.
+    Models named in optimized were optimized offline and are run as-is.
+    """
+    sample_inputs = np.ascontiguousarray(sample_inputs)
+    single_inputs = [sample_inputs[i:i + 1] for i in range(len(sample_inputs))]
+    timing_inputs = [single_inputs[i % len(single_inputs)] for i in range(timing_runs)]
+
+    with torch.inference_mode():
+        reference = model(torch.from_numpy(sample_inputs)).numpy()
+        eager = time_calls(lambda x: model(torch.from_numpy(x)), timing_inputs, warmup=3)
+
+    report: Dict[str, Any] = {
+        "num_samples": len(sample_inputs),
+        "timing": {"pytorch_eager": eager},
+        "parity": {},
+    }
+    for name, path in onnx_paths.items():
+        session = _onnx_session(path, optimized=name in optimized)
+        outputs = session.run(["output"], {"input": sample_inputs})[0]
+        report["parity"][name] = {
+            "max_abs_diff": float(np.abs(outputs - reference).max()),
+            "top1_agreement": float((outputs.argmax(1) == reference.argmax(1)).mean()),
+        }
+        report["timing"][name] = time_calls(
+            lambda x: session.run(["output"], {"input": x}), timing_inputs, warmup=3
+        )
+
+    for name, timing in report["timing"].items():
+        parity = report["parity"].get(name)
+        line = f"{name:<16} p50 {timing['p50_ms']:.2f} ms, p99 {timing['p99_ms']:.2f} ms"
+        if parity is not None:
+            line += f", max |diff| {parity['max_abs_diff']:.2e}, top-1 agreement {parity['top1_agreement'] * 100:.1f}%"
+        print(line)
+
+    return report
+
+def load_val_samples(
+    data_dir: str,
+    num_samples: int,
+    class_mapping: Optional[Dict[str, int]] = None,
+    seed: int = 0,
+    resolution: int = 224,
+    skip: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Random validation images with the validation transform, as NCHW float32
+
+    The same seed always draws the same images; skip drops the first ones
+    (e.g. the calibration images) so evaluation sets stay disjoint from them.
+    """
+    from train_produce_model import ProduceDataset, build_val_transform
+
+    dataset = ProduceDataset(data_dir=data_dir, transform=build_val_transform(resolution), split="val")
+    if class_mapping and dataset.class_to_idx != class_mapping:
+        print("Warning: validation classes do not match the checkpoint's class mapping")
+
+    indices = np.random.default_rng(seed).permutation(len(dataset))[skip:skip + num_samples]
+    images = np.empty((len(indices), 3, resolution, resolution), dtype=np.float32)
+    labels = np.empty(len(indices), dtype=np.int64)
+    for i, idx in enumerate(indices):
+        image, labels[i], _ = dataset[int(idx)]
+        images[i] = image.numpy()
+
+    return images, labels
+
+class ImageCalibrationReader(CalibrationDataReader):
+    """Feeds preprocessed images to the ONNX Runtime calibrator one batch at a time"""
+
+    def __init__(self, images: np.ndarray, batch_size: int = 1):
+        """
+        Args:
+            images: Calibration inputs (NCHW float32 images or NHWC uint8 frames)
+            batch_size: Images per calibration batch
+        """
+        self.images = images
+        self.batch_size = batch_size
+        self.position = 0
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        if self.position >= len(self.images):
+            return None
+        batch = self.images[self.position:self.position + self.batch_size]
+        self.position += self.batch_size
+        return {"input": batch}
+
+    def rewind(self):
+        self.position = 0
+
+def quantize_onnx_int8(
+    onnx_path: str,
+    output_path: str,
+    calibration_images: np.ndarray,
+    per_channel: bool = True
+) -> str:
+    """
+    Statically quantize an ONNX model to INT8 in QDQ format
+
+    Weights are quantized per output channel to int8 and activations to uint8
+    with scales calibrated on the given images. The QDQ graph runs on the
+    ONNX Runtime CPU provider and can be built by TensorRT as an explicitly
+    quantized network.
+    """
+    # Shape inference and graph cleanup before quantization
+    prepared_path = output_path + ".prep.onnx"
+    quant_pre_process(onnx_path, prepared_path)
+
+    quantize_static(
+        prepared_path,
+        output_path,
+        ImageCalibrationReader(calibration_images),
+        quant_format=QuantFormat.QDQ,
+        per_channel=per_channel,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    os.remove(prepared_path)
+
+    print(f"INT8 model calibrated on {len(calibration_images)} images saved to {output_path}")
+    return output_path
+
+def onnx_accuracy(onnx_path: str, images: np.ndarray, labels: np.ndarray, batch_size: int = 16,
+                  optimized: bool = False) -> float:
+    """Top-1 accuracy (%) of an ONNX model on preprocessed images"""
+    session = _onnx_session(onnx_path, optimized)
+    correct = 0
+    for start in range(0, len(images), batch_size):
+        logits = session.run(["output"], {"input": images[start:start + batch_size]})[0]
+        correct += int((logits.argmax(1) == labels[start:start + batch_size]).sum())
+    return 100 * correct / len(images)
+
+def profile_name(batch_size: int, resolution: int) -> str:
+    """Name of an input profile, also used in engine file names"""
+    return f"b{batch_size}_r{resolution}"
+
+def benchmark_profiles(
+    onnx_path: str,
+    batch_sizes: List[int],
+    resolutions: List[int],
+    eval_sets: Optional[Dict[int, Tuple[np.ndarray, np.ndarray]]] = None,
+    runs: int = 20,
+    frame_input: bool = False,
+    optimized: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Measure latency and throughput of every batch size/resolution profile
+
+    Top-1 accuracy only depends on the resolution and is measured once per
+    resolution on eval_sets[resolution] when given. Frame-input models are
+    fed random uint8 frames. optimized marks a model optimized offline.
+    """
+    session = _onnx_session(onnx_path, optimized)
+    accuracies = {}
+    profiles = []
+    for resolution in resolutions:
+        if eval_sets and resolution in eval_sets and len(eval_sets[resolution][0]):
+            accuracies[resolution] = onnx_accuracy(onnx_path, *eval_sets[resolution], optimized=optimized)
+        for batch_size in batch_sizes:
+            shape = model_input_shape(batch_size, resolution, frame_input)
+            if frame_input:
+                inputs = [np.random.default_rng(i).integers(0, 256, shape, dtype=np.uint8) for i in range(runs)]
+            else:
+                inputs = [np.random.default_rng(i).standard_normal(shape, dtype=np.float32) for i in range(runs)]
+            stats = time_calls(lambda x: session.run(["output"], {"input": x}), inputs,
+                               items_per_call=batch_size, warmup=3)
+            accuracy = accuracies.get(resolution)
+            profiles.append({
+                "name": profile_name(batch_size, resolution),
+                "batch_size": batch_size,
+                "resolution": resolution,
+                "input_shape": list(shape),
+                "latency_p50_ms": stats["p50_ms"],
+                "latency_p99_ms": stats["p99_ms"],
+                "images_per_sec": stats["images_per_sec"],
+                "top1_accuracy": accuracy,
+            })
+            print(f"{profiles[-1]['name']:<10} p50 {stats['p50_ms']:.2f} ms, {stats['images_per_sec']:.1f} img/s"
+                  + (f", top-1 {accuracy:.2f}%" if accuracy is not None else ""))
+    return profiles
+
+def cpu_id() -> str:
+    """Architecture and CPU model of this host"""
+    import platform
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return f"{platform.machine()} {line.split(':', 1)[1].strip()}"
+    except OSError:
+        pass
+    return f"{platform.machine()} {platform.processor()}".strip()
+
+def gpu_id() -> Optional[Dict[str, Any]]:
+    """Name and compute capability of the GPU engines are built on, or None"""
+    if not torch.cuda.is_available():
+        return None
+    return {"name": torch.cuda.get_device_name(0),
+            "compute_capability": list(torch.cuda.get_device_capability(0))}
+
+def host_id() -> Dict[str, Any]:
+    """Hardware that measurements in cached reports were taken on"""
+    return {"cpu": cpu_id(), "gpu": gpu_id()}
+
+def dataset_key(data_dir: Optional[str], splits: Tuple[str, ...] = ("val",)) -> Optional[Dict[str, str]]:
+    """Digest of the files of each dataset split, so cached results follow changes to the data"""
+    if not data_dir:
+        return None
+    return {split: hash_tree(os.path.join(data_dir, split)) for split in splits}
+
+def optimized_key(source_key: Dict[str, Any], level: str) -> Dict[str, Any]:
+    """Cache key of the ONNX Runtime optimized version of a cached ONNX model"""
+    key = dict(source_key, stage="optimized", source_stage=source_key["stage"], level=level,
+               onnxruntime=onnxruntime.__version__)
+    if level == "all":
+        # Layout transformations of this level are specific to the CPU they ran on
+        key["cpu"] = cpu_id()
+    return key
+
+def int8_key(onnx_key: Dict[str, Any], calibration_images: np.ndarray) -> Dict[str, Any]:
+    """Cache key of the INT8 model quantized from an ONNX export with given calibration images"""
+    return dict(onnx_key, stage="int8", onnxruntime=onnxruntime.__version__,
+                calibration=hashlib.sha1(np.ascontiguousarray(calibration_images).tobytes()).hexdigest())
+
+def engine_key(source_key: Dict[str, Any], precision: str, input_shape: Tuple[int, ...]) -> Dict[str, Any]:
+    """Cache key of a TensorRT engine built from a cached ONNX model"""
+    # Engines only run on the GPU model and compute capability they were built for
+    return dict(source_key, stage="tensorrt", precision=precision, profile=list(input_shape),
+                tensorrt=trt.__version__ if trt is not None else None, gpu=gpu_id())
+
+def convert_onnx_to_fp16(onnx_path: str, output_path: str) -> Optional[str]:
+    """Convert an ONNX model to float16, keeping float32 inputs and outputs"""
+    try:
+        from onnxconverter_common import float16
+    except ImportError:
+        print("onnxconverter-common not installed, skipping the fp16 ONNX model")
+        return None
+    
+    model = float16.convert_float_to_float16(onnx.load(onnx_path), keep_io_types=True)
+    onnx.save(model, output_path)
+    print(f"FP16 ONNX model saved to {output_path}")
+    return output_path
+
+def build_precision_variants(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the ONNX model(s) and TensorRT engine of one precision from a shared export
+
+    Runs in a worker process of compare_precisions; artifacts go through the
+    artifact cache when job["cache_dir"] is set.
+    """
+    cache = ArtifactCache(job["cache_dir"]) if job["cache_dir"] else None
+    def cached(key_fields: Dict[str, Any], filename: str, build) -> Optional[str]:
+        if cache is None:
+            return build(os.path.join(job["output_dir"], filename))
+        return cache.get_or_build(key_fields, filename, build, job["output_dir"])
+    
+    precision, onnx_path, key = job["precision"], job["onnx_path"], job["onnx_key"]
+    if precision == "fp16":
+        key = dict(key, stage="fp16")
+        path = cached(key, "model_fp16.onnx", lambda p: convert_onnx_to_fp16(onnx_path, p))
+    elif precision == "int8":
+        calibration_images = np.load(job["calibration_path"])
+        key = int8_key(key, calibration_images)
+        path = cached(key, "model_int8.onnx", lambda p: quantize_onnx_int8(onnx_path, p, calibration_images))
+    else:
+        path = onnx_path
+    
+    result: Dict[str, Any] = {"precision": precision, "variants": [], "engine_path": None}
+    if path is None:
+        return result
+    result["variants"].append({"name": precision, "precision": precision, "optimized": False, "onnx_path": path})
+    
+    if job["optimization_level"] != "none":
+        optimized_path = cached(optimized_key(key, job["optimization_level"]), f"model_{precision}_optimized.onnx",
+                                lambda p: optimize_onnx(path, p, job["optimization_level"]))
+        result["variants"].append({"name": f"{precision}_optimized", "precision": precision,
+                                   "optimized": True, "onnx_path": optimized_path})
+    
+    # TensorRT builds fp32/fp16 from the float export and int8 from the QDQ model
+    engine_source, source_key = (path, key) if precision == "int8" else (onnx_path, job["onnx_key"])
+    result["engine_path"] = cached(
+        engine_key(source_key, precision, INPUT_SHAPE), f"model_{precision}_{profile_name(INPUT_SHAPE[0], INPUT_SHAPE[2])}.engine",
+        lambda p: convert_onnx_to_tensorrt(engine_source, p, precision, INPUT_SHAPE)
+    )
+    return result
+
+def compare_precisions(
+    onnx_path: str,
+    onnx_key: Dict[str, Any],
+    output_dir: str,
+    cache_dir: Optional[str],
+    optimization_level: str,
+    calibration_images: Optional[np.ndarray],
+    eval_images: Optional[np.ndarray],
+    eval_labels: Optional[np.ndarray],
+    workers: int = 3,
+    batch_size: int = 8,
+    runs: int = 50
+) -> Dict[str, Any]:
+    """
+    Build fp32, fp16 and int8 variants in parallel processes and benchmark them
+
+    Every ONNX variant is timed afterwards, one at a time, on the same inputs:
+    batch-1 latency, throughput at batch_size, file size and top-1 accuracy
+    on the evaluation images. Variants that were not optimized offline are
+    optimized on load, so every row reflects what the device would run.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    
+    precisions = ["fp32", "fp16"]
+    calibration_path = None
+    if calibration_images is not None:
+        precisions.append("int8")
+        calibration_path = os.path.join(output_dir, "calibration_images.npy")
+        np.save(calibration_path, calibration_images)
+    else:
+        print("No calibration data, skipping int8")
+    
+    jobs = [{"precision": precision, "onnx_path": onnx_path, "onnx_key": onnx_key, "output_dir": output_dir,
+             "cache_dir": cache_dir, "optimization_level": optimization_level,
+             "calibration_path": calibration_path} for precision in precisions]
+    
+    # Spawned workers do not inherit the parent's torch/OpenMP thread state
+    print(f"Building {', '.join(precisions)} variants in {min(workers, len(jobs))} processes...")
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = list(pool.map(build_precision_variants, jobs))
+    
+    if eval_images is not None and len(eval_images):
+        inputs = np.ascontiguousarray(eval_images, dtype=np.float32)
+    else:
+        inputs = np.random.default_rng(0).standard_normal((max(batch_size, 16), 3, 224, 224), dtype=np.float32)
+    single_inputs = [inputs[i % len(inputs)][None] for i in range(runs)]
+    batch_inputs = [np.resize(inputs, (batch_size,) + inputs.shape[1:]) for _ in range(max(3, runs // batch_size))]
+    
+    variants = []
+    for result in results:
+        for variant in result["variants"]:
+            session = _onnx_session(variant["onnx_path"], optimized=variant["optimized"])
+            run = lambda x: session.run(["output"], {"input": x})
+            latency = time_calls(run, single_inputs, warmup=3)
+            throughput = time_calls(run, batch_inputs, items_per_call=batch_size, warmup=1)
+            variant.update({
+                "size_mb": os.path.getsize(variant["onnx_path"]) / 1e6,
+                "latency_p50_ms": latency["p50_ms"],
+                "latency_p99_ms": latency["p99_ms"],
+                "images_per_sec": throughput["images_per_sec"],
+                "top1_accuracy": (onnx_accuracy(variant["onnx_path"], eval_images, eval_labels,
+                                                optimized=variant["optimized"])
+                                  if eval_images is not None and len(eval_images) else None),
+                "engine_file": os.path.basename(result["engine_path"]) if result["engine_path"] else None,
+                "engine_size_mb": os.path.getsize(result["engine_path"]) / 1e6 if result["engine_path"] else None,
+            })
+            variants.append(variant)
+    
+    baseline = next(v for v in variants if v["name"] == "fp32")
+    for variant in variants:
+        variant["speedup_vs_fp32"] = baseline["latency_p50_ms"] / variant["latency_p50_ms"]
+        if variant["top1_accuracy"] is not None:
+            variant["accuracy_delta_vs_fp32"] = variant["top1_accuracy"] - baseline["top1_accuracy"]
+    
+    print(f"{'variant':<18}{'size MB':>10}{'p50 ms':>10}{'p99 ms':>10}{'img/s':>10}{'top-1':>10}{'speedup':>10}")
+    for v in variants:
+        accuracy = f"{v['top1_accuracy']:.2f}" if v["top1_accuracy"] is not None else "-"
+        print(f"{v['name']:<18}{v['size_mb']:>10.1f}{v['latency_p50_ms']:>10.2f}{v['latency_p99_ms']:>10.2f}"
+              f"{v['images_per_sec']:>10.1f}{accuracy:>10}{v['speedup_vs_fp32']:>10.2f}")
+    
+    return {
+        "eval_samples": len(eval_images) if eval_images is not None else 0,
+        "batch_size": batch_size,
+        "timing_runs": runs,
+        "optimization_level": optimization_level,
+        "variants": variants,
+    }
+
 def convert_onnx_to_tensorrt(
     onnx_path: str, 
     output_path: str, 
-    precision: str = "fp16"
-) -> str:
+    precision: str = "fp16",
+    input_shape: Tuple[int, int, int, int] = (1, 3, 224, 224)
+) -> Optional[str]:
     """
     Convert ONNX model to TensorRT format
     
-    Note: This part requires TensorRT to be installed on the system.
-    It's commented out as it would typically run on the target system.
-    """
-    print("TensorRT conversion - this is a placeholder as TensorRT is target-specific")
-    print(f"In a real implementation, this would convert {onnx_path} to {output_path}")
-    print(f"Using precision: {precision}")
-    
+    Note: This part requires TensorRT to be installed on the system, and an
+    engine only runs on the GPU and TensorRT version it was built with.
+    Returns None when TensorRT is not available; the deployment package
+    then runs the ONNX model with ONNX Runtime.
     """
-    # TensorRT conversion code (uncomment when running on system with TensorRT)
+    if trt is None:
+        print("TensorRT not installed, skipping engine build (the package will use ONNX Runtime)")
+        return None
     
+    print(f"Building TensorRT engine from {onnx_path} with {precision} precision")
     TRT_LOGGER = trt.Logger(trt.Logger.WARNING)
     
     # Create builder
@@ -112,37 +657,60 @@ def convert_onnx_to_tensorrt(
     
     # Configure builder
     config = builder.create_builder_config()
-    config.max_workspace_size = 1 << 30  # 1 GB
+    config.set_memory_pool_limit(trt.MemoryPoolType.WORKSPACE, 1 << 30)  # 1 GB
+    
+    # The exported batch axis is dynamic; build for the deployed input shape
+    profile = builder.create_optimization_profile()
+    profile.set_shape("input", input_shape, input_shape, input_shape)
+    config.add_optimization_profile(profile)
     
     # Set precision
     if precision == "fp16" and builder.platform_has_fast_fp16:
         config.set_flag(trt.BuilderFlag.FP16)
     elif precision == "int8" and builder.platform_has_fast_int8:
         config.set_flag(trt.BuilderFlag.INT8)
-        # Would need calibration data for INT8
+        # onnx_path is the QDQ model from quantize_onnx_int8, whose
+        # Q/DQ nodes carry the calibrated scales (explicit quantization)
     
     # Build engine
     serialized_engine = builder.build_serialized_network(network, config)
+    if serialized_engine is None:
+        raise RuntimeError("TensorRT engine build failed")
     
     # Save engine
     with open(output_path, "wb") as f:
         f.write(serialized_engine)
     
     print(f"TensorRT engine saved to {output_path}")
-    """
     
     return output_path
 
 def create_deployment_package(
-    tensorrt_path: str, 
+    tensorrt_path: Optional[str], 
     class_mapping: Dict[str, int], 
-    output_dir: str
+    output_dir: str,
+    arch: str = DEFAULT_ARCH,
+    precision: str = "fp16",
+    onnx_path: Optional[str] = None,
+    onnx_precision: str = "fp32",
+    reports: Optional[Dict[str, Dict]] = None,
+    profiles: Optional[List[Dict[str, Any]]] = None,
+    model_input_format: Optional[Dict[str, Any]] = None
 ) -> str:
     """
     Create a deployment package with TensorRT model and metadata
+
+    The ONNX model and any conversion reports (written as <name>.json) are
+    copied into the package next to the engine. The inference script runs the
+    engine when TensorRT is available and the ONNX model otherwise.
+
+    Each of the optional input profiles (see benchmark_profiles) may carry an
+    "engine_path" of its own TensorRT engine; the first profile is the default.
+    model_input_format (see input_format) tells the runtime how to prepare inputs.
+    precision is that of the TensorRT engines and onnx_precision that of the
+    ONNX model; both are recorded, since an fp16 engine is built from the
+    fp32 export that is packaged for ONNX Runtime.
     """
-    import json
-    
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     
@@ -154,16 +722,32 @@ def create_deployment_package(
     with open(mapping_path, "w") as f:
         json.dump(idx_to_class, f, indent=2)
     
+    # Package the profile engines under their file names
+    packaged_profiles = []
+    for profile in profiles or []:
+        profile = dict(profile)
+        engine_path = profile.pop("engine_path", None)
+        profile["model_file"] = os.path.basename(engine_path) if engine_path else None
+        if engine_path:
+            shutil.copy2(engine_path, os.path.join(output_dir, profile["model_file"]))
+        packaged_profiles.append(profile)
+    
     # Create deployment info file
     deploy_info = {
-        "model_type": "ConvNeXt-Large",
-        "input_shape": [1, 3, 224, 224],
+        "model_type": BACKBONES[arch]["display_name"],
+        "architecture": arch,
+        "input_shape": packaged_profiles[0]["input_shape"] if packaged_profiles else list(INPUT_SHAPE),
         "input_name": "input",
+        "input_format": model_input_format or input_format(),
         "output_name": "output",
-        "precision": "fp16",
+        "engine_precision": precision if tensorrt_path or any(p["model_file"] for p in packaged_profiles) else None,
+        "onnx_precision": onnx_precision if onnx_path else None,
         "num_classes": len(class_mapping),
         "class_mapping_file": "class_mapping.json",
-        "model_file": os.path.basename(tensorrt_path),
+        "model_file": os.path.basename(tensorrt_path) if tensorrt_path else None,
+        "onnx_model_file": os.path.basename(onnx_path) if onnx_path else None,
+        "profiles": packaged_profiles,
+        "default_profile": packaged_profiles[0]["name"] if packaged_profiles else None,
         "created_on": "2025-04-09",  # Current date
     }
     
@@ -171,12 +755,16 @@ def create_deployment_package(
     with open(info_path, "w") as f:
         json.dump(deploy_info, f, indent=2)
     
-    # Copy TensorRT model (this is a placeholder since we're not actually creating it)
-    # In reality, we would copy the file or create a dummy for demonstration
-    dest_model_path = os.path.join(output_dir, os.path.basename(tensorrt_path))
-    with open(dest_model_path, "w") as f:
-        f.write("# This is a placeholder for the TensorRT model file\n")
-        f.write("# In a real deployment, this would be a binary TensorRT engine file\n")
+    # Copy TensorRT engine (already copied with the profiles when given)
+    if tensorrt_path and not packaged_profiles:
+        shutil.copy2(tensorrt_path, os.path.join(output_dir, os.path.basename(tensorrt_path)))
+    
+    if onnx_path:
+        shutil.copy2(onnx_path, os.path.join(output_dir, os.path.basename(onnx_path)))
+    
+    for name, report in (reports or {}).items():
+        with open(os.path.join(output_dir, f"{name}.json"), "w") as f:
+            json.dump(report, f, indent=2)
     
     print(f"Deployment package created in {output_dir}")
     
@@ -192,12 +780,12 @@ def create_inference_script(output_dir: str) -> str:
     script_content += '''
 """
 Produce Recognition Inference Script for Raspberry Pi
-This script captures images from a camera, processes them through the TensorRT model,
+This script captures images from a camera, processes them through the TensorRT model
+(or the ONNX model with ONNX Runtime when TensorRT is not available),
 reads weight from a connected scale, and outputs JSON results.
 
 Requirements:
-- TensorRT
-- PyCUDA
+- ONNX Runtime, or TensorRT and PyCUDA
 - PySerial (for scale communication)
 - OpenCV
 - NumPy
@@ -211,20 +799,472 @@ Hardware:
 import os
 import json
 import time
+import queue
+import random
+import threading
 import cv2
 import numpy as np
 import serial
 import argparse
 from typing import Dict, Any, List, Tuple, Optional
 
-# TensorRT imports
+# TensorRT imports (optional, ONNX Runtime is used without them)
 try:
     import tensorrt as trt
     import pycuda.driver as cuda
     import pycuda.autoinit
 except ImportError:
-    print("Warning: TensorRT or CUDA packages not found.")
-    print("This script requires TensorRT and PyCUDA to run inference.")
+    trt = None
+
+class InferenceBackend:
+    """Runs the classifier on preprocessed batches (NCHW float32 images, or NHWC uint8 frames)"""
+    
+    name = "base"
+    # Whether set_input_shape can switch profiles without a new backend
+    supports_reshape = False
+    
+    def __init__(self, input_shape: Tuple[int, ...], num_classes: int, input_dtype: str = "float32"):
+        self.input_shape = tuple(input_shape)
+        self.num_classes = num_classes
+        self.input_dtype = np.dtype(input_dtype)
+        # Preallocated buffers, reused by every call
+        self.input = np.zeros(self.input_shape, dtype=self.input_dtype)
+        self.output = np.zeros((self.input_shape[0], num_classes), dtype=np.float32)
+    
+    def infer(self, batch: np.ndarray) -> np.ndarray:
+        """Return the logits of a batch (a view of the output buffer)"""
+        raise NotImplementedError("Subclasses must implement infer method")
+    
+    def set_input_shape(self, input_shape: Tuple[int, ...]):
+        """Switch to another input profile"""
+        if tuple(input_shape) != self.input_shape:
+            raise NotImplementedError(f"{self.name} backend has a fixed input shape")
+    
+    def close(self):
+        """Release backend resources"""
+        pass
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """ONNX Runtime CPU backend with IO binding over the preallocated buffers"""
+    
+    name = "onnxruntime"
+    supports_reshape = True
+    
+    def __init__(
+        self,
+        model_path: str,
+        input_shape: Tuple[int, ...],
+        num_classes: int,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 1,
+        input_name: str = "input",
+        output_name: str = "output",
+        input_dtype: str = "float32"
+    ):
+        """
+        Args:
+            model_path: ONNX model file
+            input_shape: Fixed input shape
+            num_classes: Number of output logits
+            intra_op_threads: Threads used inside an operator (0 = all cores)
+            inter_op_threads: Threads used to run independent operators
+            input_name: Name of the graph input
+            output_name: Name of the graph output
+            input_dtype: Graph input type (uint8 for frame-input models)
+        """
+        import onnxruntime as ort
+        self.num_classes = num_classes
+        self.input_dtype = np.dtype(input_dtype)
+        self.input_name = input_name
+        self.output_name = output_name
+        
+        sess_options = ort.SessionOptions()
+        sess_options.intra_op_num_threads = intra_op_threads
+        sess_options.inter_op_num_threads = inter_op_threads
+        sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        # Packaged models are portable; optimizations specific to this CPU are applied here
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options, providers=["CPUExecutionProvider"])
+        
+        # One IO binding and buffer pair per input shape, kept for later switches
+        self._bindings = {}
+        self.set_input_shape(input_shape)
+    
+    def set_input_shape(self, input_shape: Tuple[int, ...]):
+        """Switch input profile; the session accepts any batch size and resolution it was exported with"""
+        import onnxruntime as ort
+        input_shape = tuple(input_shape)
+        if input_shape not in self._bindings:
+            input_buffer = np.zeros(input_shape, dtype=self.input_dtype)
+            output_buffer = np.zeros((input_shape[0], self.num_classes), dtype=np.float32)
+            # CPU OrtValues share memory with the numpy buffers, so binding once
+            # means each call only copies the frame into self.input
+            io_binding = self.session.io_binding()
+            io_binding.bind_ortvalue_input(self.input_name, ort.OrtValue.ortvalue_from_numpy(input_buffer))
+            io_binding.bind_ortvalue_output(self.output_name, ort.OrtValue.ortvalue_from_numpy(output_buffer))
+            self._bindings[input_shape] = (io_binding, input_buffer, output_buffer)
+        self.io_binding, self.input, self.output = self._bindings[input_shape]
+        self.input_shape = input_shape
+    
+    def infer(self, batch: np.ndarray) -> np.ndarray:
+        """Run the session on a batch"""
+        if batch is not self.input:
+            np.copyto(self.input, batch)
+        self.session.run_with_iobinding(self.io_binding)
+        return self.output
+    
+    def close(self):
+        """Release the session"""
+        self._bindings = {}
+        self.io_binding = None
+        self.session = None
+
+class TensorRTBackend(InferenceBackend):
+    """TensorRT engine with page-locked host buffers and a CUDA stream"""
+    
+    name = "tensorrt"
+    
+    def __init__(
+        self,
+        engine_path: str,
+        input_shape: Tuple[int, ...],
+        num_classes: int,
+        input_name: str = "input",
+        output_name: str = "output",
+        input_dtype: str = "float32"
+    ):
+        """
+        Args:
+            engine_path: Serialized TensorRT engine
+            input_shape: Fixed input shape
+            num_classes: Number of output logits
+            input_name: Name of the engine input tensor
+            output_name: Name of the engine output tensor
+            input_dtype: Engine input type (uint8 for frame-input models)
+        """
+        if trt is None:
+            raise RuntimeError("TensorRT and PyCUDA are not installed")
+        self.input_shape = tuple(input_shape)
+        self.num_classes = num_classes
+        
+        logger = trt.Logger(trt.Logger.WARNING)
+        with open(engine_path, "rb") as f:
+            self.engine = trt.Runtime(logger).deserialize_cuda_engine(f.read())
+        if self.engine is None:
+            raise RuntimeError(f"Failed to load TensorRT engine {engine_path}")
+        self.context = self.engine.create_execution_context()
+        self.context.set_input_shape(input_name, self.input_shape)
+        
+        # Page-locked host buffers allow asynchronous copies
+        self.input = cuda.pagelocked_empty(self.input_shape, dtype=np.dtype(input_dtype))
+        self.output = cuda.pagelocked_empty((self.input_shape[0], num_classes), dtype=np.float32)
+        self.device_input = cuda.mem_alloc(self.input.nbytes)
+        self.device_output = cuda.mem_alloc(self.output.nbytes)
+        self.context.set_tensor_address(input_name, int(self.device_input))
+        self.context.set_tensor_address(output_name, int(self.device_output))
+        self.stream = cuda.Stream()
+    
+    def infer(self, batch: np.ndarray) -> np.ndarray:
+        """Copy the batch to the GPU, run the engine and copy the logits back"""
+        if batch is not self.input:
+            np.copyto(self.input, batch)
+        cuda.memcpy_htod_async(self.device_input, self.input, self.stream)
+        self.context.execute_async_v3(self.stream.handle)
+        cuda.memcpy_dtoh_async(self.output, self.device_output, self.stream)
+        self.stream.synchronize()
+        return self.output
+    
+    def close(self):
+        """Free device memory"""
+        self.device_input.free()
+        self.device_output.free()
+        self.context = None
+        self.engine = None
+
+def create_backend(
+    model_dir: str,
+    deployment_info: Dict[str, Any],
+    backend: str = "auto",
+    intra_op_threads: int = 0,
+    inter_op_threads: int = 1,
+    profile: Optional[Dict[str, Any]] = None
+) -> InferenceBackend:
+    """Create the requested backend; "auto" prefers TensorRT and falls back to ONNX Runtime"""
+    profile = profile or {"input_shape": deployment_info["input_shape"],
+                          "model_file": deployment_info.get("model_file")}
+    input_shape = profile["input_shape"]
+    num_classes = deployment_info["num_classes"]
+    engine_file = profile.get("model_file")
+    input_dtype = deployment_info.get("input_format", {}).get("dtype", "float32")
+    
+    if backend in ("auto", "tensorrt") and trt is not None and engine_file:
+        try:
+            return TensorRTBackend(os.path.join(model_dir, engine_file), input_shape, num_classes,
+                                   deployment_info["input_name"], deployment_info["output_name"], input_dtype)
+        except Exception as e:
+            if backend == "tensorrt":
+                raise
+            print(f"TensorRT backend unavailable ({str(e)}), using ONNX Runtime")
+    elif backend == "tensorrt":
+        raise RuntimeError("TensorRT backend requested but TensorRT or the engine file is missing")
+    
+    onnx_file = deployment_info.get("onnx_model_file")
+    if not onnx_file:
+        raise RuntimeError("Deployment package contains no ONNX model")
+    return OnnxRuntimeBackend(os.path.join(model_dir, onnx_file), input_shape, num_classes,
+                              intra_op_threads, inter_op_threads,
+                              deployment_info["input_name"], deployment_info["output_name"], input_dtype)
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+def reference_preprocess(image: np.ndarray, height: int, width: int) -> np.ndarray:
+    """Straightforward preprocessing the Preprocessor reproduces bit for bit"""
+    resized = cv2.resize(image, (width, height))
+    rgb = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+    normalized = rgb.astype(np.float32) / 255.0
+    normalized = (normalized - np.array(IMAGENET_MEAN)) / np.array(IMAGENET_STD)
+    return np.expand_dims(normalized.transpose(2, 0, 1), axis=0).astype(np.float32)
+
+class Preprocessor:
+    """
+    Turns BGR camera frames into normalized float32 NCHW batches without per-frame allocations
+
+    Normalization of a uint8 pixel only depends on its value and channel, so
+    it is precomputed for all 256 values per channel with the reference math
+    and applied as a table lookup, which gives bitwise identical results.
+    Resize, channel reordering and lookup write into buffers that are
+    allocated once per input size and reused; num_buffers output buffers are
+    rotated for callers that keep several results alive at once.
+    
+    Frame-input models normalize inside the graph, so for them the output is
+    just the resized uint8 NHWC BGR frame.
+    """
+    
+    def __init__(self, num_buffers: int = 1, frame_input: bool = False):
+        """
+        Args:
+            num_buffers: Output buffers per input size, used round-robin
+            frame_input: Produce (1, H, W, 3) uint8 BGR frames instead of normalized NCHW images
+        """
+        values = np.arange(256, dtype=np.float32) / 255.0
+        mean = np.array(IMAGENET_MEAN)[:, None]
+        std = np.array(IMAGENET_STD)[:, None]
+        self.lut = ((values[None, :] - mean) / std).astype(np.float32)
+        self.num_buffers = num_buffers
+        self.frame_input = frame_input
+        self._buffers = {}
+    
+    def _buffers_for(self, height: int, width: int) -> Dict[str, Any]:
+        key = (height, width)
+        if key not in self._buffers and self.frame_input:
+            self._buffers[key] = {
+                "outputs": [np.empty((1, height, width, 3), dtype=np.uint8) for _ in range(self.num_buffers)],
+                "next": 0,
+            }
+        elif key not in self._buffers:
+            self._buffers[key] = {
+                "resized": np.empty((height, width, 3), dtype=np.uint8),
+                "planes": np.empty((3, height, width), dtype=np.uint8),
+                "outputs": [np.empty((1, 3, height, width), dtype=np.float32) for _ in range(self.num_buffers)],
+                "next": 0,
+            }
+        return self._buffers[key]
+    
+    def __call__(self, image: np.ndarray, height: int, width: int) -> np.ndarray:
+        """Preprocessed batch of one image; valid until num_buffers further calls"""
+        buffers = self._buffers_for(height, width)
+        output = buffers["outputs"][buffers["next"]]
+        buffers["next"] = (buffers["next"] + 1) % self.num_buffers
+        
+        if self.frame_input:
+            cv2.resize(image, (width, height), dst=output[0])
+            return output
+        
+        resized = cv2.resize(image, (width, height), dst=buffers["resized"])
+        # BGR HWC to RGB CHW while still uint8
+        planes = buffers["planes"]
+        np.copyto(planes, resized.transpose(2, 0, 1)[::-1])
+        for channel in range(3):
+            np.take(self.lut[channel], planes[channel], out=output[0, channel], mode="clip")
+        return output
+
+def input_size(input_shape: List[int], input_format: Dict[str, Any]) -> Tuple[int, int]:
+    """Height and width of a model input shape in the given input layout"""
+    if input_format.get("layout") == "NHWC":
+        return input_shape[1], input_shape[2]
+    return input_shape[2], input_shape[3]
+
+def benchmark_preprocessing(height: int, width: int, frames: int = 200,
+                            frame_size: Tuple[int, int] = (720, 1280)) -> Dict[str, float]:
+    """Per-frame cost of the reference and the buffered preprocessing, checking they match bitwise"""
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, size=(*frame_size, 3), dtype=np.uint8) for _ in range(min(frames, 8))]
+    preprocessor = Preprocessor()
+    
+    for image in images:
+        expected = reference_preprocess(image, height, width)
+        actual = preprocessor(image, height, width)
+        if not np.array_equal(expected.view(np.uint32), actual.view(np.uint32)):
+            raise AssertionError("Preprocessor output differs from the reference preprocessing")
+    
+    results = {}
+    for name, fn in (("reference", reference_preprocess), ("buffered", preprocessor)):
+        start = time.perf_counter()
+        for i in range(frames):
+            fn(images[i % len(images)], height, width)
+        results[f"{name}_ms"] = (time.perf_counter() - start) * 1000 / frames
+    results["speedup"] = results["reference_ms"] / results["buffered_ms"]
+    return results
+
+class ProfileSelector:
+    """
+    Chooses the input profile from the device temperature and the frame queue
+
+    Single-image profiles form levels from the highest to the lowest
+    resolution. The selector steps one level down while the device is hot or
+    frames are queuing up and back up once it has cooled and the queue is
+    empty, at most once per check interval. Batched profiles at the current
+    resolution are used when enough frames are waiting.
+    """
+    
+    def __init__(
+        self,
+        profiles: List[Dict[str, Any]],
+        throttle_temp_c: float = 75.0,
+        recover_temp_c: float = 68.0,
+        queue_high: int = 2,
+        check_interval_s: float = 2.0,
+        thermal_zone: str = "/sys/class/thermal/thermal_zone0/temp"
+    ):
+        """
+        Args:
+            profiles: Input profiles from deployment_info.json
+            throttle_temp_c: Temperature at which to step down a resolution level
+            recover_temp_c: Temperature below which to step back up
+            queue_high: Queue depth at which to step down a resolution level
+            check_interval_s: Minimum time between level changes
+            thermal_zone: sysfs file with the SoC temperature in millidegrees
+        """
+        self.levels = sorted([p for p in profiles if p["batch_size"] == 1],
+                             key=lambda p: p["resolution"], reverse=True) or profiles[:1]
+        self.batched = sorted([p for p in profiles if p["batch_size"] > 1],
+                              key=lambda p: p["batch_size"], reverse=True)
+        self.throttle_temp_c = throttle_temp_c
+        self.recover_temp_c = recover_temp_c
+        self.queue_high = queue_high
+        self.check_interval_s = check_interval_s
+        self.thermal_zone = thermal_zone
+        self.level = 0
+        self.temperature = None
+        self._last_check = 0.0
+    
+    def read_temperature(self) -> Optional[float]:
+        """SoC temperature in degrees Celsius, or None if unavailable"""
+        try:
+            with open(self.thermal_zone, "r") as f:
+                return int(f.read().strip()) / 1000
+        except (OSError, ValueError):
+            return None
+    
+    def select(self, queue_depth: int = 0, max_batch: int = 1) -> Dict[str, Any]:
+        """Profile for the next inference given the number of frames waiting behind it"""
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval_s:
+            self._last_check = now
+            self.temperature = self.read_temperature()
+            hot = self.temperature is not None and self.temperature >= self.throttle_temp_c
+            cool = self.temperature is None or self.temperature <= self.recover_temp_c
+            if hot or queue_depth >= self.queue_high:
+                self.level = min(self.level + 1, len(self.levels) - 1)
+            elif cool and queue_depth == 0:
+                self.level = max(self.level - 1, 0)
+        
+        profile = self.levels[self.level]
+        for batched in self.batched:
+            if (batched["resolution"] == profile["resolution"]
+                    and batched["batch_size"] <= min(queue_depth + 1, max_batch)):
+                return batched
+        return profile
+
+class SceneChangeGate:
+    """
+    Decides whether a frame needs a new inference or can reuse the last result
+
+    Frames are compared on a small grayscale thumbnail against the frame the
+    last inference ran on, so slow drift still adds up to a change. A change
+    of the scale weight always triggers an inference, and so does a result
+    older than max_age_s.
+    """
+    
+    def __init__(
+        self,
+        diff_threshold: float = 4.0,
+        weight_threshold_g: float = 2.0,
+        max_age_s: float = 60.0,
+        thumbnail_size: Tuple[int, int] = (32, 24)
+    ):
+        """
+        Args:
+            diff_threshold: Mean absolute thumbnail difference (0-255) that counts as a scene change
+            weight_threshold_g: Weight change in grams that counts as a scene change
+            max_age_s: Longest time a result is reused
+            thumbnail_size: Width and height of the compared thumbnails
+        """
+        self.diff_threshold = diff_threshold
+        self.weight_threshold_g = weight_threshold_g
+        self.max_age_s = max_age_s
+        self.thumbnail_size = thumbnail_size
+        self.reference = None
+        self.reference_weight = None
+        self.last_result = None
+        self.last_inference = 0.0
+        self.inferences = 0
+        self.skipped = 0
+    
+    def thumbnail(self, image: np.ndarray) -> np.ndarray:
+        """Downsampled grayscale frame"""
+        small = cv2.resize(image, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    
+    def _weight_changed(self, weight_grams: Optional[float]) -> bool:
+        if weight_grams is None or self.reference_weight is None:
+            return (weight_grams is None) != (self.reference_weight is None)
+        return abs(weight_grams - self.reference_weight) >= self.weight_threshold_g
+    
+    def check(self, image: np.ndarray, weight_grams: Optional[float]) -> Tuple[bool, np.ndarray]:
+        """Whether the frame needs an inference, and its thumbnail for update()"""
+        thumbnail = self.thumbnail(image)
+        if (self.last_result is None
+                or time.monotonic() - self.last_inference >= self.max_age_s
+                or self._weight_changed(weight_grams)):
+            return True, thumbnail
+        return float(cv2.absdiff(thumbnail, self.reference).mean()) >= self.diff_threshold, thumbnail
+    
+    def update(self, thumbnail: np.ndarray, weight_grams: Optional[float], result: Dict[str, Any]):
+        """Record the frame and result of an inference"""
+        self.reference = thumbnail
+        self.reference_weight = weight_grams
+        self.last_result = result
+        self.last_inference = time.monotonic()
+        self.inferences += 1
+    
+    def reuse(self) -> Dict[str, Any]:
+        """The last result, re-emitted for an unchanged scene"""
+        self.skipped += 1
+        result = dict(self.last_result)
+        result["reused"] = True
+        result["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        return result
+    
+    def stats(self) -> Dict[str, Any]:
+        """Inference and skip counters"""
+        total = self.inferences + self.skipped
+        return {
+            "inferences": self.inferences,
+            "skipped": self.skipped,
+            "skip_rate": round(self.skipped / total, 3) if total else 0.0,
+        }
 
 class ProduceRecognitionSystem:
     """Main class for produce recognition system"""
@@ -235,7 +1275,14 @@ class ProduceRecognitionSystem:
         scale_port: str = "/dev/ttyUSB0",
         scale_baudrate: int = 9600,
         camera_id: int = 0,
-        confidence_threshold: float = 0.7
+        confidence_threshold: float = 0.7,
+        backend: str = "auto",
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 1,
+        profile: str = "auto",
+        throttle_temp_c: float = 75.0,
+        scene_gate: Optional[SceneChangeGate] = None,
+        scale_interface=None
     ):
         """
         Initialize the produce recognition system
@@ -246,8 +1293,17 @@ class ProduceRecognitionSystem:
             scale_baudrate: Baud rate for scale connection
             camera_id: Camera device ID
             confidence_threshold: Minimum confidence threshold for recognition
+            backend: Inference backend: "auto", "tensorrt" or "onnxruntime"
+            intra_op_threads: ONNX Runtime threads inside an operator (0 = all cores)
+            inter_op_threads: ONNX Runtime threads across operators
+            profile: Input profile name, or "auto" to adapt to temperature and load
+            throttle_temp_c: Temperature at which "auto" lowers the resolution
+            scene_gate: Optional gate that reuses the last result while the scene is unchanged
+            scale_interface: Connected scale driver from scale_integration.py, used instead of the raw serial port
         """
         self.model_dir = model_dir
+        self.scene_gate = scene_gate
+        self.scale_interface = scale_interface
         self.scale_port = scale_port
         self.scale_baudrate = scale_baudrate
         self.camera_id = camera_id
@@ -259,13 +1315,37 @@ class ProduceRecognitionSystem:
         # Load class mapping
         self.class_mapping = self._load_class_mapping()
         
-        # Initialize TensorRT engine
-        self.engine = None
-        self.context = None
-        self.input_buffer = None
-        self.output_buffer = None
-        self.bindings = None
-        self._init_tensorrt()
+        # Frame-input models take uint8 BGR camera frames and normalize in the graph
+        self.input_format = self.deployment_info.get("input_format", {})
+        
+        # Reused preprocessing buffers
+        self.preprocessor = Preprocessor(frame_input=self.input_format.get("layout") == "NHWC")
+        
+        # Input profiles (packages without profiles have a single fixed shape)
+        input_shape = self.deployment_info["input_shape"]
+        self.profiles = self.deployment_info.get("profiles") or [{
+            "name": "default",
+            "batch_size": input_shape[0],
+            "resolution": input_size(input_shape, self.input_format)[0],
+            "input_shape": input_shape,
+            "model_file": self.deployment_info.get("model_file"),
+        }]
+        self.profile_selector = None
+        if profile == "auto":
+            self.profile_selector = ProfileSelector(self.profiles, throttle_temp_c)
+            self.profile = self.profile_selector.select()
+        else:
+            matching = [p for p in self.profiles if p["name"] == profile]
+            if not matching:
+                raise ValueError(f"Unknown profile {profile}, available: {[p['name'] for p in self.profiles]}")
+            self.profile = matching[0]
+        
+        # Initialize inference backend (session and buffers are created once)
+        self._backend_args = (backend, intra_op_threads, inter_op_threads)
+        self.backend = create_backend(model_dir, self.deployment_info, backend,
+                                      intra_op_threads, inter_op_threads, self.profile)
+        self._profile_backends = {self.profile["name"]: self.backend}
+        print(f"Inference backend: {self.backend.name}, profile {self.profile['name']}")
         
         # Initialize camera
         self.camera = None
@@ -292,21 +1372,20 @@ class ProduceRecognitionSystem:
         with open(mapping_path, "r") as f:
             return json.load(f)
     
-    def _init_tensorrt(self):
-        """Initialize TensorRT engine and allocate buffers"""
-        try:
-            # Load TensorRT engine
-            model_path = os.path.join(self.model_dir, self.deployment_info["model_file"])
-            
-            # In a real implementation, we would load the TensorRT engine
-            # and allocate CUDA buffers for inputs and outputs
-            
-            print(f"TensorRT engine would be initialized from {model_path}")
-            print("This is a placeholder for actual TensorRT initialization")
-            
-        except Exception as e:
-            print(f"Error initializing TensorRT: {str(e)}")
-            print("Falling back to mock inference mode")
+    def _activate_profile(self, profile: Dict[str, Any]):
+        """Switch the backend to another input profile"""
+        if profile["name"] == self.profile["name"]:
+            return
+        if self.backend.supports_reshape:
+            self.backend.set_input_shape(profile["input_shape"])
+        else:
+            # Engines are built per profile; keep every loaded one for later switches
+            if profile["name"] not in self._profile_backends:
+                self._profile_backends[profile["name"]] = create_backend(
+                    self.model_dir, self.deployment_info, *self._backend_args, profile)
+            self.backend = self._profile_backends[profile["name"]]
+        print(f"Switched to profile {profile['name']}")
+        self.profile = profile
     
     def _init_camera(self):
         """Initialize camera capture"""
@@ -318,6 +1397,8 @@ class ProduceRecognitionSystem:
             # Set camera properties
             self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
             self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+            # Keep no backlog, so a capture after an idle period gets a fresh frame
+            self.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
             
             print(f"Camera initialized: ID {self.camera_id}")
         except Exception as e:
@@ -326,6 +1407,9 @@ class ProduceRecognitionSystem:
     
     def _init_scale(self):
         """Initialize serial connection to scale"""
+        if self.scale_interface is not None:
+            # The driver owns the serial port
+            return
         try:
             self.scale = serial.Serial(
                 port=self.scale_port,
@@ -337,36 +1421,25 @@ class ProduceRecognitionSystem:
             print(f"Error connecting to scale: {str(e)}")
             print("Falling back to mock scale readings")
     
-    def _preprocess_image(self, image: np.ndarray) -> np.ndarray:
+    def _preprocess_image(self, image: np.ndarray, profile: Optional[Dict[str, Any]] = None) -> np.ndarray:
         """Preprocess image for model input"""
-        # Resize to model input size
-        input_shape = self.deployment_info["input_shape"]
-        resized = cv2.resize(image, (input_shape[2], input_shape[3]))
-        
-        # Convert to RGB (OpenCV uses BGR)
-        rgb = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-        
-        # Normalize pixel values
-        normalized = rgb.astype(np.float32) / 255.0
-        normalized = (normalized - np.array([0.485, 0.456, 0.406])) / np.array([0.229, 0.224, 0.225])
-        
-        # Transpose to NCHW format for TensorRT
-        nchw = normalized.transpose(2, 0, 1)
-        
-        # Add batch dimension
-        batched = np.expand_dims(nchw, axis=0)
-        
-        return batched
+        # Resize to the input size of the given (default: active) profile, convert to RGB,
+        # normalize and transpose to NCHW in reused float32 buffers (frame-input models: resize only)
+        height, width = input_size((profile or self.profile)["input_shape"], self.input_format)
+        return self.preprocessor(image, height, width)
     
     def _read_scale_weight(self) -> Optional[float]:
         """Read weight from connected scale"""
+        if self.scale_interface is not None:
+            return self.scale_interface.read_weight()
+        
         if self.scale is None:
             # Return mock weight if scale not connected
             return round(random.uniform(150, 500), 1)
         
         try:
             # Read data from scale
-            self.scale.write(b"W\r\n")  # Command to request weight
+            self.scale.write(b"W\\r\\n")  # Command to request weight
             time.sleep(0.1)
             
             if self.scale.in_waiting:
@@ -384,23 +1457,16 @@ class ProduceRecognitionSystem:
             print(f"Error reading scale: {str(e)}")
             return None
     
-    def _infer(self, preprocessed_image: np.ndarray) -> np.ndarray:
-        """Run inference with TensorRT engine"""
-        # This is a placeholder for actual TensorRT inference
-        # In a real implementation, this would run the TensorRT engine
-        
-        # Mock inference result - random probabilities for each class
-        num_classes = len(self.class_mapping)
-        mock_probs = np.random.random(num_classes)
-        mock_probs = np.exp(mock_probs) / np.sum(np.exp(mock_probs))  # Apply softmax
+    def _infer(self, preprocessed: np.ndarray) -> np.ndarray:
+        """Run inference on up to batch_size preprocessed images and return class probabilities"""
+        count = len(preprocessed)
+        batch = self.backend.input
+        batch[:count] = preprocessed
+        logits = self.backend.infer(batch)[:count]
         
-        # Make one class more likely to be the prediction
-        mock_probs[:] = mock_probs[:] * 0.2
-        random_class = np.random.randint(0, num_classes)
-        mock_probs[random_class] = np.random.uniform(0.7, 0.99)
-        mock_probs = mock_probs / np.sum(mock_probs)  # Renormalize
-        
-        return mock_probs
+        # Softmax
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
     
     def _get_produce_data(self, class_id: int) -> Dict[str, Any]:
         """Get produce data for a given class ID"""
@@ -470,9 +1536,8 @@ class ProduceRecognitionSystem:
         
         return mock_data[best_match]
     
-    def capture_and_recognize(self) -> Dict[str, Any]:
-        """Capture image, recognize produce, and return results"""
-        # Capture image from camera
+    def _capture_image(self) -> np.ndarray:
+        """Capture an image from the camera (or a mock image without one)"""
         if self.camera is None or not self.camera.isOpened():
             # Mock image capture
             print("Using mock image capture")
@@ -480,21 +1545,21 @@ class ProduceRecognitionSystem:
             mock_image = np.ones((720, 1280, 3), dtype=np.uint8) * 100
             # Add some random noise to simulate an image
             mock_image = mock_image + np.random.randint(0, 50, size=mock_image.shape, dtype=np.uint8)
-            image = mock_image
-        else:
-            ret, image = self.camera.read()
-            if not ret:
-                raise RuntimeError("Failed to capture image from camera")
-        
-        # Save captured image for debugging
-        cv2.imwrite("captured_image.jpg", image)
-        
-        # Preprocess image
-        preprocessed = self._preprocess_image(image)
-        
-        # Run inference
-        probabilities = self._infer(preprocessed)
+            return mock_image
         
+        ret, image = self.camera.read()
+        if not ret:
+            raise RuntimeError("Failed to capture image from camera")
+        return image
+    
+    def _build_result(
+        self,
+        probabilities: np.ndarray,
+        read_weight,
+        profile_name: str,
+        timing_ms: Dict[str, float]
+    ) -> Dict[str, Any]:
+        """Result JSON for one image's class probabilities; read_weight is only called for confident results"""
         # Get class with highest probability
         class_id = np.argmax(probabilities)
         confidence = probabilities[class_id]
@@ -504,14 +1569,16 @@ class ProduceRecognitionSystem:
             return {
                 "success": False,
                 "message": "Confidence too low",
-                "confidence": float(confidence)
+                "confidence": float(confidence),
+                "profile": profile_name,
+                "timing_ms": timing_ms
             }
         
         # Get class name
         class_name = self.class_mapping[str(class_id)]
         
         # Read weight from scale
-        weight_grams = self._read_scale_weight()
+        weight_grams = read_weight()
         
         # Get produce data
         produce_data = self._get_produce_data(class_id)
@@ -530,11 +1597,58 @@ class ProduceRecognitionSystem:
             "price": round(price, 2) if price is not None else None,
             "price_per_kg": produce_data["price_per_kg"],
             "nutrition_per_100g": produce_data["nutrition"],
+            "profile": profile_name,
+            "timing_ms": timing_ms,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         }
         
         return result
     
+    def capture_and_recognize(self, weight_grams: Optional[float] = None) -> Dict[str, Any]:
+        """Capture image, recognize produce, and return results; a given weight_grams skips the scale read"""
+        # Capture image from camera
+        image = self._capture_image()
+        
+        # Save captured image for debugging
+        cv2.imwrite("captured_image.jpg", image)
+        
+        read_weight = self._read_scale_weight
+        if weight_grams is not None:
+            read_weight = lambda: weight_grams
+        
+        # Skip the model while neither the tray nor the weight changed
+        if self.scene_gate is not None:
+            if weight_grams is None:
+                weight_grams = self._read_scale_weight()
+            read_weight = lambda: weight_grams
+            changed, thumbnail = self.scene_gate.check(image, weight_grams)
+            if not changed:
+                result = self.scene_gate.reuse()
+                result["gate"] = self.scene_gate.stats()
+                return result
+        
+        # Pick the input profile for the current temperature
+        if self.profile_selector is not None:
+            self._activate_profile(self.profile_selector.select())
+        
+        # Preprocess image
+        start = time.perf_counter()
+        preprocessed = self._preprocess_image(image)
+        preprocess_done = time.perf_counter()
+        
+        # Run inference
+        probabilities = self._infer(preprocessed)[0]
+        timing_ms = {
+            "preprocess": round((preprocess_done - start) * 1000, 2),
+            "inference": round((time.perf_counter() - preprocess_done) * 1000, 2),
+        }
+        
+        result = self._build_result(probabilities, read_weight, self.profile["name"], timing_ms)
+        if self.scene_gate is not None:
+            self.scene_gate.update(thumbnail, weight_grams, result)
+            result = dict(result, gate=self.scene_gate.stats())
+        return result
+    
     def close(self):
         """Close resources"""
         if self.camera is not None and self.camera.isOpened():
@@ -542,6 +1656,251 @@ class ProduceRecognitionSystem:
         
         if self.scale is not None:
             self.scale.close()
+        
+        if self.scale_interface is not None:
+            self.scale_interface.disconnect()
+        
+        for backend in self._profile_backends.values():
+            backend.close()
+
+class RecognitionPipeline:
+    """
+    Runs capture, preprocessing, inference and scale reads as concurrent stages
+
+    Each stage has its own thread and bounded queues connect them, so frame
+    N+1 is captured and preprocessed while frame N is inferred, and the scale
+    is read while the model runs. Throughput is set by the slowest stage
+    rather than the sum of all of them; full queues block the capture stage.
+    Frames waiting in the queue let the profile selector pick batched
+    profiles or a lower resolution.
+    """
+    
+    def __init__(
+        self,
+        system: ProduceRecognitionSystem,
+        queue_size: int = 2,
+        frame_interval_s: float = 0.0,
+        max_frames: Optional[int] = None,
+        debug_image_path: Optional[str] = None,
+        batch_timeout_s: float = 0.05
+    ):
+        """
+        Args:
+            system: Initialized recognition system whose camera, scale and backend are used
+            queue_size: Capacity of each queue between stages
+            frame_interval_s: Minimum time between captures (0 = as fast as the pipeline drains)
+            max_frames: Stop after this many frames (None = until stop() is called)
+            debug_image_path: Optional path the latest captured image is written to
+            batch_timeout_s: Longest wait for the frames of a batched profile to finish preprocessing
+        """
+        self.system = system
+        # Preprocessed frames stay alive in the queue, the held frame and the batch being inferred
+        system.preprocessor = Preprocessor(num_buffers=2 * queue_size + 2,
+                                           frame_input=system.preprocessor.frame_input)
+        self.frame_interval_s = frame_interval_s
+        self.max_frames = max_frames
+        self.debug_image_path = debug_image_path
+        self.max_batch = queue_size
+        self.batch_timeout_s = batch_timeout_s
+        
+        self.capture_queue = queue.Queue(maxsize=queue_size)
+        self.preprocessed_queue = queue.Queue(maxsize=queue_size)
+        self.scale_queue = queue.Queue(maxsize=queue_size)
+        self.weight_queue = queue.Queue(maxsize=queue_size)
+        self.result_queue = queue.Queue(maxsize=queue_size)
+        
+        self.error = None
+        self._stop = threading.Event()
+        self._held = None
+        self._ended = False
+        self._threads = [
+            threading.Thread(target=self._run_stage, args=(stage,), name=stage.__name__, daemon=True)
+            for stage in (self._capture_stage, self._preprocess_stage, self._scale_stage, self._inference_stage)
+        ]
+    
+    def _put(self, q: queue.Queue, item) -> bool:
+        """Put an item, giving up once the pipeline is stopped"""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _get(self, q: queue.Queue):
+        """Get an item, or None once the pipeline is stopped"""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+    
+    def _run_stage(self, stage):
+        try:
+            stage()
+        except Exception as e:
+            print(f"Pipeline stage {stage.__name__} failed: {str(e)}")
+            self.error = e
+            self._stop.set()
+    
+    def _capture_stage(self):
+        frame_id = 0
+        while self.max_frames is None or frame_id < self.max_frames:
+            started = time.perf_counter()
+            image = self.system._capture_image()
+            if self.debug_image_path:
+                cv2.imwrite(self.debug_image_path, image)
+            
+            frame = {"frame_id": frame_id, "image": image, "captured": started}
+            # The scale is read for every frame, while the frame is preprocessed and inferred
+            if not (self._put(self.scale_queue, frame_id) and self._put(self.capture_queue, frame)):
+                return
+            frame_id += 1
+            
+            remaining = self.frame_interval_s - (time.perf_counter() - started)
+            if remaining > 0 and self._stop.wait(remaining):
+                return
+        
+        # End of stream
+        self._put(self.scale_queue, None)
+        self._put(self.capture_queue, None)
+    
+    def _preprocess_stage(self):
+        system = self.system
+        while True:
+            frame = self._get(self.capture_queue)
+            if frame is None:
+                self._put(self.preprocessed_queue, None)
+                return
+            
+            # Pick the profile for the current temperature and the frames waiting behind this one
+            profile = system.profile
+            if system.profile_selector is not None:
+                waiting = self.capture_queue.qsize() + self.preprocessed_queue.qsize()
+                profile = system.profile_selector.select(waiting, self.max_batch)
+            
+            start = time.perf_counter()
+            frame["preprocessed"] = system._preprocess_image(frame.pop("image"), profile)
+            frame["profile"] = profile
+            frame["preprocess_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            if not self._put(self.preprocessed_queue, frame):
+                return
+    
+    def _scale_stage(self):
+        while True:
+            frame_id = self._get(self.scale_queue)
+            if frame_id is None:
+                return
+            if not self._put(self.weight_queue, (frame_id, self.system._read_scale_weight())):
+                return
+    
+    def _single_profile(self, profile: Dict[str, Any]) -> Dict[str, Any]:
+        """Batch-1 profile at the resolution of a batched one"""
+        for candidate in self.system.profiles:
+            if candidate["batch_size"] == 1 and candidate["resolution"] == profile["resolution"]:
+                return candidate
+        return profile
+    
+    def _next_batch(self) -> Optional[List[Dict[str, Any]]]:
+        """
+        Next preprocessed frame plus the following frames that fit in its profile's batch
+
+        Batched profiles are picked while frames are still being preprocessed,
+        so the batch waits up to batch_timeout_s for them. A batch that still
+        comes up short is padded, or runs on the batch-1 profile if only one
+        frame arrived.
+        """
+        if self._held is not None:
+            first, self._held = self._held, None
+        elif self._ended:
+            return None
+        else:
+            first = self._get(self.preprocessed_queue)
+        if first is None:
+            return None
+        
+        frames = [first]
+        profile = first["profile"]
+        deadline = time.perf_counter() + self.batch_timeout_s
+        while len(frames) < profile["batch_size"] and not self._ended:
+            try:
+                frame = self.preprocessed_queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if frame is None:
+                self._ended = True
+                break
+            if frame["profile"]["resolution"] != profile["resolution"]:
+                # Different input size: starts the next batch
+                self._held = frame
+                break
+            frames.append(frame)
+        
+        if len(frames) == 1 and profile["batch_size"] > 1:
+            # Same input size, so the preprocessed frame is valid for the single-image profile
+            first["profile"] = self._single_profile(profile)
+        return frames
+    
+    def _weight_for(self, frame_id: int) -> Optional[float]:
+        """Scale reading taken for a frame (readings arrive in capture order)"""
+        while True:
+            item = self._get(self.weight_queue)
+            if item is None:
+                return None
+            if item[0] == frame_id:
+                return item[1]
+    
+    def _inference_stage(self):
+        system = self.system
+        while True:
+            frames = self._next_batch()
+            if frames is None:
+                self._put(self.result_queue, None)
+                return
+            
+            profile = frames[0]["profile"]
+            system._activate_profile(profile)
+            start = time.perf_counter()
+            probabilities = system._infer(np.concatenate([f["preprocessed"] for f in frames]))
+            inference_ms = round((time.perf_counter() - start) * 1000, 2)
+            
+            for frame, frame_probabilities in zip(frames, probabilities):
+                weight_grams = self._weight_for(frame["frame_id"])
+                timing_ms = {
+                    "preprocess": frame["preprocess_ms"],
+                    "inference": inference_ms,
+                    "batch_size": len(frames),
+                }
+                result = system._build_result(frame_probabilities, lambda: weight_grams,
+                                              profile["name"], timing_ms)
+                timing_ms["total"] = round((time.perf_counter() - frame["captured"]) * 1000, 2)
+                result["frame_id"] = frame["frame_id"]
+                if not self._put(self.result_queue, result):
+                    return
+    
+    def start(self):
+        """Start the stage threads"""
+        for thread in self._threads:
+            thread.start()
+    
+    def results(self):
+        """Yield results in capture order until the stream ends or the pipeline is stopped"""
+        while True:
+            result = self._get(self.result_queue)
+            if result is None:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield result
+    
+    def stop(self):
+        """Stop every stage and wait for the threads"""
+        self._stop.set()
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join(timeout=5)
 
 def main():
     """Main function"""
@@ -553,20 +1912,93 @@ def main():
     parser.add_argument("--confidence", type=float, default=0.7, help="Minimum confidence threshold")
     parser.add_argument("--continuous", action="store_true", help="Run in continuous mode")
     parser.add_argument("--output", type=str, default=None, help="Output JSON file (default: print to stdout)")
+    parser.add_argument("--backend", type=str, default="auto", choices=["auto", "tensorrt", "onnxruntime"], help="Inference backend")
+    parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime intra-op threads (0 = all cores)")
+    parser.add_argument("--inter_op_threads", type=int, default=1, help="ONNX Runtime inter-op threads")
+    parser.add_argument("--profile", type=str, default="auto", help="Input profile name, or auto to adapt to temperature and load")
+    parser.add_argument("--throttle_temp", type=float, default=75.0, help="SoC temperature (C) at which auto lowers the resolution")
+    parser.add_argument("--pipelined", action="store_true", help="Continuous mode with capture, preprocessing, inference and scale reads running concurrently")
+    parser.add_argument("--queue_size", type=int, default=2, help="Capacity of the queues between pipeline stages")
+    parser.add_argument("--frame_interval", type=float, default=0.0, help="Minimum seconds between captures in pipelined mode")
+    parser.add_argument("--batch_timeout", type=float, default=0.05, help="Longest wait in seconds to fill a batched profile in pipelined mode")
+    parser.add_argument("--scene_gate", action="store_true", help="Reuse the last result while the scene and weight are unchanged (not in pipelined mode)")
+    parser.add_argument("--scene_threshold", type=float, default=4.0, help="Mean thumbnail difference (0-255) that counts as a scene change")
+    parser.add_argument("--weight_threshold", type=float, default=2.0, help="Weight change (grams) that counts as a scene change")
+    parser.add_argument("--max_skip_time", type=float, default=60.0, help="Longest time (s) a result is reused by the scene gate")
+    parser.add_argument("--event_driven", action="store_true", help="Recognize once whenever the weight on the scale settles (needs scale_integration.py)")
+    parser.add_argument("--scale_type", type=str, default="generic", choices=["dymo", "mettler", "generic"], help="Scale driver for --event_driven")
+    parser.add_argument("--zero_threshold", type=float, default=5.0, help="Weight (grams) up to which the scale counts as empty")
+    parser.add_argument("--stable_readings", type=int, default=3, help="Consecutive agreeing readings that count as a settled weight")
+    parser.add_argument("--stable_tolerance", type=float, default=1.0, help="Largest spread (grams) of settled readings")
+    parser.add_argument("--debounce", type=float, default=1.0, help="Minimum seconds between event-driven recognitions")
+    parser.add_argument("--benchmark_preprocess", type=int, default=0, help="Benchmark preprocessing over N frames at the model input size and exit")
     
     args = parser.parse_args()
     
+    if args.benchmark_preprocess:
+        with open(os.path.join(args.model_dir, "deployment_info.json"), "r") as f:
+            deployment_info = json.load(f)
+        height, width = input_size(deployment_info["input_shape"], deployment_info.get("input_format", {}))
+        stats = benchmark_preprocessing(height, width, args.benchmark_preprocess)
+        print(f"Preprocessing {height}x{width}: reference {stats['reference_ms']:.2f} ms, "
+              f"buffered {stats['buffered_ms']:.2f} ms per frame ({stats['speedup']:.1f}x), outputs identical")
+        return
+    
+    scale_interface = None
+    if args.event_driven:
+        from scale_integration import ScaleEventScheduler, create_scale_interface
+        scale_interface = create_scale_interface(args.scale_type, args.scale_port, args.scale_baudrate)
+        if not scale_interface.connect():
+            print("Event-driven mode needs a connected scale. Exiting.")
+            return
+    
     # Create produce recognition system
     system = ProduceRecognitionSystem(
         model_dir=args.model_dir,
         scale_port=args.scale_port,
         scale_baudrate=args.scale_baudrate,
         camera_id=args.camera_id,
-        confidence_threshold=args.confidence
+        confidence_threshold=args.confidence,
+        backend=args.backend,
+        intra_op_threads=args.threads,
+        inter_op_threads=args.inter_op_threads,
+        profile=args.profile,
+        throttle_temp_c=args.throttle_temp,
+        scene_gate=SceneChangeGate(args.scene_threshold, args.weight_threshold, args.max_skip_time)
+        if args.scene_gate else None,
+        scale_interface=scale_interface
     )
     
+    pipeline = None
     try:
-        if args.continuous:
+        if args.event_driven:
+            print("Waiting for items on the scale. Press Ctrl+C to stop.")
+            scheduler = ScaleEventScheduler(
+                scale_interface, zero_threshold_g=args.zero_threshold, stable_tolerance_g=args.stable_tolerance,
+                stable_readings=args.stable_readings, debounce_s=args.debounce
+            )
+            for weight_grams in scheduler.events():
+                settled = time.perf_counter()
+                result = system.capture_and_recognize(weight_grams)
+                result["trigger_latency_ms"] = round((time.perf_counter() - settled) * 1000, 2)
+                print(json.dumps(result, indent=2))
+                
+                if args.output:
+                    with open(args.output, "w") as f:
+                        json.dump(result, f, indent=2)
+        elif args.pipelined:
+            print("Running in pipelined mode. Press Ctrl+C to stop.")
+            pipeline = RecognitionPipeline(system, queue_size=args.queue_size,
+                                           frame_interval_s=args.frame_interval,
+                                           batch_timeout_s=args.batch_timeout)
+            pipeline.start()
+            for result in pipeline.results():
+                print(json.dumps(result, indent=2))
+                
+                if args.output:
+                    with open(args.output, "w") as f:
+                        json.dump(result, f, indent=2)
+        elif args.continuous:
             print("Running in continuous mode. Press Ctrl+C to stop.")
             while True:
                 result = system.capture_and_recognize()
@@ -597,6 +2029,11 @@ def main():
         print("Interrupted by user")
     finally:
         # Clean up resources
+        if pipeline is not None:
+            pipeline.stop()
+        if system.scene_gate is not None:
+            stats = system.scene_gate.stats()
+            print(f"Scene gate: {stats['inferences']} inferences, {stats['skipped']} skipped")
         system.close()
 
 if __name__ == "__main__":
@@ -637,6 +2074,7 @@ Compatible scale protocols:
 import time
 import serial
 import argparse
+from collections import deque
 from typing import Dict, Any, Optional, List
 
 class ScaleInterface:
@@ -921,6 +2359,87 @@ class GenericScaleInterface(ScaleInterface):
             print(f"Error checking generic scale stability: {str(e)}")
             return False
 
+class ScaleEventScheduler:
+    """
+    Turns a stream of scale readings into recognition triggers
+
+    One trigger fires when the weight leaves zero and settles: the last
+    stable_readings readings agree within stable_tolerance_g. Further
+    triggers need the settled weight to move by retrigger_delta_g (items
+    added or removed) and are at least debounce_s apart. Taking everything
+    off the scale resets the scheduler. Readings of None (drivers that only
+    report settled weights, or failed reads) count as unsettled.
+    """
+    
+    def __init__(
+        self,
+        scale: ScaleInterface,
+        zero_threshold_g: float = 5.0,
+        stable_tolerance_g: float = 1.0,
+        stable_readings: int = 3,
+        retrigger_delta_g: float = 10.0,
+        debounce_s: float = 1.0,
+        poll_interval_s: float = 0.0
+    ):
+        """
+        Args:
+            scale: Connected scale driver
+            zero_threshold_g: Weights up to this count as an empty scale
+            stable_tolerance_g: Largest spread of readings that counts as settled
+            stable_readings: Consecutive readings that must agree
+            retrigger_delta_g: Settled weight change that triggers another recognition
+            debounce_s: Minimum time between triggers
+            poll_interval_s: Extra delay between readings (drivers already wait for the reply)
+        """
+        self.scale = scale
+        self.zero_threshold_g = zero_threshold_g
+        self.stable_tolerance_g = stable_tolerance_g
+        self.stable_readings = stable_readings
+        self.retrigger_delta_g = retrigger_delta_g
+        self.debounce_s = debounce_s
+        self.poll_interval_s = poll_interval_s
+        self.readings = deque(maxlen=stable_readings)
+        self.triggered_weight = None
+        self.last_trigger = 0.0
+        self.triggers = 0
+    
+    def update(self, weight: Optional[float], now: float) -> Optional[float]:
+        """Feed one reading; returns the settled weight when it triggers a recognition"""
+        if weight is None:
+            self.readings.clear()
+            return None
+        
+        if weight <= self.zero_threshold_g:
+            # Scale emptied: the next load triggers again
+            self.readings.clear()
+            self.triggered_weight = None
+            return None
+        
+        self.readings.append(weight)
+        if (len(self.readings) < self.stable_readings
+                or max(self.readings) - min(self.readings) > self.stable_tolerance_g):
+            return None
+        
+        settled = sum(self.readings) / len(self.readings)
+        if self.triggered_weight is not None and (
+                abs(settled - self.triggered_weight) < self.retrigger_delta_g
+                or now - self.last_trigger < self.debounce_s):
+            return None
+        
+        self.triggered_weight = settled
+        self.last_trigger = now
+        self.triggers += 1
+        return settled
+    
+    def events(self):
+        """Poll the scale and yield the settled weight of every trigger"""
+        while True:
+            settled = self.update(self.scale.read_weight(), time.monotonic())
+            if settled is not None:
+                yield settled
+            if self.poll_interval_s:
+                time.sleep(self.poll_interval_s)
+
 def create_scale_interface(
     scale_type: str, 
     port: str, 
@@ -988,7 +2507,7 @@ def main():
                 print("Failed to read weight")
     
     except KeyboardInterrupt:
-        print("\nInterrupted by user")
+        print("\\nInterrupted by user")
     finally:
         # Disconnect from scale
         scale.disconnect()
@@ -1018,37 +2537,268 @@ def main():
     parser.add_argument("--output_dir", type=str, default="./deployment", help="Output directory for TensorRT model")
     parser.add_argument("--num_classes", type=int, required=True, help="Number of classes in the model")
     parser.add_argument("--precision", type=str, default="fp16", choices=["fp32", "fp16", "int8"], help="Precision for TensorRT model")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version (17+ exports native LayerNormalization)")
+    parser.add_argument("--optimization_level", type=str, default="extended", choices=["none"] + list(OPTIMIZATION_LEVELS),
+                        help="ONNX Runtime offline graph optimization level (\"all\" is CPU-specific: reported, not packaged)")
+    parser.add_argument("--parity_samples", type=int, default=16, help="Sample inputs for the PyTorch/ONNX parity check")
+    parser.add_argument("--timing_runs", type=int, default=50, help="Timed batch-1 runs per model in the parity report")
+    parser.add_argument("--data_dir", type=str, default=None, help="Dataset directory; val images are used for calibration, parity and accuracy")
+    parser.add_argument("--calibration_samples", type=int, default=256, help="Validation images used for INT8 calibration")
+    parser.add_argument("--eval_samples", type=int, default=512, help="Validation images used to measure the INT8 accuracy drop")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1], help="Batch sizes of the deployed input profiles")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[224], help="Input resolutions of the deployed profiles (multiples of 32)")
+    parser.add_argument("--profile_runs", type=int, default=20, help="Timed runs per input profile")
+    parser.add_argument("--compare_precisions", action="store_true",
+                        help="Build fp32/fp16/int8 (and optimized) variants in parallel and write a comparison report instead of a package")
+    parser.add_argument("--compare_workers", type=int, default=3, help="Worker processes for --compare_precisions")
+    parser.add_argument("--compare_batch_size", type=int, default=8, help="Batch size of the throughput measurement in --compare_precisions")
+    parser.add_argument("--prune_keep_ratio", type=float, default=None, help="Prune ConvNeXt block MLPs to this fraction of their channels before export")
+    parser.add_argument("--prune_epochs", type=int, default=2, help="Recovery fine-tuning epochs after pruning (needs --data_dir)")
+    parser.add_argument("--cache_dir", type=str, default=os.path.expanduser("~/.cache/produce_recognition/artifacts"),
+                        help="Content-addressed cache of converted artifacts")
+    parser.add_argument("--cache_max_gb", type=float, default=20.0, help="Cache size budget; least recently used entries are evicted beyond it")
+    parser.add_argument("--no_cache", action="store_true", help="Rebuild every artifact without using the cache")
+    parser.add_argument("--frame_input", action="store_true",
+                        help="Export a model taking uint8 NHWC BGR frames, with normalization built into the graph")
     
     args = parser.parse_args()
+    if args.precision == "int8" and not args.data_dir:
+        parser.error("--precision int8 needs --data_dir for calibration")
+    if args.precision == "int8" and (args.calibration_samples < 1 or args.eval_samples < 1):
+        parser.error("--precision int8 needs --calibration_samples and --eval_samples of at least 1")
+    if args.frame_input and args.compare_precisions:
+        parser.error("--compare_precisions does not support --frame_input")
     
     # Create output directory
     os.makedirs(args.output_dir, exist_ok=True)
     
     # Step 1: Load PyTorch model
     print("Loading PyTorch model...")
-    model, class_mapping = load_pytorch_model(args.model_path, args.num_classes)
-    print(f"Model loaded with {args.num_classes} output classes")
+    model, class_mapping, arch = load_pytorch_model(args.model_path, args.num_classes)
+    print(f"{BACKBONES[arch]['display_name']} model loaded with {args.num_classes} output classes")
+    
+    # Artifacts are cached under a hash of everything they are built from
+    cache = None if args.no_cache else ArtifactCache(args.cache_dir, max_bytes=int(args.cache_max_gb * 1e9))
+    def cached(key_fields: Dict[str, Any], filename: str, build) -> Optional[str]:
+        if cache is None:
+            return build(os.path.join(args.output_dir, filename))
+        return cache.get_or_build(key_fields, filename, build, args.output_dir)
+    
+    def write_json(path: str, report: Dict) -> str:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        return path
+    
+    reports = {}
+    checkpoint_key = {"checkpoint": hash_file(args.model_path)}
+    
+    # Step 1b: Structured pruning with recovery fine-tuning
+    if args.prune_keep_ratio is not None:
+        from prune_model import prune_and_recover
+        print(f"Pruning MLP channels (keeping {args.prune_keep_ratio:.0%})...")
+        checkpoint_key["pruning"] = {"keep_ratio": args.prune_keep_ratio,
+                                     "data": dataset_key(args.data_dir, ("train", "val")),
+                                     "epochs": args.prune_epochs if args.data_dir else 0,
+                                     "converter_version": CONVERTER_VERSION}
+        
+        def build_pruned(path: str) -> str:
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            pruned, report = prune_and_recover(model.to(device), args.prune_keep_ratio, device,
+                                               data_dir=args.data_dir, epochs=args.prune_epochs)
+            torch.save({
+                'arch': arch,
+                'mlp_hidden_dims': report["mlp_hidden_dims"],
+                'model_state_dict': pruned.cpu().state_dict(),
+                'class_to_idx': class_mapping,
+                'pruning_report': report,
+            }, path)
+            return path
+        pruned_path = cached(dict(checkpoint_key, stage="pruned"), "model_pruned.pth", build_pruned)
+        model, class_mapping, arch = load_pytorch_model(pruned_path, args.num_classes)
+        reports["pruning_report"] = torch.load(pruned_path, map_location="cpu")["pruning_report"]
+    
+    # Input profiles, default first: smallest batch at the largest resolution
+    batch_sizes = sorted(set(args.batch_sizes))
+    resolutions = sorted(set(args.resolutions), reverse=True)
+    dynamic_resolution = resolutions != [INPUT_SHAPE[2]]
+    
+    # Frame-input exports (and their parity reference) take camera frames instead of normalized images
+    export_model = FrameInputModel(model) if args.frame_input else model
+    prepare_inputs = to_frames if args.frame_input else (lambda images: images)
     
     # Step 2: Convert to ONNX
     print("Converting model to ONNX format...")
-    onnx_path = os.path.join(args.output_dir, "model.onnx")
-    convert_to_onnx(model, onnx_path)
+    onnx_key = {
+        "stage": "onnx",
+        **checkpoint_key,
+        "opset": args.opset,
+        "input_shape": list(INPUT_SHAPE),
+        "dynamic_resolution": dynamic_resolution,
+        "frame_input": args.frame_input,
+        "converter_version": CONVERTER_VERSION,
+        "torch": torch.__version__,
+    }
+    onnx_path = cached(onnx_key, "model.onnx",
+                       lambda path: convert_to_onnx(export_model, path, INPUT_SHAPE, opset_version=args.opset,
+                                                    dynamic_resolution=dynamic_resolution,
+                                                    frame_input=args.frame_input))
+    onnx_paths = {"onnx_raw": onnx_path}
+    onnx_keys = {"onnx_raw": onnx_key}
+    
+    # Step 2b: Offline graph optimization and parity check against PyTorch
+    if args.optimization_level != "none":
+        print(f"Optimizing ONNX graph ({args.optimization_level})...")
+        onnx_keys["onnx_optimized"] = optimized_key(onnx_key, args.optimization_level)
+        onnx_paths["onnx_optimized"] = cached(
+            onnx_keys["onnx_optimized"], "model_optimized.onnx",
+            lambda path: optimize_onnx(onnx_path, path, args.optimization_level)
+        )
+    
+    # Disjoint validation images for calibration and evaluation
+    eval_images = eval_labels = None
+    num_calibration = args.calibration_samples
+    if args.data_dir:
+        print("Loading validation samples...")
+        images, labels = load_val_samples(args.data_dir, args.calibration_samples + args.eval_samples, class_mapping)
+        images = prepare_inputs(images)
+        requested = args.calibration_samples + args.eval_samples
+        if len(images) < requested:
+            # Small validation split: divide it in the requested proportion
+            num_calibration = len(images) * args.calibration_samples // max(requested, 1)
+            if args.eval_samples:
+                num_calibration = max(1, min(num_calibration, len(images) - 1))
+            print(f"Only {len(images)} validation images: {num_calibration} for calibration, "
+                  f"{len(images) - num_calibration} for evaluation")
+        if args.precision == "int8" and (num_calibration < 1 or num_calibration >= len(images)):
+            parser.error(f"--precision int8 needs at least 2 validation images, found {len(images)}")
+        calibration_images = images[:num_calibration]
+        eval_images, eval_labels = images[num_calibration:], labels[num_calibration:]
+    
+    # Comparison mode: build every precision from this export in parallel and report instead of packaging
+    if args.compare_precisions:
+        report = compare_precisions(
+            onnx_path, onnx_key, args.output_dir, None if args.no_cache else args.cache_dir,
+            args.optimization_level, calibration_images if args.data_dir else None,
+            eval_images, eval_labels, workers=args.compare_workers,
+            batch_size=args.compare_batch_size, runs=args.timing_runs
+        )
+        report_path = write_json(os.path.join(args.output_dir, "precision_comparison.json"), report)
+        print(f"Precision comparison written to {report_path}")
+        return
+    
+    # Step 2c: INT8 static quantization
+    if args.precision == "int8":
+        print("Quantizing ONNX model to INT8...")
+        onnx_keys["onnx_int8"] = int8_key(onnx_key, calibration_images)
+        onnx_paths["onnx_int8"] = cached(
+            onnx_keys["onnx_int8"], "model_int8.onnx",
+            lambda path: quantize_onnx_int8(onnx_path, path, calibration_images)
+        )
     
-    # Step 3: Convert ONNX to TensorRT
+    print("Checking ONNX parity against PyTorch...")
+    if eval_images is not None and len(eval_images):
+        sample_inputs = eval_images[:args.parity_samples]
+    else:
+        sample_inputs = prepare_inputs(np.random.default_rng(0).standard_normal(
+            (args.parity_samples, 3, 224, 224), dtype=np.float32))
+    
+    def build_parity_report(path: str) -> str:
+        report = check_onnx_parity(export_model, onnx_paths, sample_inputs, args.timing_runs)
+        report["opset"] = args.opset
+        report["optimization_level"] = args.optimization_level
+        return write_json(path, report)
+    # Reports measured with sessions that optimize on load (older ones did not); they
+    # hold latencies, so they are only reused on the same hardware
+    parity_key = {"stage": "parity", "models": onnx_keys, "timing_runs": args.timing_runs, "session": "optimized",
+                  "host": host_id(),
+                  "samples": hashlib.sha1(sample_inputs.tobytes()).hexdigest()}
+    with open(cached(parity_key, "parity_report.json", build_parity_report), "r") as f:
+        parity_report = json.load(f)
+    reports["parity_report"] = parity_report
+    
+    if args.precision == "int8":
+        def build_quantization_report(path: str) -> str:
+            fp32_acc = onnx_accuracy(onnx_path, eval_images, eval_labels)
+            int8_acc = onnx_accuracy(onnx_paths["onnx_int8"], eval_images, eval_labels)
+            timing = parity_report["timing"]
+            return write_json(path, {
+                "calibration_samples": len(calibration_images),
+                "eval_samples": len(eval_images),
+                "fp32_accuracy": fp32_acc,
+                "int8_accuracy": int8_acc,
+                "accuracy_drop": fp32_acc - int8_acc,
+                "speedup_p50": timing["onnx_raw"]["p50_ms"] / timing["onnx_int8"]["p50_ms"],
+            })
+        quantization_key = dict(parity_key, stage="quantization",
+                                eval=hashlib.sha1(eval_images.tobytes() + eval_labels.tobytes()).hexdigest())
+        with open(cached(quantization_key, "quantization_report.json", build_quantization_report), "r") as f:
+            quantization_report = json.load(f)
+        reports["quantization_report"] = quantization_report
+        print(f"INT8 accuracy {quantization_report['int8_accuracy']:.2f}% vs fp32 "
+              f"{quantization_report['fp32_accuracy']:.2f}% "
+              f"({quantization_report['accuracy_drop']:+.2f} points drop), "
+              f"{quantization_report['speedup_p50']:.2f}x faster")
+    
+    # Step 3: Measure latency and accuracy of every input profile on the packaged model
+    # Layout transformations of the "all" level only suit this host's CPU: that model is kept for the
+    # local reports, and the package gets the portable export that the runtime optimizes on the device
+    package_optimized = (args.precision != "int8" and "onnx_optimized" in onnx_paths
+                         and args.optimization_level != "all")
+    if args.precision == "int8":
+        package_onnx = onnx_paths["onnx_int8"]
+    else:
+        package_onnx = onnx_paths["onnx_optimized"] if package_optimized else onnx_path
+        if args.optimization_level == "all":
+            print("Packaging the unoptimized export; the runtime applies the \"all\" level on the device")
+    package_key = onnx_keys["onnx_int8" if args.precision == "int8" else
+                            "onnx_optimized" if package_optimized else "onnx_raw"]
+    
+    def build_profile_report(path: str) -> str:
+        eval_sets = {}
+        if args.data_dir:
+            for resolution in resolutions:
+                images, labels = load_val_samples(args.data_dir, args.eval_samples, class_mapping,
+                                                  resolution=resolution, skip=num_calibration)
+                eval_sets[resolution] = (prepare_inputs(images), labels)
+        print("Benchmarking input profiles...")
+        return write_json(path, {"profiles": benchmark_profiles(package_onnx, batch_sizes, resolutions,
+                                                                eval_sets, args.profile_runs, args.frame_input,
+                                                                package_optimized)})
+    profile_key = {"stage": "profiles", "model": package_key, "session": "optimized", "host": host_id(),
+                   "batch_sizes": batch_sizes,
+                   "resolutions": resolutions, "runs": args.profile_runs, "data": dataset_key(args.data_dir),
+                   "eval_samples": args.eval_samples if args.data_dir else None}
+    with open(cached(profile_key, "profile_report.json", build_profile_report), "r") as f:
+        profiles = json.load(f)["profiles"]
+    reports["profile_report"] = {"profiles": [dict(profile) for profile in profiles]}
+    
+    # Step 4: Convert ONNX to TensorRT, one engine per input profile
     print(f"Converting ONNX model to TensorRT with {args.precision} precision...")
-    tensorrt_path = os.path.join(args.output_dir, f"model_{args.precision}.engine")
-    convert_onnx_to_tensorrt(onnx_path, tensorrt_path, args.precision)
+    engine_source = "onnx_int8" if args.precision == "int8" else "onnx_raw"
+    for profile in profiles:
+        profile["engine_path"] = cached(
+            engine_key(onnx_keys[engine_source], args.precision, profile["input_shape"]),
+            f"model_{args.precision}_{profile['name']}.engine",
+            lambda path: convert_onnx_to_tensorrt(onnx_paths[engine_source], path, args.precision,
+                                                  tuple(profile["input_shape"]))
+        )
+    tensorrt_path = profiles[0]["engine_path"]
     
-    # Step 4: Create deployment package
+    # Step 5: Create deployment package
     print("Creating deployment package...")
     package_dir = os.path.join(args.output_dir, "deploy_package")
-    create_deployment_package(tensorrt_path, class_mapping, package_dir)
-    
-    # Step 5: Create inference script
+    create_deployment_package(tensorrt_path, class_mapping, package_dir, arch=arch,
+                              precision=args.precision, onnx_path=package_onnx,
+                              onnx_precision="int8" if args.precision == "int8" else "fp32",
+                              reports=reports, profiles=profiles,
+                              model_input_format=input_format(args.frame_input,
+                                                              args.frame_input and export_model.folded))
+    
+    # Step 6: Create inference script
     print("Creating inference script...")
     create_inference_script(package_dir)
     
-    # Step 6: Create scale integration script
+    # Step 7: Create scale integration script
     print("Creating scale integration script...")
     create_scale_integration_script(package_dir)
     
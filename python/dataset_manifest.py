@@ -0,0 +1,239 @@
+"""
+Produce Recognition System - Dataset Manifest
+This script maintains a persisted manifest of each dataset split (path, label,
+file size, mtime and optional content hash), so datasets are listed without
+globbing the whole split on every construction. Only class directories whose
+mtime changed since the last run are listed again.
+"""
+
+import os
+import argparse
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Per-file status flags
+OK = 0
+CORRUPT = 1
+DUPLICATE = 2
+
+
+class SplitManifest:
+    """Columnar listing of the images of one dataset split"""
+
+    def __init__(self,
+                 classes: List[str],
+                 dir_mtimes: np.ndarray,
+                 paths: np.ndarray,
+                 labels: np.ndarray,
+                 sizes: np.ndarray,
+                 mtimes: np.ndarray,
+                 hashes: np.ndarray,
+                 flags: np.ndarray,
+                 hash_files: bool = False):
+        """
+        Args:
+            classes: Sorted class directory names
+            dir_mtimes: mtime_ns of each class directory when it was last listed
+            paths: Image paths relative to the split directory
+            labels: Class index of each image
+            sizes: File size in bytes
+            mtimes: File mtime_ns
+            hashes: Content hash (empty if not computed)
+            flags: OK, CORRUPT or DUPLICATE
+            hash_files: Whether content hashes are maintained
+        """
+        self.classes = classes
+        self.dir_mtimes = dir_mtimes
+        self.paths = paths
+        self.labels = labels
+        self.sizes = sizes
+        self.mtimes = mtimes
+        self.hashes = hashes
+        self.flags = flags
+        self.hash_files = hash_files
+
+    def __len__(self):
+        return len(self.paths)
+
+    def samples(self, split_dir: Path, include_flagged: bool = False) -> List[Path]:
+        """Absolute image paths, skipping corrupt and duplicate files by default"""
+        keep = np.ones(len(self.paths), dtype=bool) if include_flagged else self.flags == OK
+        return [split_dir / p for p in self.paths[keep]]
+
+    def save(self, manifest_path: str):
+        """Write the manifest atomically"""
+        os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+        # Per-process name: every torchrun rank may refresh the same manifest
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path,
+                 classes=np.array(self.classes, dtype=str),
+                 dir_mtimes=self.dir_mtimes,
+                 paths=self.paths.astype(str),
+                 labels=self.labels,
+                 sizes=self.sizes,
+                 mtimes=self.mtimes,
+                 hashes=self.hashes.astype("S40"),
+                 flags=self.flags,
+                 hash_files=np.array(self.hash_files))
+        os.replace(tmp_path, manifest_path)
+
+    @classmethod
+    def load(cls, manifest_path: str) -> "SplitManifest":
+        data = np.load(manifest_path)
+        return cls(classes=data["classes"].tolist(),
+                   dir_mtimes=data["dir_mtimes"],
+                   paths=data["paths"],
+                   labels=data["labels"],
+                   sizes=data["sizes"],
+                   mtimes=data["mtimes"],
+                   hashes=data["hashes"],
+                   flags=data["flags"],
+                   hash_files=bool(data["hash_files"]))
+
+
+def _is_valid_image(path: str) -> bool:
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            image.verify()
+        return True
+    except Exception:
+        return False
+
+
+def update_manifest(split_dir: Path,
+                    manifest_path: str,
+                    hash_files: bool = False,
+                    verify_images: bool = False,
+                    pattern_suffix: str = ".jpg") -> SplitManifest:
+    """
+    Load the manifest of a split and bring it up to date
+
+    Class directories with an unchanged mtime are taken from the stored
+    manifest without being listed. Files whose size and mtime are unchanged
+    keep their stored hash and status. Note that editing a file in place does
+    not change its directory's mtime; delete the manifest to force a full rescan.
+    """
+    from precompute_sam_masks import hash_image_bytes
+
+    split_dir = Path(split_dir)
+    old = None
+    if os.path.exists(manifest_path):
+        old = SplitManifest.load(manifest_path)
+        if hash_files and not old.hash_files:
+            # Hashes were never computed; every directory has to be visited
+            old.dir_mtimes = np.full_like(old.dir_mtimes, -1)
+        hash_files = hash_files or old.hash_files
+
+    old_dirs: Dict[str, int] = {}
+    if old is not None:
+        old_dirs = {name: int(mtime) for name, mtime in zip(old.classes, old.dir_mtimes)}
+
+    class_dirs = sorted((entry for entry in os.scandir(split_dir) if entry.is_dir()),
+                        key=lambda entry: entry.name)
+    classes = [entry.name for entry in class_dirs]
+    dir_mtimes = np.array([entry.stat().st_mtime_ns for entry in class_dirs], dtype=np.int64)
+
+    # Stored entries grouped by class directory
+    old_entries: Dict[str, Dict[str, tuple]] = {}
+    if old is not None:
+        for path, size, mtime, digest, flag in zip(old.paths, old.sizes, old.mtimes,
+                                                   old.hashes, old.flags):
+            class_name, file_name = str(path).split("/", 1)
+            old_entries.setdefault(class_name, {})[file_name] = (int(size), int(mtime), digest, int(flag))
+
+    paths, labels, sizes, mtimes, hashes, flags = [], [], [], [], [], []
+    rescanned = 0
+    for label, (entry, dir_mtime) in enumerate(zip(class_dirs, dir_mtimes)):
+        stored = old_entries.get(entry.name, {})
+        if old_dirs.get(entry.name) == int(dir_mtime):
+            files = sorted(stored.items())
+        else:
+            rescanned += 1
+            files = []
+            for file_entry in sorted(os.scandir(entry.path), key=lambda e: e.name):
+                if not file_entry.name.endswith(pattern_suffix) or not file_entry.is_file():
+                    continue
+                stat = file_entry.stat()
+                previous = stored.get(file_entry.name)
+                if (previous is not None and previous[:2] == (stat.st_size, stat.st_mtime_ns)
+                        and (previous[2] or not hash_files)):
+                    files.append((file_entry.name, previous))
+                    continue
+
+                digest = b""
+                if hash_files:
+                    with open(file_entry.path, "rb") as f:
+                        digest = hash_image_bytes(f.read()).encode()
+                flag = OK
+                if stat.st_size == 0 or (verify_images and not _is_valid_image(file_entry.path)):
+                    flag = CORRUPT
+                files.append((file_entry.name, (stat.st_size, stat.st_mtime_ns, digest, flag)))
+
+        for file_name, (size, mtime, digest, flag) in files:
+            paths.append(f"{entry.name}/{file_name}")
+            labels.append(label)
+            sizes.append(size)
+            mtimes.append(mtime)
+            hashes.append(digest)
+            flags.append(CORRUPT if flag == CORRUPT else OK)
+
+    # Flag every copy of an already seen content hash as a duplicate
+    if hash_files:
+        seen = set()
+        for i, digest in enumerate(hashes):
+            if not digest or flags[i] == CORRUPT:
+                continue
+            if digest in seen:
+                flags[i] = DUPLICATE
+            seen.add(digest)
+
+    manifest = SplitManifest(classes=classes,
+                             dir_mtimes=dir_mtimes,
+                             paths=np.array(paths, dtype=str),
+                             labels=np.array(labels, dtype=np.int64),
+                             sizes=np.array(sizes, dtype=np.int64),
+                             mtimes=np.array(mtimes, dtype=np.int64),
+                             hashes=np.array(hashes, dtype="S40"),
+                             flags=np.array(flags, dtype=np.int8),
+                             hash_files=hash_files)
+
+    if old is None or rescanned or len(classes) != len(old.classes):
+        try:
+            manifest.save(manifest_path)
+        except OSError as e:
+            print(f"Could not write manifest {manifest_path}: {str(e)}")
+
+    return manifest
+
+
+def manifest_path_for(manifest_dir: str, split: str) -> str:
+    """Location of the manifest of a split"""
+    return os.path.join(manifest_dir, f"{split}.npz")
+
+
+def main(args):
+    """Build or refresh the manifests of the requested splits"""
+    for split in args.splits:
+        manifest = update_manifest(Path(args.data_dir) / split,
+                                   manifest_path_for(args.manifest_dir, split),
+                                   hash_files=args.hash_files,
+                                   verify_images=args.verify_images)
+        corrupt = int((manifest.flags == CORRUPT).sum())
+        duplicates = int((manifest.flags == DUPLICATE).sum())
+        print(f"[{split}] {len(manifest)} files in {len(manifest.classes)} classes, "
+              f"{corrupt} corrupt, {duplicates} duplicates")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build dataset manifests for produce dataset")
+    parser.add_argument("--data_dir", type=str, required=True, help="Path to dataset directory")
+    parser.add_argument("--manifest_dir", type=str, required=True, help="Directory for the manifest files")
+    parser.add_argument("--splits", type=str, nargs="+", default=["train", "val"], help="Dataset splits to index")
+    parser.add_argument("--hash_files", action="store_true", help="Store content hashes and flag duplicate images")
+    parser.add_argument("--verify_images", action="store_true", help="Flag images that fail to decode as corrupt")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,225 @@
+"""
+Produce Recognition System - Knowledge Distillation Script
+This script distills a trained ConvNeXt-Large produce model (teacher) into a
+small student network (ConvNeXt-Tiny, MobileNetV3, ...) that is cheap enough
+for the checkout devices. Teacher logits can be cached on disk once so the
+teacher does not run on every epoch; the student then trains on the same
+fixed, unaugmented view the logits were computed on.
+"""
+
+import os
+import argparse
+import numpy as np
+from typing import Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+from torch.utils.data import DataLoader, Dataset
+
+from backbones import BACKBONES, DEFAULT_ARCH
+from compact_checkpoint import load_checkpoint
+from train_produce_model import (ProduceDataset, CheckpointWriter, build_model,
+                                 build_train_transform, build_val_transform,
+                                 build_embedding_cache, validate)
+
+
+class IndexedDataset(Dataset):
+    """Returns the sample index in place of the mask, to look up cached teacher logits"""
+
+    def __init__(self, dataset: ProduceDataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        image, label, _ = self.dataset[idx]
+        return image, label, idx
+
+
+def distillation_loss(student_logits: torch.Tensor,
+                      teacher_logits: torch.Tensor,
+                      labels: torch.Tensor,
+                      temperature: float = 4.0,
+                      alpha: float = 0.5) -> torch.Tensor:
+    """Hinton KD loss: alpha * CE(labels) + (1 - alpha) * T^2 * KL(teacher || student)"""
+    soft = F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=1),
+        F.softmax(teacher_logits / temperature, dim=1),
+        reduction="batchmean"
+    ) * temperature ** 2
+    hard = F.cross_entropy(student_logits, labels)
+    return alpha * hard + (1 - alpha) * soft
+
+
+def distill_one_epoch(student, teacher, dataloader, optimizer, device,
+                      cached_logits: Optional[torch.Tensor] = None,
+                      temperature: float = 4.0, alpha: float = 0.5):
+    """Train the student for one epoch against live or cached teacher logits"""
+    student.train()
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    total = 0
+
+    for images, labels, indices in dataloader:
+        images = images.to(device, non_blocking=True)
+        labels = labels.to(device, non_blocking=True)
+
+        if cached_logits is not None:
+            teacher_logits = cached_logits[indices].to(device, non_blocking=True).float()
+        else:
+            with torch.no_grad():
+                teacher_logits = teacher(images)
+
+        optimizer.zero_grad(set_to_none=True)
+
+        outputs = student(images)
+        loss = distillation_loss(outputs, teacher_logits, labels, temperature, alpha)
+        loss.backward()
+        optimizer.step()
+
+        running_loss += loss.detach()
+
+        _, predicted = outputs.max(1)
+        total += labels.size(0)
+        correct += predicted.eq(labels).sum()
+
+    return running_loss.item() / len(dataloader), 100 * correct.item() / total
+
+
+def load_teacher(checkpoint_path: str, num_classes: int, device) -> nn.Module:
+    """Load the trained teacher from a train_produce_model.py checkpoint (.pth or .weights)"""
+    checkpoint = load_checkpoint(checkpoint_path)
+    teacher = build_model(num_classes=num_classes, pretrained=False,
+                          arch=checkpoint.get('arch', DEFAULT_ARCH),
+                          mlp_hidden_dims=checkpoint.get('mlp_hidden_dims'))
+    teacher.load_state_dict(checkpoint['model_state_dict'])
+    teacher.eval()
+    for param in teacher.parameters():
+        param.requires_grad_(False)
+    return teacher.to(device)
+
+
+def main(args):
+    """Main distillation function"""
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Using device: {device}")
+
+    train_dataset = ProduceDataset(
+        data_dir=args.data_dir,
+        transform=build_train_transform(),
+        split="train",
+        shard_dir=args.shard_dir,
+        manifest_dir=args.manifest_dir
+    )
+    val_dataset = ProduceDataset(
+        data_dir=args.data_dir,
+        transform=build_val_transform(),
+        split="val",
+        shard_dir=args.shard_dir,
+        manifest_dir=args.manifest_dir
+    )
+    num_classes = len(train_dataset.classes)
+
+    print(f"Loading teacher from {args.teacher_checkpoint}...")
+    teacher = load_teacher(args.teacher_checkpoint, num_classes, device)
+
+    # Teacher logits on the fixed validation view, computed once and memory-mapped
+    cached_logits = None
+    if args.cache_teacher_logits:
+        cache_dir = args.cache_dir or os.path.join(args.output_dir, "teacher_cache")
+        os.makedirs(cache_dir, exist_ok=True)
+        teacher_id = f"{os.path.abspath(args.teacher_checkpoint)}@{os.path.getmtime(args.teacher_checkpoint)}"
+        logits = build_embedding_cache(
+            teacher, train_dataset, os.path.join(cache_dir, "train_logits.npy"), teacher_id, device,
+            [build_val_transform()], batch_size=args.batch_size, num_workers=args.num_workers,
+            feature_fn=teacher, feature_dim=num_classes
+        )
+        cached_logits = torch.from_numpy(np.ascontiguousarray(logits[0]))
+        # The cached logits only match that view, so the student trains on it too
+        # (random crops would be distilled against the teacher's answer for another image)
+        train_dataset.transform = build_val_transform()
+        print("Cached teacher logits: training the student on the fixed view, without augmentation")
+        # The teacher is no longer needed on the device
+        teacher = None
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+
+    train_loader = DataLoader(
+        IndexedDataset(train_dataset),
+        batch_size=args.batch_size,
+        shuffle=True,
+        num_workers=args.num_workers,
+        pin_memory=device.type == "cuda"
+    )
+    val_loader = DataLoader(
+        val_dataset,
+        batch_size=args.batch_size,
+        shuffle=False,
+        num_workers=args.num_workers,
+        pin_memory=device.type == "cuda"
+    )
+
+    student = build_model(num_classes=num_classes, pretrained=True, arch=args.student_arch).to(device)
+    print(f"Student {args.student_arch}: {sum(p.numel() for p in student.parameters()) / 1e6:.1f}M parameters")
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.AdamW(student.parameters(), lr=args.learning_rate, weight_decay=args.weight_decay)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs, eta_min=1e-6)
+    checkpoint_writer = CheckpointWriter()
+
+    best_val_acc = 0.0
+    for epoch in range(1, args.epochs + 1):
+        print(f"Epoch {epoch}/{args.epochs}")
+
+        train_loss, train_acc = distill_one_epoch(
+            student, teacher, train_loader, optimizer, device,
+            cached_logits=cached_logits, temperature=args.temperature, alpha=args.alpha
+        )
+        val_loss, val_acc = validate(student, val_loader, criterion, device)
+        scheduler.step()
+
+        print(f"Train KD Loss: {train_loss:.4f}, Train Acc: {train_acc:.2f}%")
+        print(f"Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.2f}%")
+
+        if val_acc > best_val_acc:
+            best_val_acc = val_acc
+            checkpoint_writer.save({
+                'epoch': epoch,
+                'arch': args.student_arch,
+                'model_state_dict': student.state_dict(),
+                'val_acc': val_acc,
+                'class_to_idx': train_dataset.class_to_idx,
+            }, os.path.join(args.output_dir, 'best_student.pth'))
+            print(f"New best student saved with validation accuracy: {val_acc:.2f}%")
+
+    checkpoint_writer.close()
+    print("Distillation completed!")
+    print(f"Best student validation accuracy: {best_val_acc:.2f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Produce Recognition Distillation Script")
+    parser.add_argument("--data_dir", type=str, required=True, help="Path to dataset directory")
+    parser.add_argument("--teacher_checkpoint", type=str, required=True, help="Trained teacher checkpoint (best_model.pth)")
+    parser.add_argument("--student_arch", type=str, default="convnext_tiny", choices=list(BACKBONES), help="Backbone architecture of the student")
+    parser.add_argument("--output_dir", type=str, default="./output", help="Output directory for saved models")
+    parser.add_argument("--batch_size", type=int, default=64, help="Batch size")
+    parser.add_argument("--epochs", type=int, default=30, help="Number of epochs")
+    parser.add_argument("--learning_rate", type=float, default=5e-4, help="Learning rate")
+    parser.add_argument("--weight_decay", type=float, default=1e-4, help="Weight decay")
+    parser.add_argument("--num_workers", type=int, default=4, help="Number of workers for data loading")
+    parser.add_argument("--temperature", type=float, default=4.0, help="Distillation temperature")
+    parser.add_argument("--alpha", type=float, default=0.5, help="Weight of the hard-label loss")
+    parser.add_argument("--cache_teacher_logits", action="store_true", help="Compute teacher logits once on the fixed view and cache them on disk; the student then trains on that view without augmentation")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Teacher logits cache directory (default: <output_dir>/teacher_cache)")
+    parser.add_argument("--shard_dir", type=str, default=None, help="Directory of shards built with build_dataset_shards.py")
+    parser.add_argument("--manifest_dir", type=str, default=None, help="Directory of dataset manifests (see dataset_manifest.py)")
+
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    main(args)
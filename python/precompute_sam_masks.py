@@ -0,0 +1,188 @@
+"""
+Produce Recognition System - SAM Mask Precomputation Script
+This script runs SAM once per dataset image and stores the largest mask
+in a compact on-disk store keyed by image content hash, so training can
+read masks instead of running SAM on every sample of every epoch.
+"""
+
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+INDEX_FILE = "index.json"
+DATA_FILE = "masks.bin"
+
+
+def hash_image_bytes(data: bytes) -> str:
+    """Content hash used to key images across stores"""
+    return hashlib.sha1(data).hexdigest()
+
+
+class MaskStore:
+    """Bit-packed segmentation masks in a memory-mapped file plus a JSON index"""
+
+    def __init__(self, store_dir: str, readonly: bool = True):
+        """
+        Args:
+            store_dir: Directory holding the mask data file and index
+            readonly: Open for reading only (training) or for appending (precompute)
+        """
+        self.store_dir = store_dir
+        self.readonly = readonly
+        self.data_path = os.path.join(store_dir, DATA_FILE)
+        self.index_path = os.path.join(store_dir, INDEX_FILE)
+
+        self.index: Dict[str, Tuple[int, int, int]] = {}
+        self.data_size = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                saved = json.load(f)
+            self.index = {k: tuple(v) for k, v in saved["masks"].items()}
+            self.data_size = saved["data_size"]
+
+        self._data = None
+        self._writer = None
+        if not readonly:
+            os.makedirs(store_dir, exist_ok=True)
+            # Drop bytes appended after the last committed index (interrupted run)
+            mode = "r+b" if os.path.exists(self.data_path) else "w+b"
+            self._writer = open(self.data_path, mode)
+            self._writer.truncate(self.data_size)
+            self._writer.seek(self.data_size)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def __getstate__(self):
+        # Each DataLoader worker maps the file itself instead of receiving a copy
+        state = self.__dict__.copy()
+        state["_data"] = None
+        state["_writer"] = None
+        return state
+
+    def _mapped(self) -> np.ndarray:
+        if self._data is None:
+            self._data = np.memmap(self.data_path, dtype=np.uint8, mode="r",
+                                   shape=(self.data_size,))
+        return self._data
+
+    def get_packed(self, key: str) -> Optional[Tuple[np.ndarray, Tuple[int, int]]]:
+        """Return a zero-copy view of the packed mask bits and the mask shape"""
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        offset, height, width = entry
+        nbytes = (height * width + 7) // 8
+        return self._mapped()[offset:offset + nbytes], (height, width)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return the boolean mask for an image hash, or None if not stored"""
+        packed = self.get_packed(key)
+        if packed is None:
+            return None
+        bits, (height, width) = packed
+        return np.unpackbits(bits, count=height * width).reshape(height, width).astype(bool)
+
+    def put(self, key: str, mask: np.ndarray):
+        """Append a boolean mask for an image hash"""
+        if self._writer is None:
+            raise RuntimeError("MaskStore was opened read-only")
+        height, width = mask.shape
+        packed = np.packbits(mask.astype(bool).ravel())
+        self._writer.write(packed.tobytes())
+        self.index[key] = (self.data_size, height, width)
+        self.data_size += packed.nbytes
+        self._data = None
+
+    def commit(self):
+        """Flush mask data and atomically rewrite the index"""
+        if self._writer is None:
+            return
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"data_size": self.data_size,
+                       "masks": {k: list(v) for k, v in self.index.items()}}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        """Commit pending masks and release file handles"""
+        if self._writer is not None:
+            self.commit()
+            self._writer.close()
+            self._writer = None
+        self._data = None
+
+
+def largest_mask(mask_generator, image_np: np.ndarray) -> Optional[np.ndarray]:
+    """Run SAM on an RGB image and return the largest mask"""
+    masks = mask_generator.generate(image_np)
+    if len(masks) == 0:
+        return None
+    # Use the largest mask as the primary produce item
+    return max(masks, key=lambda x: x['area'])['segmentation']
+
+
+def main(args):
+    """Precompute SAM masks for every split of the dataset"""
+    import io
+    from PIL import Image
+    from train_produce_model import ProduceDataset, load_sam_model
+
+    print("Loading SAM model for segmentation...")
+    mask_generator = load_sam_model(args.sam_model_type, args.sam_checkpoint)
+
+    store = MaskStore(args.store_dir, readonly=False)
+    print(f"Mask store at {args.store_dir} holds {len(store)} masks")
+
+    try:
+        for split in args.splits:
+            dataset = ProduceDataset(data_dir=args.data_dir, split=split, manifest_dir=args.manifest_dir)
+            done = 0
+            skipped = 0
+            for img_path in dataset.samples:
+                with open(img_path, "rb") as f:
+                    data = f.read()
+                key = hash_image_bytes(data)
+                if key in store:
+                    skipped += 1
+                    continue
+
+                image_np = np.array(Image.open(io.BytesIO(data)).convert('RGB'))
+                mask = largest_mask(mask_generator, image_np)
+                if mask is None:
+                    # Store an empty mask so the image is not retried
+                    mask = np.zeros(image_np.shape[:2], dtype=bool)
+                store.put(key, mask)
+                done += 1
+
+                if done % args.commit_every == 0:
+                    store.commit()
+                    print(f"[{split}] {done} masks generated, {skipped} already stored")
+
+            store.commit()
+            print(f"[{split}] finished: {done} masks generated, {skipped} already stored")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute SAM masks for produce dataset")
+    parser.add_argument("--data_dir", type=str, required=True, help="Path to dataset directory")
+    parser.add_argument("--store_dir", type=str, required=True, help="Output directory for the mask store")
+    parser.add_argument("--sam_checkpoint", type=str, required=True, help="Path to SAM checkpoint")
+    parser.add_argument("--sam_model_type", type=str, default="vit_h", help="SAM model type")
+    parser.add_argument("--splits", type=str, nargs="+", default=["train", "val"], help="Dataset splits to process")
+    parser.add_argument("--manifest_dir", type=str, default=None, help="Directory of dataset manifests (see dataset_manifest.py)")
+    parser.add_argument("--commit_every", type=int, default=100, help="Commit the index every N new masks")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,223 @@
+"""
+Produce Recognition System - Structured Pruning Script
+This script removes the least important hidden channels of the MLP in every
+ConvNeXt block, which holds most of the model's FLOPs, and rebuilds the layers
+as smaller dense Linear layers. A short fine-tuning pass recovers accuracy.
+The pruned checkpoint records the new widths so every loader can rebuild it,
+and the report compares FLOPs, parameters, CPU latency and accuracy before
+and after.
+"""
+
+import os
+import json
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from backbones import BACKBONES, DEFAULT_ARCH, convnext_mlps, mlp_hidden_dims
+from compact_checkpoint import load_checkpoint
+
+
+def channel_importance(fc1: nn.Linear, fc2: nn.Linear) -> torch.Tensor:
+    """Importance of each hidden channel: norm of its input weights times norm of its output weights"""
+    return fc1.weight.detach().norm(dim=1) * fc2.weight.detach().norm(dim=0)
+
+
+def prune_mlp_channels(model: nn.Module, keep_ratio: float, round_to: int = 8) -> List[int]:
+    """
+    Keep the most important keep_ratio of the hidden channels of every ConvNeXt block MLP
+
+    Widths are rounded to a multiple of round_to for efficient kernels.
+    Returns the new hidden widths.
+    """
+    mlps = list(convnext_mlps(model))
+    if not mlps:
+        raise ValueError("Structured pruning supports ConvNeXt backbones only")
+
+    for block, fc1_idx, fc2_idx in mlps:
+        fc1, fc2 = block[fc1_idx], block[fc2_idx]
+        hidden = fc1.out_features
+        keep = min(hidden, max(round_to, int(round(hidden * keep_ratio / round_to)) * round_to))
+        # Keep channels in their original order
+        kept = channel_importance(fc1, fc2).topk(keep).indices.sort().values
+
+        new_fc1 = nn.Linear(fc1.in_features, keep).to(fc1.weight.device)
+        new_fc2 = nn.Linear(keep, fc2.out_features).to(fc2.weight.device)
+        with torch.no_grad():
+            new_fc1.weight.copy_(fc1.weight[kept])
+            new_fc1.bias.copy_(fc1.bias[kept])
+            new_fc2.weight.copy_(fc2.weight[:, kept])
+            new_fc2.bias.copy_(fc2.bias)
+        block[fc1_idx] = new_fc1
+        block[fc2_idx] = new_fc2
+
+    return mlp_hidden_dims(model)
+
+
+def count_macs(model: nn.Module, input_shape: Tuple[int, ...] = (1, 3, 224, 224)) -> int:
+    """Multiply-accumulates of one forward pass through the Conv2d and Linear layers"""
+    macs = 0
+
+    def conv_hook(module, inputs, output):
+        nonlocal macs
+        kernel = module.kernel_size[0] * module.kernel_size[1]
+        macs += output.numel() * (module.in_channels // module.groups) * kernel
+
+    def linear_hook(module, inputs, output):
+        nonlocal macs
+        macs += output.numel() * module.in_features
+
+    handles = []
+    for module in model.modules():
+        if isinstance(module, nn.Conv2d):
+            handles.append(module.register_forward_hook(conv_hook))
+        elif isinstance(module, nn.Linear):
+            handles.append(module.register_forward_hook(linear_hook))
+
+    was_training = model.training
+    model.eval()
+    with torch.inference_mode():
+        model(torch.zeros(input_shape, device=next(model.parameters()).device))
+    model.train(was_training)
+    for handle in handles:
+        handle.remove()
+
+    return macs
+
+
+def model_stats(model: nn.Module, input_shape: Tuple[int, ...] = (1, 3, 224, 224),
+                runs: int = 20) -> Dict[str, float]:
+    """GMACs, parameter count and batch-1 CPU latency of a model"""
+    import copy
+    from benchmark_pipeline import time_calls
+
+    cpu_model = copy.deepcopy(model).cpu().eval()
+    inputs = [torch.randn(input_shape) for _ in range(runs)]
+    with torch.inference_mode():
+        timing = time_calls(cpu_model, inputs, warmup=3)
+
+    return {
+        "gmacs": count_macs(cpu_model, input_shape) / 1e9,
+        "params_m": sum(p.numel() for p in cpu_model.parameters()) / 1e6,
+        "latency_p50_ms": timing["p50_ms"],
+        "latency_p99_ms": timing["p99_ms"],
+    }
+
+
+def recover(model: nn.Module, data_dir: str, epochs: int, device,
+            learning_rate: float = 5e-5, batch_size: int = 32, num_workers: int = 4,
+            shard_dir: Optional[str] = None, manifest_dir: Optional[str] = None) -> Tuple[float, List[float]]:
+    """Fine-tune a pruned model for a few epochs; returns the accuracy before and after each epoch"""
+    from torch.utils.data import DataLoader
+    from train_produce_model import (ProduceDataset, build_train_transform, build_val_transform,
+                                     train_one_epoch, validate)
+
+    train_dataset = ProduceDataset(data_dir=data_dir, transform=build_train_transform(), split="train",
+                                   shard_dir=shard_dir, manifest_dir=manifest_dir)
+    val_dataset = ProduceDataset(data_dir=data_dir, transform=build_val_transform(), split="val",
+                                 shard_dir=shard_dir, manifest_dir=manifest_dir)
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True,
+                              num_workers=num_workers, pin_memory=device.type == "cuda")
+    val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False,
+                            num_workers=num_workers, pin_memory=device.type == "cuda")
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.AdamW(model.parameters(), lr=learning_rate, weight_decay=1e-4)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=max(1, epochs), eta_min=learning_rate / 10)
+
+    _, pruned_acc = validate(model, val_loader, criterion, device)
+    print(f"Pruned model before recovery: Val Acc {pruned_acc:.2f}%")
+
+    history = []
+    for epoch in range(1, epochs + 1):
+        train_loss, train_acc = train_one_epoch(model, train_loader, criterion, optimizer, device)
+        val_loss, val_acc = validate(model, val_loader, criterion, device)
+        scheduler.step()
+        history.append(val_acc)
+        print(f"Recovery epoch {epoch}/{epochs}: Train Loss {train_loss:.4f}, Val Acc {val_acc:.2f}%")
+
+    model.eval()
+    return pruned_acc, history
+
+
+def prune_and_recover(model: nn.Module, keep_ratio: float, device, data_dir: Optional[str] = None,
+                      epochs: int = 2, **recover_kwargs) -> Tuple[nn.Module, Dict[str, Any]]:
+    """Prune a model in place, fine-tune it if a dataset is given, and report the savings"""
+    print("Measuring the unpruned model...")
+    before = model_stats(model)
+
+    hidden_dims = prune_mlp_channels(model, keep_ratio)
+    model.to(device)
+
+    report: Dict[str, Any] = {"keep_ratio": keep_ratio, "mlp_hidden_dims": hidden_dims, "before": before}
+    if data_dir and epochs > 0:
+        pruned_acc, history = recover(model, data_dir, epochs, device, **recover_kwargs)
+        report["pruned_val_acc"] = pruned_acc
+        report["recovery_val_acc"] = history
+
+    print("Measuring the pruned model...")
+    report["after"] = model_stats(model)
+    after = report["after"]
+    print(f"GMACs {before['gmacs']:.2f} -> {after['gmacs']:.2f}, "
+          f"params {before['params_m']:.1f}M -> {after['params_m']:.1f}M, "
+          f"p50 latency {before['latency_p50_ms']:.1f} -> {after['latency_p50_ms']:.1f} ms")
+
+    return model, report
+
+
+def main(args):
+    """Prune a trained checkpoint and save the smaller model"""
+    from train_produce_model import build_model
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    checkpoint = load_checkpoint(args.checkpoint)
+    arch = checkpoint.get('arch', DEFAULT_ARCH)
+    if BACKBONES[arch]["family"] != "convnext":
+        raise ValueError(f"Structured pruning supports ConvNeXt backbones only, not {arch}")
+
+    model = build_model(num_classes=len(checkpoint['class_to_idx']), pretrained=False, arch=arch,
+                        mlp_hidden_dims=checkpoint.get('mlp_hidden_dims'))
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model.to(device)
+
+    model, report = prune_and_recover(
+        model, args.keep_ratio, device, data_dir=args.data_dir, epochs=args.epochs,
+        learning_rate=args.learning_rate, batch_size=args.batch_size, num_workers=args.num_workers,
+        shard_dir=args.shard_dir, manifest_dir=args.manifest_dir
+    )
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    torch.save({
+        'arch': arch,
+        'mlp_hidden_dims': report["mlp_hidden_dims"],
+        'model_state_dict': model.state_dict(),
+        'class_to_idx': checkpoint['class_to_idx'],
+        'val_acc': report["recovery_val_acc"][-1] if report.get("recovery_val_acc") else None,
+    }, args.output)
+    print(f"Pruned model saved to {args.output}")
+
+    report_path = os.path.splitext(args.output)[0] + "_pruning_report.json"
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Pruning report written to {report_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Structured channel pruning for ConvNeXt produce models")
+    parser.add_argument("--checkpoint", type=str, required=True, help="Trained checkpoint (best_model.pth or .weights)")
+    parser.add_argument("--output", type=str, required=True, help="Output path of the pruned checkpoint")
+    parser.add_argument("--keep_ratio", type=float, default=0.5, help="Fraction of MLP hidden channels kept in every block")
+    parser.add_argument("--data_dir", type=str, default=None, help="Dataset for the recovery fine-tuning (skipped if not given)")
+    parser.add_argument("--epochs", type=int, default=2, help="Recovery fine-tuning epochs")
+    parser.add_argument("--learning_rate", type=float, default=5e-5, help="Recovery learning rate")
+    parser.add_argument("--batch_size", type=int, default=32, help="Batch size")
+    parser.add_argument("--num_workers", type=int, default=4, help="Number of workers for data loading")
+    parser.add_argument("--shard_dir", type=str, default=None, help="Directory of shards built with build_dataset_shards.py")
+    parser.add_argument("--manifest_dir", type=str, default=None, help="Directory of dataset manifests (see dataset_manifest.py)")
+
+    args = parser.parse_args()
+
+    main(args)
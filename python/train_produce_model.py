@@ -6,23 +6,39 @@ and integrates with SAM for segmentation.
 """
 
 import os
+import json
+import math
+import time
 import random
 import argparse
 import numpy as np
 from pathlib import Path
+from contextlib import nullcontext
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
 from typing import Dict, List, Tuple, Optional
 
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, Dataset
+import torch.nn.functional as F
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Dataset, Subset
+from torch.utils.data.distributed import DistributedSampler
 import torchvision.transforms as transforms
-from torchvision.models import convnext_large, ConvNeXt_Large_Weights
 
 from segment_anything import SamAutomaticMaskGenerator, sam_model_registry
 from segment_anything.utils.transforms import ResizeLongestSide
 
+from precompute_sam_masks import MaskStore, hash_image_bytes
+from compact_checkpoint import load_checkpoint, save_compact_checkpoint
+from build_dataset_shards import ShardStore
+from dataset_manifest import update_manifest, manifest_path_for
+from backbones import (BACKBONES, DEFAULT_ARCH, build_backbone, head_prefix, pooled_features,
+                       feature_dim as backbone_feature_dim)
+
 # Set random seeds for reproducibility
 SEED = 42
 random.seed(SEED)
@@ -32,6 +48,10 @@ if torch.cuda.is_available():
     torch.cuda.manual_seed(SEED)
     torch.backends.cudnn.deterministic = True
 
+# ImageNet normalization used by the pretrained ConvNeXt weights
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
 class ProduceDataset(Dataset):
     """Dataset for produce images with segmentation masks"""
     
@@ -39,24 +59,44 @@ class ProduceDataset(Dataset):
                  data_dir: str, 
                  transform=None, 
                  sam_model=None,
-                 split: str = "train"):
+                 split: str = "train",
+                 mask_store: Optional[MaskStore] = None,
+                 shard_dir: Optional[str] = None,
+                 manifest_dir: Optional[str] = None):
         """
         Args:
             data_dir: Directory with produce images and annotations
             transform: Optional transform to be applied on images
             sam_model: SAM model for segmentation
             split: Dataset split (train, val, test)
+            mask_store: Precomputed SAM masks, used instead of running sam_model
+            shard_dir: Pre-resized shards built with build_dataset_shards.py,
+                read instead of decoding the JPEGs in data_dir
+            manifest_dir: Directory of persisted split manifests, used instead
+                of globbing the split; corrupt and duplicate files are skipped
         """
         self.data_dir = Path(data_dir)
         self.transform = transform
         self.sam_model = sam_model
+        self.mask_store = mask_store
         
-        # Get all image paths
-        self.samples = list((self.data_dir / split).glob('*/*.jpg'))
-        
-        # Map class names to indices
-        self.classes = sorted([d.name for d in (self.data_dir / split).iterdir() 
-                              if d.is_dir()])
+        self.shards = None
+        if shard_dir:
+            self.shards = ShardStore(os.path.join(shard_dir, split))
+            self.samples = list(range(len(self.shards)))
+            self.classes = self.shards.classes
+        elif manifest_dir:
+            split_dir = self.data_dir / split
+            manifest = update_manifest(split_dir, manifest_path_for(manifest_dir, split))
+            self.samples = manifest.samples(split_dir)
+            self.classes = manifest.classes
+        else:
+            # Get all image paths
+            self.samples = list((self.data_dir / split).glob('*/*.jpg'))
+            
+            # Map class names to indices
+            self.classes = sorted([d.name for d in (self.data_dir / split).iterdir() 
+                                  if d.is_dir()])
         self.class_to_idx = {cls_name: i for i, cls_name in enumerate(self.classes)}
         
         # SAM transform for preprocessing
@@ -66,18 +106,46 @@ class ProduceDataset(Dataset):
     def __len__(self):
         return len(self.samples)
     
+    def sample_key(self, idx) -> str:
+        """Stable identifier of a sample that does not depend on its label"""
+        if self.shards is not None:
+            return self.shards.hashes[idx].decode()
+        return str(self.samples[idx].relative_to(self.data_dir))
+    
+    def sample_label(self, idx) -> int:
+        """Class index of a sample without loading the image"""
+        if self.shards is not None:
+            return int(self.shards.labels[idx])
+        return self.class_to_idx[self.samples[idx].parent.name]
+    
     def __getitem__(self, idx):
-        img_path = self.samples[idx]
-        class_name = img_path.parent.name
-        label = self.class_to_idx[class_name]
-        
-        # Load image
         from PIL import Image
-        image = Image.open(img_path).convert('RGB')
+        mask = None
+        
+        if self.shards is not None:
+            # Already decoded and resized; wrap the memory-mapped pixels
+            image = Image.fromarray(self.shards.get_image(idx))
+            label = int(self.shards.labels[idx])
+            if self.mask_store is not None:
+                mask = self.mask_store.get(self.shards.hashes[idx].decode())
+        else:
+            img_path = self.samples[idx]
+            class_name = img_path.parent.name
+            label = self.class_to_idx[class_name]
+            
+            # Load image
+            if self.mask_store is not None:
+                # Read the file once for both the content hash and decoding
+                import io
+                with open(img_path, 'rb') as f:
+                    data = f.read()
+                image = Image.open(io.BytesIO(data)).convert('RGB')
+                mask = self.mask_store.get(hash_image_bytes(data))
+            else:
+                image = Image.open(img_path).convert('RGB')
         
         # Generate mask using SAM if available
-        mask = None
-        if self.sam_model:
+        if self.sam_model and self.mask_store is None:
             # Convert PIL image to numpy array
             image_np = np.array(image)
             
@@ -112,69 +180,262 @@ class ProduceDataset(Dataset):
         
         return image, label, mask if mask is not None else torch.zeros(1)
 
-def build_model(num_classes: int, pretrained: bool = True) -> nn.Module:
-    """Build ConvNeXt-Large model with custom classifier head"""
-    if pretrained:
-        model = convnext_large(weights=ConvNeXt_Large_Weights.DEFAULT)
-    else:
-        model = convnext_large(weights=None)
+def build_train_transform(batch_augment: bool = False):
+    """Training transforms; with batch_augment, workers only crop and the rest runs in BatchAugmentation"""
+    if batch_augment:
+        return transforms.Compose([
+            transforms.RandomResizedCrop(224),
+            transforms.PILToTensor()
+        ])
+    
+    return transforms.Compose([
+        transforms.RandomResizedCrop(224),
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomRotation(15),
+        transforms.ColorJitter(brightness=0.1, contrast=0.1, saturation=0.1),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+    ])
+
+def build_val_transform(resolution: int = 224):
+    """Deterministic validation transforms (resize to 8/7 of the crop, center crop)"""
+    return transforms.Compose([
+        transforms.Resize(resolution * 256 // 224),
+        transforms.CenterCrop(resolution),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+    ])
+
+class BatchAugmentation(nn.Module):
+    """Flip, rotation, color jitter and normalization applied to collated uint8 batches"""
+    
+    def __init__(self, 
+                 degrees: float = 15.0, 
+                 brightness: float = 0.1, 
+                 contrast: float = 0.1, 
+                 saturation: float = 0.1):
+        """
+        Args:
+            degrees: Maximum absolute rotation angle, as in RandomRotation
+            brightness: Brightness jitter amount, as in ColorJitter
+            contrast: Contrast jitter amount, as in ColorJitter
+            saturation: Saturation jitter amount, as in ColorJitter
+        """
+        super().__init__()
+        self.degrees = degrees
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.register_buffer('mean', torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1))
+        self.register_buffer('std', torch.tensor(IMAGENET_STD).view(1, 3, 1, 1))
+        self.register_buffer('gray_weights', torch.tensor([0.299, 0.587, 0.114]).view(1, 3, 1, 1))
+    
+    def _uniform(self, n: int, low: float, high: float, device) -> torch.Tensor:
+        return torch.empty(n, 1, 1, 1, device=device).uniform_(low, high)
+    
+    def _grayscale(self, x: torch.Tensor) -> torch.Tensor:
+        return (x * self.gray_weights).sum(dim=1, keepdim=True)
+    
+    @torch.no_grad()
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        n = images.shape[0]
+        x = images.float().div_(255)
+        
+        # Horizontal flip for a random half of the batch
+        flip = torch.rand(n, device=x.device) < 0.5
+        x = torch.where(flip.view(n, 1, 1, 1), x.flip(-1), x)
+        
+        # Per-sample rotation through a single batched affine grid
+        angles = torch.empty(n, device=x.device).uniform_(-self.degrees, self.degrees) * (math.pi / 180)
+        theta = torch.zeros(n, 2, 3, device=x.device)
+        theta[:, 0, 0] = angles.cos()
+        theta[:, 0, 1] = -angles.sin()
+        theta[:, 1, 0] = angles.sin()
+        theta[:, 1, 1] = angles.cos()
+        grid = F.affine_grid(theta, list(x.shape), align_corners=False)
+        x = F.grid_sample(x, grid, mode='nearest', padding_mode='zeros', align_corners=False)
+        
+        # Color jitter with per-sample factors
+        if self.brightness:
+            x = (x * self._uniform(n, 1 - self.brightness, 1 + self.brightness, x.device)).clamp_(0, 1)
+        if self.contrast:
+            factor = self._uniform(n, 1 - self.contrast, 1 + self.contrast, x.device)
+            mean = self._grayscale(x).mean(dim=(1, 2, 3), keepdim=True)
+            x = (factor * x + (1 - factor) * mean).clamp_(0, 1)
+        if self.saturation:
+            factor = self._uniform(n, 1 - self.saturation, 1 + self.saturation, x.device)
+            x = (factor * x + (1 - factor) * self._grayscale(x)).clamp_(0, 1)
+        
+        return (x - self.mean) / self.std
+
+def build_model(num_classes: int, pretrained: bool = True, arch: str = DEFAULT_ARCH,
+                mlp_hidden_dims: Optional[List[int]] = None) -> nn.Module:
+    """Build a registered backbone (ConvNeXt-Large by default) with custom classifier head"""
+    return build_backbone(arch, num_classes, pretrained=pretrained, mlp_hidden_dims=mlp_hidden_dims)
+
+class StepTimer:
+    """Per-phase wall time of training steps, for measuring the input pipeline"""
+    
+    def __init__(self, device):
+        """
+        Args:
+            device: Training device; CUDA is synchronized at every phase boundary
+                so time is attributed to the phase that issued the work
+        """
+        self.device = device
+        self.totals = defaultdict(float)
+        self.steps = 0
+        self._last = None
+    
+    def start(self):
+        """Start timing the next step"""
+        self._last = time.perf_counter()
+    
+    def mark(self, phase: str):
+        """Attribute the time since the previous mark to a phase"""
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        now = time.perf_counter()
+        self.totals[phase] += now - self._last
+        self._last = now
+        if phase == "optimizer":
+            self.steps += 1
     
-    # Modify the classifier head
-    in_features = model.classifier[-1].in_features
-    model.classifier[-1] = nn.Linear(in_features, num_classes)
+    def summary(self) -> str:
+        """Average milliseconds per step for each phase"""
+        steps = max(self.steps, 1)
+        parts = [f"{phase} {1000 * t / steps:.1f}ms" for phase, t in self.totals.items()]
+        return f"Step time breakdown ({self.steps} steps): " + ", ".join(parts)
     
-    return model
+    def reset(self):
+        self.totals.clear()
+        self.steps = 0
 
-def train_one_epoch(model, dataloader, criterion, optimizer, device):
+def setup_distributed(backend: str = "gloo") -> Tuple[int, int, int]:
+    """Join the process group when launched by torchrun; returns (rank, world_size, local_rank)"""
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size <= 1:
+        return 0, 1, 0
+    dist.init_process_group(backend=backend)
+    return dist.get_rank(), world_size, int(os.environ.get("LOCAL_RANK", 0))
+
+def reduce_metrics(running_loss: torch.Tensor, correct: torch.Tensor, total: int,
+                   num_batches: int) -> Tuple[float, float]:
+    """Average loss and accuracy (%) over all processes with a single all-reduce"""
+    stats = torch.stack([
+        running_loss.detach().double(),
+        correct.double(),
+        torch.tensor(float(total), dtype=torch.float64, device=running_loss.device),
+        torch.tensor(float(num_batches), dtype=torch.float64, device=running_loss.device),
+    ]).cpu()
+    if dist.is_available() and dist.is_initialized():
+        dist.all_reduce(stats, op=dist.ReduceOp.SUM)
+    loss_sum, correct_sum, total_sum, batches_sum = stats.tolist()
+    return loss_sum / batches_sum, 100 * correct_sum / total_sum
+
+def train_one_epoch(model, dataloader, criterion, optimizer, device, batch_transform=None,
+                    log_interval: int = 0, timer: Optional[StepTimer] = None,
+                    amp_dtype: Optional[torch.dtype] = None, scaler=None,
+                    accumulation_steps: int = 1, channels_last: bool = False):
     """Train model for one epoch"""
     model.train()
-    running_loss = 0.0
-    correct = 0
+    # Metrics stay on the device; they are only read back at log points and epoch end
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
     total = 0
+    num_steps = len(dataloader)
     
-    for images, labels, _ in dataloader:
-        images, labels = images.to(device), labels.to(device)
+    optimizer.zero_grad(set_to_none=True)
+    if timer:
+        timer.start()
+    for step, (images, labels, _) in enumerate(dataloader, 1):
+        if timer:
+            timer.mark("data")
+        images = images.to(device, non_blocking=True)
+        labels = labels.to(device, non_blocking=True)
         
-        optimizer.zero_grad()
+        if batch_transform is not None:
+            images = batch_transform(images)
+        if channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+        if timer:
+            timer.mark("transfer")
         
-        outputs = model(images)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
+        # Average gradients over the micro-batches of one optimizer step
+        group_start = (step - 1) // accumulation_steps * accumulation_steps
+        group_size = min(accumulation_steps, num_steps - group_start)
+        is_update_step = step - group_start == group_size
         
-        running_loss += loss.item()
+        # Under DDP, only the last micro-batch of a group all-reduces gradients
+        sync_context = nullcontext()
+        if isinstance(model, DistributedDataParallel) and not is_update_step:
+            sync_context = model.no_sync()
+        
+        with sync_context:
+            with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=amp_dtype is not None):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
+            if timer:
+                timer.mark("forward")
+            
+            if scaler is not None:
+                scaler.scale(loss / group_size).backward()
+            else:
+                (loss / group_size).backward()
+        if timer:
+            timer.mark("backward")
+        
+        if is_update_step:
+            if scaler is not None:
+                scaler.step(optimizer)
+                scaler.update()
+            else:
+                optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+        if timer:
+            timer.mark("optimizer")
+        
+        running_loss += loss.detach().float()
         
         _, predicted = outputs.max(1)
         total += labels.size(0)
-        correct += predicted.eq(labels).sum().item()
+        correct += predicted.eq(labels).sum()
+        
+        if log_interval and step % log_interval == 0:
+            print(f"  Step {step}/{num_steps}: Loss: {running_loss.item() / step:.4f}, "
+                  f"Acc: {100 * correct.item() / total:.2f}%")
     
-    epoch_loss = running_loss / len(dataloader)
-    epoch_acc = 100 * correct / total
+    epoch_loss, epoch_acc = reduce_metrics(running_loss, correct, total, num_steps)
     
     return epoch_loss, epoch_acc
 
-def validate(model, dataloader, criterion, device):
+def validate(model, dataloader, criterion, device,
+             amp_dtype: Optional[torch.dtype] = None, channels_last: bool = False):
     """Validate model on validation set"""
     model.eval()
-    running_loss = 0.0
-    correct = 0
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
     total = 0
     
     with torch.no_grad():
         for images, labels, _ in dataloader:
-            images, labels = images.to(device), labels.to(device)
+            images = images.to(device, non_blocking=True)
+            labels = labels.to(device, non_blocking=True)
+            if channels_last:
+                images = images.contiguous(memory_format=torch.channels_last)
             
-            outputs = model(images)
-            loss = criterion(outputs, labels)
+            with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=amp_dtype is not None):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
             
-            running_loss += loss.item()
+            running_loss += loss.float()
             
             _, predicted = outputs.max(1)
             total += labels.size(0)
-            correct += predicted.eq(labels).sum().item()
+            correct += predicted.eq(labels).sum()
     
-    val_loss = running_loss / len(dataloader)
-    val_acc = 100 * correct / total
+    # Identical on every process, so all ranks agree on the best model
+    val_loss, val_acc = reduce_metrics(running_loss, correct, total, len(dataloader))
     
     return val_loss, val_acc
 
@@ -185,62 +446,356 @@ def load_sam_model(model_type: str, checkpoint_path: str):
     mask_generator = SamAutomaticMaskGenerator(sam)
     return mask_generator
 
+def _snapshot(obj):
+    """Deep copy of a (nested) state dict with every tensor copied to CPU"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_snapshot(v) for v in obj)
+    return obj
+
+class CheckpointWriter:
+    """Saves checkpoints on a background thread from a snapshot of the training state"""
+    
+    def __init__(self, max_pending: int = 4):
+        """
+        Args:
+            max_pending: Snapshots queued for writing before save() blocks
+        """
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = deque()
+        self.max_pending = max_pending
+    
+    def _write(self, state: Dict, path: str):
+        # Write to a temporary file and rename so a kill never leaves a torn checkpoint
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    
+    def _submit(self, fn, *args):
+        # Writes run in order on the single thread; bounding the queue keeps host memory bounded
+        while len(self._pending) >= self.max_pending:
+            self._pending.popleft().result()
+        self._pending.append(self._executor.submit(fn, *args))
+    
+    def wait(self):
+        """Block until every pending write finished, re-raising the first error"""
+        while self._pending:
+            self._pending.popleft().result()
+    
+    def save(self, state: Dict, path: str):
+        """Snapshot state now and write it to path in the background"""
+        self._submit(self._write, _snapshot(state), path)
+    
+    def save_weights(self, state_dict: Dict, metadata: Dict, path: str, half: bool = False):
+        """Snapshot model weights now and write a compact weights checkpoint in the background"""
+        self._submit(save_compact_checkpoint, path, _snapshot(state_dict), metadata, half)
+    
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+def rng_state() -> Dict:
+    """RNG state of every generator used during training"""
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def gather_rng_states() -> Optional[List[Dict]]:
+    """RNG states of all processes, indexed by rank, on rank 0 (None on other ranks)"""
+    if not (dist.is_available() and dist.is_initialized()):
+        return [rng_state()]
+    states = [None] * dist.get_world_size() if dist.get_rank() == 0 else None
+    dist.gather_object(rng_state(), states, dst=0)
+    return states
+
+def set_rng_state(state: Dict):
+    """Restore RNG state saved by rng_state"""
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def build_embedding_cache(model: nn.Module,
+                          dataset: ProduceDataset,
+                          cache_path: str,
+                          backbone_id: str,
+                          device,
+                          view_transforms: List,
+                          batch_size: int = 64,
+                          num_workers: int = 4,
+                          feature_fn=None,
+                          feature_dim: Optional[int] = None) -> np.ndarray:
+    """
+    Run the frozen backbone over a dataset and store pooled features
+    
+    Features are kept in a memory-mapped .npy file of shape (views, samples, dim)
+    next to a JSON file listing the sample keys. Rows of samples already present
+    in a cache built with the same backbone and views are reused, so only new
+    images go through the backbone. feature_fn/feature_dim cache other model
+    outputs instead, e.g. teacher logits for distillation.
+    """
+    keys = [dataset.sample_key(i) for i in range(len(dataset))]
+    views = len(view_transforms)
+    if feature_fn is None:
+        feature_fn = lambda images: pooled_features(model, images)
+        feature_dim = backbone_feature_dim(model)
+    meta_path = cache_path + ".json"
+    
+    old_features = None
+    old_rows = {}
+    if os.path.exists(meta_path) and os.path.exists(cache_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if meta["backbone"] == backbone_id and meta["views"] == views:
+            old_features = np.load(cache_path, mmap_mode="r")
+            old_rows = {key: row for row, key in enumerate(meta["keys"])}
+    
+    # Per-process name, so concurrent builds of the same cache do not share a temporary file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    features = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=np.float16, shape=(views, len(keys), feature_dim)
+    )
+    
+    reused = [(i, old_rows[key]) for i, key in enumerate(keys) if key in old_rows]
+    if reused:
+        new_idx, old_idx = (np.array(idx) for idx in zip(*reused))
+        features[:, new_idx] = old_features[:, old_idx]
+    missing = [i for i, key in enumerate(keys) if key not in old_rows]
+    print(f"Embedding cache {cache_path}: {len(reused)} reused, {len(missing)} to compute")
+    
+    model.eval()
+    original_transform = dataset.transform
+    with torch.no_grad():
+        for view, transform in enumerate(view_transforms):
+            if not missing:
+                break
+            dataset.transform = transform
+            loader = DataLoader(Subset(dataset, missing), batch_size=batch_size,
+                                shuffle=False, num_workers=num_workers)
+            offset = 0
+            for images, _, _ in loader:
+                batch_features = feature_fn(images.to(device))
+                rows = missing[offset:offset + len(images)]
+                features[view, rows] = batch_features.cpu().numpy().astype(np.float16)
+                offset += len(images)
+    dataset.transform = original_transform
+    
+    features.flush()
+    del features, old_features
+    os.replace(tmp_path, cache_path)
+    with open(meta_path, "w") as f:
+        json.dump({"backbone": backbone_id, "views": views, "keys": keys}, f)
+    
+    return np.load(cache_path, mmap_mode="r")
+
+def train_head(train_features: np.ndarray,
+               train_labels: torch.Tensor,
+               val_features: np.ndarray,
+               val_labels: torch.Tensor,
+               num_classes: int,
+               device,
+               epochs: int = 50,
+               learning_rate: float = 1e-3,
+               weight_decay: float = 1e-4,
+               batch_size: int = 256) -> Tuple[nn.Linear, float]:
+    """Train a linear classifier head on cached embeddings"""
+    # (views, samples, dim); a random stored view is drawn per sample every epoch
+    x_train = torch.from_numpy(np.ascontiguousarray(train_features)).float().to(device)
+    x_val = torch.from_numpy(np.ascontiguousarray(val_features[0])).float().to(device)
+    y_train, y_val = train_labels.to(device), val_labels.to(device)
+    views, num_samples, feature_dim = x_train.shape
+    
+    head = nn.Linear(feature_dim, num_classes).to(device)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.AdamW(head.parameters(), lr=learning_rate, weight_decay=weight_decay)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs, eta_min=1e-6)
+    
+    best_val_acc = 0.0
+    best_state = {k: v.clone() for k, v in head.state_dict().items()}
+    for epoch in range(1, epochs + 1):
+        head.train()
+        perm = torch.randperm(num_samples, device=device)
+        view_idx = torch.randint(views, (num_samples,), device=device)
+        for start in range(0, num_samples, batch_size):
+            idx = perm[start:start + batch_size]
+            optimizer.zero_grad()
+            loss = criterion(head(x_train[view_idx[idx], idx]), y_train[idx])
+            loss.backward()
+            optimizer.step()
+        scheduler.step()
+        
+        head.eval()
+        with torch.no_grad():
+            val_acc = 100 * head(x_val).argmax(1).eq(y_val).float().mean().item()
+        if val_acc > best_val_acc:
+            best_val_acc = val_acc
+            best_state = {k: v.clone() for k, v in head.state_dict().items()}
+        if epoch % 10 == 0 or epoch == epochs:
+            print(f"Head epoch {epoch}/{epochs}: Val Acc: {val_acc:.2f}%")
+    
+    head.load_state_dict(best_state)
+    return head, best_val_acc
+
+def train_head_only(args, device):
+    """Retrain only classifier[-1] on cached embeddings of a frozen backbone"""
+    train_dataset = ProduceDataset(data_dir=args.data_dir, split="train", shard_dir=args.shard_dir,
+                                   manifest_dir=args.manifest_dir)
+    val_dataset = ProduceDataset(data_dir=args.data_dir, split="val", shard_dir=args.shard_dir,
+                                 manifest_dir=args.manifest_dir)
+    num_classes = len(train_dataset.classes)
+    print(f"Head-only retraining for {num_classes} classes")
+    
+    # Backbone from a previous run, or ImageNet weights; the old head is discarded
+    arch = args.arch
+    checkpoint = None
+    hidden_dims = None
+    if args.base_checkpoint:
+        # .pth or compact .weights checkpoint
+        checkpoint = load_checkpoint(args.base_checkpoint)
+        arch = checkpoint.get('arch', DEFAULT_ARCH)
+        # Pruned checkpoints record the reduced MLP widths of their blocks
+        hidden_dims = checkpoint.get('mlp_hidden_dims')
+    model = build_model(num_classes=num_classes, pretrained=checkpoint is None, arch=arch,
+                        mlp_hidden_dims=hidden_dims)
+    backbone_id = f"{arch}@imagenet"
+    if checkpoint is not None:
+        state_dict = {k: v for k, v in checkpoint['model_state_dict'].items()
+                      if not k.startswith(head_prefix(model))}
+        model.load_state_dict(state_dict, strict=False)
+        backbone_id = f"{os.path.abspath(args.base_checkpoint)}@{os.path.getmtime(args.base_checkpoint)}"
+    model = model.to(device)
+    
+    cache_dir = args.cache_dir or os.path.join(args.output_dir, "embedding_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    
+    # View 0 is the fixed validation transform, extra views are stored augmentations
+    train_views = [build_val_transform()] + [build_train_transform()] * (args.cache_views - 1)
+    train_features = build_embedding_cache(
+        model, train_dataset, os.path.join(cache_dir, "train.npy"), backbone_id, device,
+        train_views, batch_size=args.batch_size, num_workers=args.num_workers
+    )
+    val_features = build_embedding_cache(
+        model, val_dataset, os.path.join(cache_dir, "val.npy"), backbone_id, device,
+        [build_val_transform()], batch_size=args.batch_size, num_workers=args.num_workers
+    )
+    
+    train_labels = torch.tensor([train_dataset.sample_label(i) for i in range(len(train_dataset))])
+    val_labels = torch.tensor([val_dataset.sample_label(i) for i in range(len(val_dataset))])
+    
+    head, best_val_acc = train_head(
+        train_features, train_labels, val_features, val_labels, num_classes, device,
+        epochs=args.head_epochs, learning_rate=args.head_learning_rate,
+        weight_decay=args.weight_decay
+    )
+    print(f"Best validation accuracy: {best_val_acc:.2f}%")
+    
+    model.classifier[-1] = head
+    torch.save({
+        'epoch': args.head_epochs,
+        'arch': arch,
+        'mlp_hidden_dims': hidden_dims,
+        'model_state_dict': model.state_dict(),
+        'val_acc': best_val_acc,
+        'class_to_idx': train_dataset.class_to_idx,
+    }, os.path.join(args.output_dir, 'head_model.pth'))
+    print(f"Model saved to {os.path.join(args.output_dir, 'head_model.pth')}")
+
 def main(args):
-    """Main training function"""
+    """
+    Main training function
+    
+    For data-parallel training, launch with torchrun, e.g.
+    torchrun --nproc_per_node=4 train_produce_model.py --data_dir ...
+    """
+    # Data-parallel training when launched with torchrun
+    rank, world_size, local_rank = setup_distributed(args.dist_backend)
+    distributed = world_size > 1
+    is_main_process = rank == 0
+    
     # Set device
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"Using device: {device}")
+    if torch.cuda.is_available():
+        device = torch.device("cuda", local_rank)
+        torch.cuda.set_device(device)
+    else:
+        device = torch.device("cpu")
+    print(f"Using device: {device}" + (f" (rank {rank}/{world_size})" if distributed else ""))
+    
+    if args.head_only:
+        train_head_only(args, device)
+        return
     
-    # Load SAM model
+    # Load SAM model, unless masks were precomputed with precompute_sam_masks.py
     sam_model = None
-    if args.use_sam and args.sam_checkpoint:
+    mask_store = None
+    if args.sam_mask_store:
+        mask_store = MaskStore(args.sam_mask_store)
+        print(f"Using precomputed SAM masks from {args.sam_mask_store} ({len(mask_store)} masks)")
+    elif args.use_sam and args.sam_checkpoint:
         print("Loading SAM model for segmentation...")
         sam_model = load_sam_model("vit_h", args.sam_checkpoint)
     
     # Data transforms
-    train_transform = transforms.Compose([
-        transforms.RandomResizedCrop(224),
-        transforms.RandomHorizontalFlip(),
-        transforms.RandomRotation(15),
-        transforms.ColorJitter(brightness=0.1, contrast=0.1, saturation=0.1),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
+    train_transform = build_train_transform(batch_augment=args.batch_augment)
+    val_transform = build_val_transform()
     
-    val_transform = transforms.Compose([
-        transforms.Resize(256),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
+    # Augmentations that run on whole batches after collation
+    batch_transform = None
+    if args.batch_augment:
+        batch_transform = BatchAugmentation().to(device)
     
     # Create datasets and dataloaders
     train_dataset = ProduceDataset(
         data_dir=args.data_dir, 
         transform=train_transform, 
         sam_model=sam_model,
-        split="train"
+        split="train",
+        mask_store=mask_store,
+        shard_dir=args.shard_dir,
+        manifest_dir=args.manifest_dir
     )
     
     val_dataset = ProduceDataset(
         data_dir=args.data_dir, 
         transform=val_transform, 
         sam_model=sam_model,
-        split="val"
+        split="val",
+        mask_store=mask_store,
+        shard_dir=args.shard_dir,
+        manifest_dir=args.manifest_dir
     )
     
+    # Each process sees a disjoint shard of every epoch
+    train_sampler = DistributedSampler(train_dataset, shuffle=True) if distributed else None
+    val_sampler = DistributedSampler(val_dataset, shuffle=False) if distributed else None
+    
     train_loader = DataLoader(
         train_dataset, 
         batch_size=args.batch_size, 
-        shuffle=True, 
-        num_workers=args.num_workers
+        shuffle=train_sampler is None, 
+        sampler=train_sampler, 
+        num_workers=args.num_workers,
+        pin_memory=device.type == "cuda"
     )
     
     val_loader = DataLoader(
         val_dataset, 
         batch_size=args.batch_size, 
         shuffle=False, 
-        num_workers=args.num_workers
+        sampler=val_sampler, 
+        num_workers=args.num_workers,
+        pin_memory=device.type == "cuda"
     )
     
     print(f"Number of training samples: {len(train_dataset)}")
@@ -248,8 +803,24 @@ def main(args):
     print(f"Number of classes: {len(train_dataset.classes)}")
     
     # Create model
-    model = build_model(num_classes=len(train_dataset.classes), pretrained=True)
+    model = build_model(num_classes=len(train_dataset.classes), pretrained=True, arch=args.arch)
     model = model.to(device)
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    
+    # Checkpoints store the unwrapped model so load_pytorch_model keeps working
+    base_model = model
+    if distributed:
+        model = DistributedDataParallel(model, device_ids=[device.index] if device.type == "cuda" else None)
+    
+    # Mixed precision: bf16 autocast on CPU, fp16 with loss scaling on CUDA
+    amp_dtype = None
+    scaler = None
+    if args.amp:
+        amp_dtype = torch.float16 if device.type == "cuda" else torch.bfloat16
+        if amp_dtype == torch.float16:
+            scaler = torch.cuda.amp.GradScaler()
+        print(f"Using autocast with {amp_dtype}")
     
     # Loss function and optimizer
     criterion = nn.CrossEntropyLoss()
@@ -258,19 +829,51 @@ def main(args):
     # Learning rate scheduler
     scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs, eta_min=1e-6)
     
+    # Optional per-step timing; it synchronizes the device, so leave it off for real runs
+    timer = StepTimer(device) if args.profile_steps else None
+    
     # Training loop
     best_val_acc = 0.0
+    val_acc = 0.0
+    start_epoch = 1
     
-    for epoch in range(1, args.epochs + 1):
+    # Resume an interrupted run from its last checkpoint
+    if args.resume:
+        # RNG states must stay CPU ByteTensors; load_state_dict moves model and optimizer tensors to the device
+        checkpoint = torch.load(args.resume, map_location="cpu", weights_only=False)
+        base_model.load_state_dict(checkpoint['model_state_dict'])
+        optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
+        if scaler is not None and checkpoint.get('scaler_state_dict'):
+            scaler.load_state_dict(checkpoint['scaler_state_dict'])
+        # Each rank continues its own random stream (older checkpoints only have rank 0's);
+        # ranks the checkpoint has no state for keep their own seeding
+        rng_states = checkpoint.get('rng_states') or [checkpoint['rng_state']]
+        if rank < len(rng_states):
+            set_rng_state(rng_states[rank])
+        start_epoch = checkpoint['epoch'] + 1
+        best_val_acc = checkpoint['best_val_acc']
+        val_acc = checkpoint['val_acc']
+        print(f"Resumed from {args.resume} at epoch {start_epoch}")
+    
+    checkpoint_writer = CheckpointWriter()
+    
+    for epoch in range(start_epoch, args.epochs + 1):
         print(f"Epoch {epoch}/{args.epochs}")
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
         
         # Train
         train_loss, train_acc = train_one_epoch(
-            model, train_loader, criterion, optimizer, device
+            model, train_loader, criterion, optimizer, device,
+            batch_transform=batch_transform, log_interval=args.log_interval, timer=timer,
+            amp_dtype=amp_dtype, scaler=scaler, accumulation_steps=args.accumulation_steps,
+            channels_last=args.channels_last
         )
         
         # Validate
-        val_loss, val_acc = validate(model, val_loader, criterion, device)
+        val_loss, val_acc = validate(model, val_loader, criterion, device,
+                                     amp_dtype=amp_dtype, channels_last=args.channels_last)
         
         # Update scheduler
         scheduler.step()
@@ -278,35 +881,74 @@ def main(args):
         # Print metrics
         print(f"Train Loss: {train_loss:.4f}, Train Acc: {train_acc:.2f}%")
         print(f"Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.2f}%")
+        if timer:
+            print(timer.summary())
+            timer.reset()
         
         # Save best model
         if val_acc > best_val_acc:
             best_val_acc = val_acc
-            torch.save({
+            if is_main_process:
+                # Weights only: resuming uses last_checkpoint.pth, which has the optimizer state
+                checkpoint_writer.save({
+                    'epoch': epoch,
+                    'arch': args.arch,
+                    'model_state_dict': base_model.state_dict(),
+                    'val_acc': val_acc,
+                    'class_to_idx': train_dataset.class_to_idx,
+                }, os.path.join(args.output_dir, 'best_model.pth'))
+                checkpoint_writer.save_weights(base_model.state_dict(), {
+                    'epoch': epoch,
+                    'arch': args.arch,
+                    'val_acc': val_acc,
+                    'class_to_idx': train_dataset.class_to_idx,
+                }, os.path.join(args.output_dir, 'best_model.weights'), half=args.weights_fp16)
+                print(f"New best model saved with validation accuracy: {val_acc:.2f}%")
+        
+        # Save everything needed to resume after this epoch (every rank takes part in the gather)
+        rng_states = gather_rng_states()
+        if is_main_process:
+            checkpoint_writer.save({
                 'epoch': epoch,
-                'model_state_dict': model.state_dict(),
+                'arch': args.arch,
+                'model_state_dict': base_model.state_dict(),
                 'optimizer_state_dict': optimizer.state_dict(),
+                'scheduler_state_dict': scheduler.state_dict(),
+                'scaler_state_dict': scaler.state_dict() if scaler is not None else None,
+                'rng_states': rng_states,
                 'val_acc': val_acc,
+                'best_val_acc': best_val_acc,
                 'class_to_idx': train_dataset.class_to_idx,
-            }, os.path.join(args.output_dir, 'best_model.pth'))
-            print(f"New best model saved with validation accuracy: {val_acc:.2f}%")
+            }, os.path.join(args.output_dir, 'last_checkpoint.pth'))
     
     print("Training completed!")
     print(f"Best validation accuracy: {best_val_acc:.2f}%")
     
     # Save final model
-    torch.save({
-        'epoch': args.epochs,
-        'model_state_dict': model.state_dict(),
-        'optimizer_state_dict': optimizer.state_dict(),
-        'val_acc': val_acc,
-        'class_to_idx': train_dataset.class_to_idx,
-    }, os.path.join(args.output_dir, 'final_model.pth'))
+    if is_main_process:
+        checkpoint_writer.save({
+            'epoch': args.epochs,
+            'arch': args.arch,
+            'model_state_dict': base_model.state_dict(),
+            'val_acc': val_acc,
+            'class_to_idx': train_dataset.class_to_idx,
+        }, os.path.join(args.output_dir, 'final_model.pth'))
+        checkpoint_writer.save_weights(base_model.state_dict(), {
+            'epoch': args.epochs,
+            'arch': args.arch,
+            'val_acc': val_acc,
+            'class_to_idx': train_dataset.class_to_idx,
+        }, os.path.join(args.output_dir, 'final_model.weights'), half=args.weights_fp16)
+    checkpoint_writer.close()
+    
+    if distributed:
+        dist.destroy_process_group()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Produce Recognition Training Script")
     parser.add_argument("--data_dir", type=str, required=True, help="Path to dataset directory")
     parser.add_argument("--output_dir", type=str, default="./output", help="Output directory for saved models")
+    parser.add_argument("--arch", type=str, default=DEFAULT_ARCH, choices=list(BACKBONES), help="Backbone architecture")
     parser.add_argument("--batch_size", type=int, default=16, help="Batch size")
     parser.add_argument("--epochs", type=int, default=20, help="Number of epochs")
     parser.add_argument("--learning_rate", type=float, default=1e-4, help="Learning rate")
@@ -314,8 +956,29 @@ if __name__ == "__main__":
     parser.add_argument("--num_workers", type=int, default=4, help="Number of workers for data loading")
     parser.add_argument("--use_sam", action="store_true", help="Whether to use SAM for segmentation")
     parser.add_argument("--sam_checkpoint", type=str, default=None, help="Path to SAM checkpoint")
+    parser.add_argument("--dist_backend", type=str, default="gloo", help="torch.distributed backend when launched with torchrun")
+    parser.add_argument("--resume", type=str, default=None, help="Resume training from a last_checkpoint.pth")
+    parser.add_argument("--amp", action="store_true", help="Mixed precision (bf16 on CPU, fp16 with grad scaling on CUDA)")
+    parser.add_argument("--channels_last", action="store_true", help="Use channels_last memory format for model and inputs")
+    parser.add_argument("--accumulation_steps", type=int, default=1, help="Micro-batches per optimizer step (effective batch = batch_size * N)")
+    parser.add_argument("--log_interval", type=int, default=0, help="Print running metrics every N steps (0: epoch end only)")
+    parser.add_argument("--profile_steps", action="store_true", help="Print a per-step timing breakdown every epoch")
+    parser.add_argument("--head_only", action="store_true", help="Train only the classifier head on cached backbone embeddings")
+    parser.add_argument("--base_checkpoint", type=str, default=None, help="Checkpoint whose backbone is reused in head-only mode")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Embedding cache directory (default: <output_dir>/embedding_cache)")
+    parser.add_argument("--cache_views", type=int, default=1, help="Stored views per training image (1 fixed + N-1 augmented)")
+    parser.add_argument("--head_epochs", type=int, default=50, help="Epochs for head-only training")
+    parser.add_argument("--head_learning_rate", type=float, default=1e-3, help="Learning rate for head-only training")
+    parser.add_argument("--batch_augment", action="store_true", help="Run flip/rotation/color jitter on collated batches instead of per image")
+    parser.add_argument("--manifest_dir", type=str, default=None, help="Directory of dataset manifests (see dataset_manifest.py)")
+    parser.add_argument("--shard_dir", type=str, default=None, help="Directory of shards built with build_dataset_shards.py")
+    parser.add_argument("--sam_mask_store", type=str, default=None, help="Directory of masks precomputed with precompute_sam_masks.py")
+    parser.add_argument("--weights_fp16", action="store_true", help="Store the compact best/final .weights checkpoints as fp16")
     
     args = parser.parse_args()
+    # Head-only training works on cached embeddings; every rank would rebuild and write the same files
+    if args.head_only and int(os.environ.get("WORLD_SIZE", 1)) > 1:
+        parser.error("--head_only runs in a single process, launch it without torchrun")
     
     # Create output directory if it doesn't exist
     os.makedirs(args.output_dir, exist_ok=True)